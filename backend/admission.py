@@ -0,0 +1,234 @@
+"""
+Контроль допуска запросов (ASGI middleware).
+
+Запросы делятся на классы со своими бюджетами: оформление заказов,
+админка и чтение каталога. Оформление упирается в единственного
+писателя SQLite; без ограничения во время распродажи запросы копятся
+в общем пуле потоков, и вместе с ними встают просмотр каталога и админка.
+
+У каждого класса в воркере:
+- concurrency - сколько запросов выполняется одновременно (сумма по
+  классам не больше пула потоков, поэтому класс не занимает чужие потоки);
+- rate/burst - token bucket на частоту допуска (0 - без ограничения);
+- latency_budget - сколько запрос может ждать допуска. Ожидание оценивается
+  по очереди и среднему времени обработки; если оно превысит бюджет,
+  запрос сразу получает 503 с Retry-After, а не висит до таймаута.
+
+Параметры переопределяются переменными окружения ADMISSION_<КЛАСС>_<ПАРАМЕТР>,
+например ADMISSION_CHECKOUT_CONCURRENCY=2; ADMISSION_CONTROL=0 отключает
+контроль целиком. Долгие запросы (SSE, long-poll) не ограничиваются.
+"""
+
+import asyncio
+import math
+import os
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from database import THREADPOOL_SIZE
+
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1") != "0"
+
+# Начальная оценка времени обработки, пока нет замеров, секунды
+INITIAL_SERVICE_TIME = 0.05
+
+
+def _setting(class_name: str, parameter: str, default: float) -> float:
+    return float(os.environ.get(f"ADMISSION_{class_name.upper()}_{parameter}", default))
+
+
+class Limiter:
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        latency_budget: float,
+        rate: float = 0,
+        burst: int = 1,
+    ):
+        self.name = name
+        self.concurrency = int(_setting(name, "CONCURRENCY", concurrency))
+        self.latency_budget = _setting(name, "BUDGET", latency_budget)
+        self.rate = _setting(name, "RATE", rate)
+        self.burst = _setting(name, "BURST", burst)
+        self.tokens = self.burst
+        self.refilled_at = monotonic()
+        self.service_time = INITIAL_SERVICE_TIME
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    def _token_delay(self, now: float) -> float:
+        """Через сколько будет доступен токен (0 - уже есть)."""
+        if not self.rate:
+            return 0.0
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.refilled_at) * self.rate
+        )
+        self.refilled_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> Optional[float]:
+        """
+        Ждет допуска в пределах бюджета. Возвращает None, если запрос
+        допущен (после него обязателен release), или Retry-After в секундах.
+        """
+        now = monotonic()
+        deadline = now + self.latency_budget
+        delay = self._token_delay(now)
+        expected = delay
+        if self.in_flight >= self.concurrency or self.waiters:
+            expected += (len(self.waiters) + 1) * self.service_time / self.concurrency
+        if expected > self.latency_budget:
+            self.rejected += 1
+            return expected
+
+        if self.rate:
+            # Токен резервируется сразу: следующий запрос увидит задержку больше
+            self.tokens -= 1
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self._refund_token()
+                raise
+
+        if self.in_flight < self.concurrency and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+
+        # Слот передается ожидающему в release() без уменьшения in_flight
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=max(0.0, deadline - monotonic()))
+        except BaseException:
+            # Клиент отключился во время ожидания
+            self._abandon(waiter)
+            raise
+        if waiter.done():
+            self.admitted += 1
+            return None
+        self._abandon(waiter)
+        self.rejected += 1
+        return self.service_time * (len(self.waiters) + 1) / self.concurrency
+
+    def _refund_token(self) -> None:
+        """Возвращает токен запроса, который так и не был обслужен."""
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        # Отказ по таймауту и отключение клиента: токен не израсходован
+        self._refund_token()
+        if waiter.done() and not waiter.cancelled():
+            # Слот уже передан - возвращаем его
+            self.release(None)
+            return
+        waiter.cancel()
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, elapsed: Optional[float]) -> None:
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "latency_budget": self.latency_budget,
+            "rate": self.rate or None,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "service_time_ms": round(self.service_time * 1000, 1),
+        }
+
+
+# Оформление - одна транзакция записи на запрос: больше нескольких
+# параллельных только удлиняет очередь к писателю SQLite
+_CHECKOUT_CONCURRENCY = 4
+_ADMIN_CONCURRENCY = 2
+
+LIMITERS = {
+    "checkout": Limiter(
+        "checkout",
+        concurrency=_CHECKOUT_CONCURRENCY,
+        latency_budget=2.0,
+        rate=50,
+        burst=20,
+    ),
+    "admin": Limiter("admin", concurrency=_ADMIN_CONCURRENCY, latency_budget=5.0),
+    "catalog": Limiter(
+        "catalog",
+        concurrency=max(
+            1, THREADPOOL_SIZE - _CHECKOUT_CONCURRENCY - _ADMIN_CONCURRENCY
+        ),
+        latency_budget=1.0,
+    ),
+}
+
+# (метод или None, префикс пути, класс или None - без ограничения);
+# выбирается первое совпадение
+ROUTES = [
+    ("POST", "/api/checkout", "checkout"),
+    ("GET", "/api/variants/availability/stream", None),
+    ("GET", "/api/admin/orders/events", None),
+    ("GET", "/api/admin/low-stock", None),
+    (None, "/api/admin", "admin"),
+    (None, "/api", "catalog"),
+]
+
+
+def get_limiter(method: str, path: str) -> Optional[Limiter]:
+    for route_method, prefix, class_name in ROUTES:
+        if (route_method is None or route_method == method) and path.startswith(prefix):
+            return LIMITERS[class_name] if class_name else None
+    return None
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if ADMISSION_CONTROL and scope["type"] == "http":
+            limiter = get_limiter(scope["method"], scope["path"])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = await limiter.acquire()
+        if retry_after is not None:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(monotonic() - started)
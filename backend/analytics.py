@@ -0,0 +1,316 @@
+"""
+Накопительные таблицы продаж (rollups) и отчеты по ним.
+Таблицы лежат в базе заказов, названия брендов и категорий читаются
+из базы каталога отдельными запросами.
+
+create_order и update_order_status обновляют таблицы в той же транзакции,
+что и сам заказ: отмена и возврат вычитают продажи заказа, возврат заказа
+в работу - добавляет снова. Отчеты читают только эти таблицы, поэтому их
+стоимость зависит от периода, а не от объема истории заказов.
+
+Пересчет по существующим заказам:
+    python analytics.py backfill
+"""
+
+import datetime as dt
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, desc, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+import models
+
+# Статусы, при которых заказ не учитывается в продажах
+EXCLUDED_STATUSES = (models.OrderStatus.CANCELLED, models.OrderStatus.REFUNDED)
+
+ROLLUP_MODELS = (
+    models.SalesDaily,
+    models.SalesDailyVariant,
+    models.SalesDailyBrand,
+    models.SalesDailyCategory,
+)
+
+
+class SaleLine(NamedTuple):
+    """Позиция заказа с данными, нужными для разрезов"""
+
+    variant_id: int
+    brand_id: Optional[int]
+    category_id: Optional[int]
+    quantity: int
+    total_price: Decimal
+
+
+def is_counted(status: models.OrderStatus) -> bool:
+    return status not in EXCLUDED_STATUSES
+
+
+def _upsert(db: Session, model, key: Dict[str, Any], orders, units, revenue) -> None:
+    stmt = insert(model).values(
+        **key, orders_count=orders, units=units, revenue=revenue
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={
+            "orders_count": model.orders_count + stmt.excluded.orders_count,
+            "units": model.units + stmt.excluded.units,
+            "revenue": model.revenue + stmt.excluded.revenue,
+        },
+    )
+    db.execute(stmt)
+
+
+def apply_order(
+    db: Session, day: dt.date, lines: Iterable[SaleLine], sign: int = 1
+) -> None:
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) продажи одного заказа.
+    Коммит остается за вызывающим кодом.
+    """
+    lines = list(lines)
+    if not lines:
+        return
+
+    # Заказ считается в каждом разрезе один раз, сколько бы позиций в нем ни было
+    groups = {
+        models.SalesDailyVariant: (
+            "variant_id",
+            defaultdict(lambda: [0, Decimal("0")]),
+        ),
+        models.SalesDailyBrand: ("brand_id", defaultdict(lambda: [0, Decimal("0")])),
+        models.SalesDailyCategory: (
+            "category_id",
+            defaultdict(lambda: [0, Decimal("0")]),
+        ),
+    }
+    for line in lines:
+        for key_name, totals in groups.values():
+            key_value = getattr(line, key_name)
+            if key_value is None:
+                continue
+            totals[key_value][0] += line.quantity
+            totals[key_value][1] += line.total_price
+
+    _upsert(
+        db,
+        models.SalesDaily,
+        {"day": day},
+        sign,
+        sign * sum(line.quantity for line in lines),
+        sign * sum(line.total_price for line in lines),
+    )
+    for model, (key_name, totals) in groups.items():
+        for key_value, (units, revenue) in totals.items():
+            _upsert(
+                db,
+                model,
+                {"day": day, key_name: key_value},
+                sign,
+                sign * units,
+                sign * revenue,
+            )
+
+
+# Ограничение числа параметров в одном IN
+_CHUNK_SIZE = 500
+
+
+def _get_variant_groups(
+    db: Session, variant_ids: Iterable[int]
+) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+    """
+    variant_id -> (brand_id, category_id). Каталог и заказы лежат в разных
+    базах, поэтому бренд и категория читаются отдельным запросом.
+    """
+    variant_ids = list(set(variant_ids))
+    groups = {}
+    for start in range(0, len(variant_ids), _CHUNK_SIZE):
+        rows = db.execute(
+            select(
+                models.ProductVariant.id,
+                models.Product.brand_id,
+                models.Product.category_id,
+            )
+            .join(models.Product, models.ProductVariant.product_id == models.Product.id)
+            .where(
+                models.ProductVariant.id.in_(variant_ids[start : start + _CHUNK_SIZE])
+            )
+        )
+        groups.update(
+            (variant_id, (brand_id, category_id))
+            for variant_id, brand_id, category_id in rows
+        )
+    return groups
+
+
+def _to_sale_lines(
+    db: Session, items: List[Tuple[int, int, Decimal]]
+) -> List[SaleLine]:
+    """(variant_id, quantity, total_price) -> SaleLine с брендом и категорией."""
+    groups = _get_variant_groups(db, (variant_id for variant_id, _, _ in items))
+    return [
+        SaleLine(
+            variant_id, *groups.get(variant_id, (None, None)), quantity, total_price
+        )
+        for variant_id, quantity, total_price in items
+    ]
+
+
+def get_order_lines(db: Session, order_id: int) -> List[SaleLine]:
+    """Позиции заказа с брендом и категорией товара."""
+    items = db.execute(
+        select(
+            models.OrderItem.variant_id,
+            models.OrderItem.quantity,
+            models.OrderItem.total_price,
+        ).where(models.OrderItem.order_id == order_id)
+    ).all()
+    return _to_sale_lines(db, items)
+
+
+def backfill(db: Session) -> int:
+    """
+    Пересчитывает все накопительные таблицы по истории заказов.
+    Возвращает количество учтенных заказов.
+    """
+    for model in ROLLUP_MODELS:
+        db.execute(delete(model))
+
+    stmt = (
+        select(
+            models.Order.id,
+            models.Order.created_at,
+            models.OrderItem.variant_id,
+            models.OrderItem.quantity,
+            models.OrderItem.total_price,
+        )
+        .join(models.OrderItem, models.OrderItem.order_id == models.Order.id)
+        .where(models.Order.status.not_in(EXCLUDED_STATUSES))
+        .order_by(models.Order.id)
+    )
+    rows = db.execute(stmt).all()
+    groups = _get_variant_groups(db, (row.variant_id for row in rows))
+
+    orders: Dict[int, Any] = {}
+    for order_id, created_at, variant_id, quantity, total_price in rows:
+        orders.setdefault(order_id, (created_at.date(), []))[1].append(
+            SaleLine(
+                variant_id, *groups.get(variant_id, (None, None)), quantity, total_price
+            )
+        )
+
+    for day, lines in orders.values():
+        apply_order(db, day, lines)
+
+    db.commit()
+    return len(orders)
+
+
+def _period(stmt, model, date_from: Optional[dt.date], date_to: Optional[dt.date]):
+    if date_from:
+        stmt = stmt.where(model.day >= date_from)
+    if date_to:
+        stmt = stmt.where(model.day <= date_to)
+    return stmt
+
+
+def _totals(model):
+    return (
+        func.sum(model.orders_count).label("orders_count"),
+        func.sum(model.units).label("units"),
+        func.sum(model.revenue).label("revenue"),
+    )
+
+
+def get_sales_by_day(
+    db: Session, date_from: Optional[dt.date] = None, date_to: Optional[dt.date] = None
+) -> List[Dict[str, Any]]:
+    model = models.SalesDaily
+    stmt = _period(
+        select(model.day, model.orders_count, model.units, model.revenue),
+        model,
+        date_from,
+        date_to,
+    ).order_by(model.day)
+    return [row._asdict() for row in db.execute(stmt)]
+
+
+def _with_names(db: Session, rows, key_name: str, name_model) -> List[Dict[str, Any]]:
+    """Добавляет названия из базы каталога к строкам отчета."""
+    rows = [row._asdict() for row in rows]
+    names = dict(
+        db.execute(
+            select(name_model.id, name_model.name).where(
+                name_model.id.in_([row[key_name] for row in rows])
+            )
+        ).all()
+    )
+    return [
+        {**row, "name": names[row[key_name]]} for row in rows if row[key_name] in names
+    ]
+
+
+def get_sales_by_brand(
+    db: Session, date_from: Optional[dt.date] = None, date_to: Optional[dt.date] = None
+) -> List[Dict[str, Any]]:
+    model = models.SalesDailyBrand
+    stmt = (
+        select(model.brand_id, *_totals(model))
+        .group_by(model.brand_id)
+        # Полностью отмененные продажи оставляют нулевые строки
+        .having(func.sum(model.orders_count) > 0)
+        .order_by(desc("revenue"))
+    )
+    rows = db.execute(_period(stmt, model, date_from, date_to))
+    return _with_names(db, rows, "brand_id", models.Brand)
+
+
+def get_sales_by_category(
+    db: Session, date_from: Optional[dt.date] = None, date_to: Optional[dt.date] = None
+) -> List[Dict[str, Any]]:
+    model = models.SalesDailyCategory
+    stmt = (
+        select(model.category_id, *_totals(model))
+        .group_by(model.category_id)
+        .having(func.sum(model.orders_count) > 0)
+        .order_by(desc("revenue"))
+    )
+    rows = db.execute(_period(stmt, model, date_from, date_to))
+    return _with_names(db, rows, "category_id", models.Category)
+
+
+def get_top_variants(
+    db: Session,
+    date_from: Optional[dt.date] = None,
+    date_to: Optional[dt.date] = None,
+    limit: int = 20,
+) -> List[Dict[str, Any]]:
+    model = models.SalesDailyVariant
+    stmt = (
+        select(model.variant_id, *_totals(model))
+        .group_by(model.variant_id)
+        .having(func.sum(model.orders_count) > 0)
+        .order_by(desc("revenue"))
+        .limit(limit)
+    )
+    return [
+        row._asdict() for row in db.execute(_period(stmt, model, date_from, date_to))
+    ]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import SessionLocal
+
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("Использование: python analytics.py backfill")
+
+    db = SessionLocal()
+    try:
+        print(f"✅ Пересчитано заказов: {backfill(db)}")
+    finally:
+        db.close()
@@ -0,0 +1,91 @@
+"""
+Наличие вариантов для частого опроса страницы товара
+(GET /api/variants/availability и поток SSE).
+
+Ответ - только id, остаток, статус и цена. Значения читаются из общего
+снимка каталога (snapshot.get_view), отдельной копии в каждом воркере
+нет; варианты товаров, измененных после снимка, и вариантов, которых в
+нем нет, - из базы. При изменении остатков, цены или статуса товара
+(пространство имён "products", в том числе из других воркеров через
+шину) канал "availability" будит потоки SSE.
+
+Поток SSE сверяется не с памятью воркера, а с журналом изменений
+каталога в базе (changefeed): после пробуждения он берет из журнала
+изменившиеся наблюдаемые варианты и читает их из базы
+(load_availability), поэтому видит изменения любого воркера, даже если
+шина еще не сбросила их в этом.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import cache
+import events
+import models
+import snapshot
+
+channel = events.get_channel("availability")
+
+
+def _load_rows(db: Session, variant_ids: List[int]):
+    return db.execute(
+        select(
+            models.ProductVariant.id,
+            models.ProductVariant.product_id,
+            models.ProductVariant.stock,
+            models.ProductVariant.status,
+            models.ProductVariant.price,
+        ).where(models.ProductVariant.id.in_(variant_ids))
+    ).all()
+
+
+def _to_item(row) -> Dict:
+    return {
+        "id": row.id,
+        "stock": row.stock,
+        "status": row.status,
+        "price": float(row.price),
+    }
+
+
+def load_availability(db: Session, variant_ids: List[int]) -> List[Dict]:
+    """Наличие вариантов прямо из базы, минуя снимок, в порядке id."""
+    items = {row.id: _to_item(row) for row in _load_rows(db, variant_ids)}
+    return [items[variant_id] for variant_id in variant_ids if variant_id in items]
+
+
+def get_availability(
+    db: Session, variant_ids: List[int]
+) -> Tuple[List[Dict], List[int]]:
+    """
+    Returns:
+        (наличие вариантов в порядке запроса без повторов, id ненайденных)
+    """
+    unique_ids = list(dict.fromkeys(variant_ids))
+    found = {}
+    to_load = unique_ids
+    view = snapshot.get_view(db)
+    if view is not None:
+        to_load = []
+        for variant_id in unique_ids:
+            row = view.snapshot.get_variant(variant_id)
+            if row is None or row.product_id in view.changed:
+                to_load.append(variant_id)
+            else:
+                found[variant_id] = _to_item(row)
+
+    if to_load:
+        found.update((row.id, _to_item(row)) for row in _load_rows(db, to_load))
+
+    items = [found[variant_id] for variant_id in unique_ids if variant_id in found]
+    missing = [variant_id for variant_id in unique_ids if variant_id not in found]
+    return items, missing
+
+
+def _on_products_changed(product_ids: Optional[List[int]]) -> None:
+    channel.publish()
+
+
+cache.subscribe("products", _on_products_changed)
@@ -0,0 +1,173 @@
+"""
+Нагрузочное сравнение оформления заказов при общей и раздельной базе заказов.
+
+    python bench_checkout.py [--seconds 10] [--buyers 8] [--writers 2]
+
+Для каждой схемы (orders.db отдельно и ORDERS_DATABASE_PATH=./shop.db)
+во временном каталоге заполняется база (seed.py), затем параллельно
+оформляются заказы и идут правки каталога из админки (update_variant).
+Печатает заказы/с, правки каталога/с, p50/p95 оформления и число ошибок
+(в основном исчерпанные повторы оптимистичной проверки остатков).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+LAYOUTS = {
+    "раздельная (orders.db)": "./orders.db",
+    "общая (shop.db)": "./shop.db",
+}
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _run_load(seconds: float, buyers: int, writers: int) -> dict:
+    """Нагрузка в текущем каталоге; схема баз задается окружением процесса."""
+    import seed
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed.main()
+
+    import crud
+    import models
+    import schemas
+    from database import SessionLocal
+    from sqlalchemy import update
+
+    db = SessionLocal()
+    # Остатков хватает на весь прогон: меряем запись, а не отказы
+    db.execute(update(models.ProductVariant).values(stock=10**9))
+    db.commit()
+    variant_ids = [
+        variant_id
+        for variant_id, in db.query(models.ProductVariant.id).filter(
+            models.ProductVariant.status == models.VariantStatus.ACTIVE
+        )
+    ]
+    db.close()
+
+    deadline = time.monotonic() + seconds
+    latencies, maintenance, errors = [], [0], {}
+    lock = threading.Lock()
+
+    def buyer():
+        db = SessionLocal()
+        try:
+            while time.monotonic() < deadline:
+                form = schemas.CheckoutForm(
+                    name="Нагрузка",
+                    phone="+70000000000",
+                    shipping_city="Москва",
+                    cart=[
+                        {"ProductVariantId": variant_id, "quantity": 1}
+                        for variant_id in random.sample(variant_ids, 2)
+                    ],
+                )
+                started = time.perf_counter()
+                try:
+                    crud.create_order(db, form)
+                except ValueError as e:
+                    with lock:
+                        errors[str(e)] = errors.get(str(e), 0) + 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            db.close()
+
+    def writer():
+        db = SessionLocal()
+        try:
+            while time.monotonic() < deadline:
+                price = Decimal(random.randint(1000, 9999)) / 100
+                try:
+                    crud.update_variant(
+                        db,
+                        random.choice(variant_ids),
+                        schemas.AdminVariantUpdate(price=price),
+                    )
+                except Exception as e:
+                    db.rollback()
+                    with lock:
+                        errors[str(e)] = errors.get(str(e), 0) + 1
+                    continue
+                with lock:
+                    maintenance[0] += 1
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=buyer) for _ in range(buyers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return {
+        "checkouts_per_second": round(len(latencies) / elapsed, 1),
+        "maintenance_per_second": round(maintenance[0] / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--buyers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_run_load(args.seconds, args.buyers, args.writers)))
+        return
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    for title, orders_path in LAYOUTS.items():
+        # Пути баз задаются при импорте database.py, поэтому каждая
+        # схема - отдельный процесс в своем каталоге
+        with tempfile.TemporaryDirectory() as workdir:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker"]
+                + [f"--seconds={args.seconds}", f"--buyers={args.buyers}"]
+                + [f"--writers={args.writers}"],
+                cwd=workdir,
+                env={
+                    **os.environ,
+                    "ORDERS_DATABASE_PATH": orders_path,
+                    "PYTHONPATH": backend_dir,
+                },
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"📊 {title}: заказов/с {result['checkouts_per_second']}, "
+            f"правок каталога/с {result['maintenance_per_second']}, "
+            f"p50 {result['p50_ms']} мс, p95 {result['p95_ms']} мс, "
+            f"ошибок {sum(result['errors'].values())}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Внутрипроцессные кэши для чтения каталога и их инвалидация.
+
+Кэши подписываются на пространства имён ("listings", "products", ...),
+а операции записи в crud вызывают invalidate() после коммита.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# Подписчики на инвалидацию: пространство имён -> список callback(keys)
+# keys=None означает "сбросить всё пространство имён"
+_subscribers: Dict[str, List[Callable[[Optional[List[Hashable]]], None]]] = {}
+
+# Все именованные кэши процесса - для статистики
+_caches: Dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением по времени жизни записей.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        maxsize: int = 1024,
+        maxbytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        """
+        maxbytes ограничивает суммарный размер значений (по sizeof)
+        в дополнение к числу записей maxsize.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._sizeof = sizeof
+        self._bytes = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Возвращает (найдено, значение)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return False, None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = self._sizeof(value) if self._sizeof else 0
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self._bytes > self.maxbytes
+            ):
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, keys: Optional[Iterable[Hashable]] = None) -> None:
+        with self._lock:
+            if keys is None:
+                self._data.clear()
+                self._bytes = 0
+                return
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            stats = {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 3) if requests else None,
+            }
+            if self.maxbytes is not None:
+                stats["bytes"] = self._bytes
+                stats["maxbytes"] = self.maxbytes
+            return stats
+
+
+def subscribe(
+    namespace: str, callback: Callable[[Optional[List[Hashable]]], None]
+) -> None:
+    """Регистрирует обработчик инвалидации для пространства имён."""
+    _subscribers.setdefault(namespace, []).append(callback)
+
+
+def invalidate(namespace: str, keys: Optional[Iterable[Hashable]] = None) -> None:
+    """
+    Инвалидирует записи пространства имён во всех подписанных кэшах.
+    keys=None сбрасывает пространство имён целиком.
+    """
+    key_list = list(keys) if keys is not None else None
+    for callback in _subscribers.get(namespace, []):
+        callback(key_list)
+
+
+def namespaces() -> List[str]:
+    """Пространства имён, на которые есть подписчики."""
+    return list(_subscribers)
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Статистика попаданий по всем кэшам процесса."""
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,171 @@
+"""
+Шина инвалидации кэшей между процессами (воркерами uvicorn) без внешнего
+брокера - только SQLite.
+
+Запись данных в той же транзакции добавляет в таблицу cache_invalidations
+пространство имён и ключи, которые нужно сбросить. Каждый процесс опрашивает
+базу фоновым потоком: PRAGMA data_version на постоянном соединении меняется
+только после коммита из другого соединения, поэтому холостой опрос не читает
+таблицу. Новые записи других процессов передаются в cache.invalidate().
+
+Устаревание кэшей в остальных процессах ограничено интервалом опроса
+CACHE_BUS_INTERVAL (секунды). Записи хранятся CACHE_BUS_RETENTION секунд;
+процесс, отставший сильнее, сбрасывает все кэши целиком.
+"""
+
+import json
+import os
+import threading
+import uuid
+from time import monotonic
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import cache
+import database
+import models
+
+POLL_INTERVAL = float(os.environ.get("CACHE_BUS_INTERVAL", "0.5"))
+RETENTION_SECONDS = float(os.environ.get("CACHE_BUS_RETENTION", "600"))
+# Как часто процесс удаляет устаревшие записи шины
+TRIM_INTERVAL = 60.0
+
+
+def _new_origin() -> str:
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+# Идентификатор процесса; после fork у каждого воркера свой
+_origin = _new_origin()
+
+
+def _reset_origin_after_fork() -> None:
+    global _origin, _poller
+
+    _origin = _new_origin()
+    # Поток опроса родителя в дочерний процесс не переходит
+    _poller = None
+
+
+os.register_at_fork(after_in_child=_reset_origin_after_fork)
+
+
+def publish(
+    db: Session, namespace: str, keys: Optional[Iterable[Hashable]] = None
+) -> None:
+    """
+    Ставит инвалидацию в шину для остальных процессов. Вызывается до коммита,
+    в транзакции самого изменения; свой процесс сбрасывает кэши сам после коммита.
+    """
+    db.execute(
+        insert(models.CacheInvalidation).values(
+            origin=_origin,
+            namespace=namespace,
+            keys=json.dumps(list(keys)) if keys is not None else None,
+        )
+    )
+
+
+class _Poller(threading.Thread):
+    def __init__(self, engine: Engine, interval: float):
+        super().__init__(name="cache-bus", daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.last_id = 0
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        with self.engine.connect() as conn:
+            self.last_id = (
+                conn.scalar(select(func.max(models.CacheInvalidation.id))) or 0
+            )
+            data_version = conn.execute(text("PRAGMA data_version")).scalar()
+            conn.rollback()
+            last_trim = monotonic()
+
+            while not self._stopped.wait(self.interval):
+                try:
+                    current_version = conn.execute(text("PRAGMA data_version")).scalar()
+                    if current_version != data_version:
+                        data_version = current_version
+                        self._apply_new(conn)
+                    if monotonic() - last_trim > TRIM_INTERVAL:
+                        last_trim = monotonic()
+                        self._trim(conn)
+                    conn.rollback()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Ошибка опроса шины инвалидации: {e}")
+
+    def _apply_new(self, conn) -> None:
+        rows = conn.execute(
+            select(
+                models.CacheInvalidation.id,
+                models.CacheInvalidation.origin,
+                models.CacheInvalidation.namespace,
+                models.CacheInvalidation.keys,
+            )
+            .where(models.CacheInvalidation.id > self.last_id)
+            .order_by(models.CacheInvalidation.id)
+        ).all()
+        if not rows:
+            return
+
+        # Номера идут подряд; разрыв значит, что часть записей уже удалена
+        if self.last_id and rows[0].id > self.last_id + 1:
+            for namespace in cache.namespaces():
+                cache.invalidate(namespace)
+            self.last_id = rows[-1].id
+            return
+
+        # Несколько записей одного пространства имён сбрасываются одним вызовом
+        pending: Dict[str, Optional[Set[Hashable]]] = {}
+        for row in rows:
+            if row.origin == _origin:
+                continue
+            if row.keys is None:
+                pending[row.namespace] = None
+            elif pending.get(row.namespace, set()) is not None:
+                pending.setdefault(row.namespace, set()).update(json.loads(row.keys))
+        self.last_id = rows[-1].id
+
+        for namespace, keys in pending.items():
+            cache.invalidate(namespace, keys)
+
+    def _trim(self, conn) -> None:
+        conn.execute(
+            delete(models.CacheInvalidation).where(
+                models.CacheInvalidation.created_at
+                < func.datetime("now", f"-{int(RETENTION_SECONDS)} seconds")
+            )
+        )
+        conn.commit()
+
+
+_poller: Optional[_Poller] = None
+
+
+def start(engine: Optional[Engine] = None, interval: float = POLL_INTERVAL) -> None:
+    """Запускает опрос шины в текущем процессе (из lifespan приложения)."""
+    global _poller
+
+    if _poller is not None:
+        return
+    _poller = _Poller(engine or database.engine, interval)
+    _poller.start()
+
+
+def stop() -> None:
+    global _poller
+
+    if _poller is None:
+        return
+    _poller.stop()
+    _poller.join(timeout=5)
+    _poller = None
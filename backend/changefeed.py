@@ -0,0 +1,233 @@
+"""
+Журнал изменений каталога (catalog_changes) для инкрементальной
+синхронизации клиентов.
+
+crud записывает в журнал id измененных товаров и вариантов в той же
+транзакции, что и само изменение. Клиент запоминает version из ответа
+GET /api/catalog/changes и при следующей синхронизации передает ее в since.
+
+Журнал ограничивается заданием compact():
+    python changefeed.py compact [дней хранения]
+Оно схлопывает повторы (для каждой пары товар/вариант и вида изменения
+остается только последняя запись - клиенту с любой версией этого
+достаточно) и удаляет записи старше срока хранения. Клиенты с версией
+старше удаленной части получают reset_required и загружают каталог целиком.
+"""
+
+import datetime as dt
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+import models
+
+DEFAULT_RETENTION_DAYS = 30
+MAX_CHANGES_PAGE = 1000
+
+# (product_id, variant_id или None, вид изменения)
+Change = Tuple[int, Optional[int], models.ChangeKind]
+
+
+def record(db: Session, changes: Iterable[Change]) -> None:
+    """Добавляет изменения в журнал. Коммит остается за вызывающим кодом."""
+    rows = [
+        {"product_id": product_id, "variant_id": variant_id, "kind": kind}
+        for product_id, variant_id, kind in dict.fromkeys(changes)
+    ]
+    if rows:
+        db.execute(insert(models.CatalogChange), rows)
+
+
+def _get_min_version(db: Session) -> int:
+    return (
+        db.scalar(
+            select(models.CatalogFeedState.min_version).where(
+                models.CatalogFeedState.id == 1
+            )
+        )
+        or 0
+    )
+
+
+def get_version(db: Session) -> int:
+    """Текущая версия каталога."""
+    return max(
+        db.scalar(select(func.max(models.CatalogChange.id))) or 0,
+        _get_min_version(db),
+    )
+
+
+def get_changed_variants(
+    db: Session, since: int, variant_ids: Iterable[int]
+) -> Tuple[int, Optional[Set[int]]]:
+    """
+    Текущая версия каталога и варианты из variant_ids, изменившиеся после
+    версии since. None вместо множества - журнал уже не покрывает since.
+    """
+    version = get_version(db)
+    if version == since:
+        return version, set()
+    if since < _get_min_version(db):
+        return version, None
+    changed = db.scalars(
+        select(models.CatalogChange.variant_id)
+        .where(
+            models.CatalogChange.id > since,
+            models.CatalogChange.id <= version,
+            models.CatalogChange.variant_id.in_(list(variant_ids)),
+        )
+        .distinct()
+    )
+    return version, set(changed)
+
+
+def get_changed_products(db: Session, since: int) -> Optional[Set[int]]:
+    """
+    Товары, изменившиеся после версии since. None - журнал уже не
+    покрывает since.
+    """
+    if since < _get_min_version(db):
+        return None
+    return set(
+        db.scalars(
+            select(models.CatalogChange.product_id)
+            .where(models.CatalogChange.id > since)
+            .distinct()
+        )
+    )
+
+
+def get_changes(db: Session, since: int, limit: int = 500) -> Dict[str, Any]:
+    """
+    Изменения после версии since, схлопнутые по товару/варианту: для каждого
+    указаны виды изменений и текущие цена, остаток и статус варианта.
+    """
+    if since < _get_min_version(db):
+        return {
+            "version": get_version(db),
+            "reset_required": True,
+            "has_more": False,
+            "changes": [],
+        }
+
+    rows = db.execute(
+        select(
+            models.CatalogChange.id,
+            models.CatalogChange.product_id,
+            models.CatalogChange.variant_id,
+            models.CatalogChange.kind,
+        )
+        .where(models.CatalogChange.id > since)
+        .order_by(models.CatalogChange.id)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return {
+            "version": get_version(db),
+            "reset_required": False,
+            "has_more": False,
+            "changes": [],
+        }
+
+    merged: Dict[Tuple[int, Optional[int]], Dict[str, Any]] = {}
+    for change_id, product_id, variant_id, kind in rows:
+        change = merged.pop((product_id, variant_id), None) or {
+            "product_id": product_id,
+            "variant_id": variant_id,
+            "kinds": [],
+        }
+        if kind not in change["kinds"]:
+            change["kinds"].append(kind)
+        change["version"] = change_id
+        # Пересоздаем ключ, чтобы порядок словаря соответствовал последней версии
+        merged[(product_id, variant_id)] = change
+
+    variant_ids = [key[1] for key in merged if key[1] is not None]
+    current = {
+        variant_id: (price, stock, status)
+        for variant_id, price, stock, status in db.execute(
+            select(
+                models.ProductVariant.id,
+                models.ProductVariant.price,
+                models.ProductVariant.stock,
+                models.ProductVariant.status,
+            ).where(models.ProductVariant.id.in_(variant_ids))
+        )
+    }
+
+    changes = []
+    for change in merged.values():
+        values = current.get(change["variant_id"])
+        change["deleted"] = change["variant_id"] is not None and values is None
+        change["price"], change["stock"], change["status"] = values or (None,) * 3
+        changes.append(change)
+
+    return {
+        "version": rows[-1].id,
+        "reset_required": False,
+        "has_more": has_more,
+        "changes": changes,
+    }
+
+
+def compact(
+    db: Session, retention_days: int = DEFAULT_RETENTION_DAYS
+) -> Tuple[int, int]:
+    """
+    Схлопывает повторы и удаляет записи старше retention_days.
+    Возвращает (схлопнуто, удалено по сроку).
+    """
+    latest = (
+        select(func.max(models.CatalogChange.id))
+        .group_by(
+            models.CatalogChange.product_id,
+            models.CatalogChange.variant_id,
+            models.CatalogChange.kind,
+        )
+        .scalar_subquery()
+    )
+    collapsed = db.execute(
+        delete(models.CatalogChange).where(models.CatalogChange.id.not_in(latest))
+    ).rowcount
+
+    cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=retention_days)
+    expired_version = db.scalar(
+        select(func.max(models.CatalogChange.id)).where(
+            models.CatalogChange.created_at < cutoff.replace(tzinfo=None)
+        )
+    )
+    expired = 0
+    if expired_version is not None:
+        expired = db.execute(
+            delete(models.CatalogChange).where(
+                models.CatalogChange.id <= expired_version
+            )
+        ).rowcount
+        state = db.get(models.CatalogFeedState, 1)
+        if state is None:
+            db.add(models.CatalogFeedState(id=1, min_version=expired_version))
+        else:
+            state.min_version = max(state.min_version, expired_version)
+
+    db.commit()
+    return collapsed, expired
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import SessionLocal
+
+    if not sys.argv[1:] or sys.argv[1] != "compact" or len(sys.argv) > 3:
+        sys.exit("Использование: python changefeed.py compact [дней хранения]")
+
+    retention_days = int(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_RETENTION_DAYS
+    db = SessionLocal()
+    try:
+        collapsed, expired = compact(db, retention_days)
+        print(f"✅ Схлопнуто записей: {collapsed}, удалено по сроку: {expired}")
+    finally:
+        db.close()
@@ -0,0 +1,232 @@
+"""
+Сжатие ответов API (ASGI middleware).
+
+Кодировка выбирается по Accept-Encoding: zstd, br или gzip (zstd и br -
+только если установлены пакеты zstandard и brotli). Степень сжатия и
+минимальный размер тела задаются по префиксу пути (ROUTE_POLICIES).
+
+Ответы из кэшей каталога (карточки товаров, страницы витрины, фильтры)
+одинаковы у многих клиентов: записи этих кэшей хранят тело в виде
+Precompressed, сжатые варианты которого создаются один раз на запись
+(и поэтому сильнее, PRECOMPRESSED_POLICY) и хранятся вместе с ней.
+Обработчик отдает их через response() уже сжатыми, middleware такие
+ответы не трогает.
+
+Потоки SSE (text/event-stream), уже сжатые и несжимаемые ответы
+передаются без изменений.
+"""
+
+import gzip
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Тела больше этого сжимаются в пуле потоков, а не в цикле событий
+THREAD_THRESHOLD = 64 * 1024
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+    "text/",
+)
+
+
+@dataclass(frozen=True)
+class CompressionPolicy:
+    minimum_size: int = 1024
+    gzip_level: int = 6
+    brotli_quality: int = 4
+    zstd_level: int = 3
+
+
+DEFAULT_POLICY = CompressionPolicy()
+# Тела записей кэшей каталога: сжимаются один раз на запись, поэтому сильнее
+PRECOMPRESSED_POLICY = CompressionPolicy(gzip_level=9, brotli_quality=9, zstd_level=12)
+
+# Первый подходящий префикс пути
+ROUTE_POLICIES: List[Tuple[str, CompressionPolicy]] = [
+    # Большие списки админки: каждый ответ уникален, сжимаем быстро
+    ("/api/admin/products", CompressionPolicy(gzip_level=5, brotli_quality=4)),
+]
+
+
+def _available_encodings() -> List[str]:
+    """Поддерживаемые кодировки в порядке предпочтения сервера."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+AVAILABLE_ENCODINGS = _available_encodings()
+
+
+def get_policy(path: str) -> CompressionPolicy:
+    for prefix, policy in ROUTE_POLICIES:
+        if path.startswith(prefix):
+            return policy
+    return DEFAULT_POLICY
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Лучшая из поддерживаемых кодировок, принимаемых клиентом (q > 0)."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    candidates = [
+        encoding
+        for encoding in AVAILABLE_ENCODINGS
+        if accepted.get(encoding, wildcard) > 0
+    ]
+    if not candidates:
+        return None
+    # Среди одинаковых q выигрывает порядок сервера
+    return max(candidates, key=lambda encoding: accepted.get(encoding, wildcard))
+
+
+def _compress(body: bytes, encoding: str, policy: CompressionPolicy) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=policy.zstd_level).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=policy.brotli_quality)
+    return gzip.compress(body, compresslevel=policy.gzip_level, mtime=0)
+
+
+class Precompressed:
+    """
+    JSON-тело записи кэша и его сжатые варианты. Вариант кодировки
+    создается при первом запросе с ней и хранится до удаления записи.
+    """
+
+    __slots__ = ("body", "_encoded", "_lock")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self._encoded: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def size(self) -> int:
+        """Оценка памяти для кэшей: тело и место под сжатые варианты."""
+        return 2 * len(self.body)
+
+    def encode(self, encoding: str) -> bytes:
+        encoded = self._encoded.get(encoding)
+        if encoded is None:
+            # Одновременные первые запросы сжимают тело один раз
+            with self._lock:
+                encoded = self._encoded.get(encoding)
+                if encoded is None:
+                    encoded = _compress(self.body, encoding, PRECOMPRESSED_POLICY)
+                    self._encoded[encoding] = encoded
+        return encoded
+
+
+def response(request: Request, payload: Precompressed) -> Response:
+    """
+    JSON-ответ с телом payload, сжатым по Accept-Encoding запроса.
+    Вызывается из синхронного обработчика (пул потоков): первое сжатие
+    записи может быть долгим.
+    """
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    if encoding is None or len(payload.body) < PRECOMPRESSED_POLICY.minimum_size:
+        # Vary проставит middleware, как у несжатых им ответов
+        return Response(content=payload.body, media_type="application/json")
+    return Response(
+        content=payload.encode(encoding),
+        media_type="application/json",
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+    )
+
+
+def _is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    # Поток SSE нельзя буферизовать до конца ответа
+    if content_type.startswith("text/event-stream"):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        policy = get_policy(scope["path"])
+        start_message = None
+        passthrough = False
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                passthrough = not _is_compressible(Headers(raw=message["headers"]))
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if len(body) >= policy.minimum_size:
+                if len(body) > THREAD_THRESHOLD:
+                    body = await anyio.to_thread.run_sync(
+                        _compress, body, encoding, policy
+                    )
+                else:
+                    body = _compress(body, encoding, policy)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,13 +1,84 @@
+import base64
+import datetime as dt
+import json
+import logging
+import random
+import re
+import time
 from decimal import Decimal
-from random import random
-from sqlite3 import OperationalError
-from time import time
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import asc, desc, exists, func, and_, select, update
-from typing import Any, Dict, List, Optional, Tuple
-from sqlalchemy.orm import selectinload, joinedload, Session
+from sqlalchemy import (
+    asc,
+    bindparam,
+    delete,
+    desc,
+    exists,
+    func,
+    and_,
+    literal_column,
+    select,
+    String,
+    table,
+    tuple_,
+    type_coerce,
+    update,
+)
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from sqlalchemy.orm import noload, selectinload, joinedload, Session
+import analytics
+import cache
+import cache_bus
+import changefeed
+import low_stock
 import models
+import order_events
+import price_stats
 import schemas
+import snapshot
+import surrogate
+
+logger = logging.getLogger(__name__)
+
+# Кэш общего количества товаров по сигнатуре фильтров.
+# Сбрасывается при любых изменениях остатков/статусов (пространство "listings").
+_product_count_cache = cache.TTLCache("product_counts", ttl=60, maxsize=2048)
+cache.subscribe("listings", _product_count_cache.invalidate)
+
+# Шаблоны запросов витрины по форме фильтров (см. _get_listing_statement).
+# Форм немного, поэтому шаблоны не вытесняются и не устаревают
+_listing_statements = cache.TTLCache(
+    "listing_statements", ttl=float("inf"), maxsize=1024
+)
+
+# Виртуальная FTS5-таблица (см. models.PRODUCTS_FTS_DDL)
+_products_fts = table("products_fts")
+
+# Веса колонок для bm25: name, description, brand, category
+_FTS_WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+
+
+# Максимальное количество id в одном пакетном запросе
+MAX_BATCH_IDS = 300
+
+# Поля варианта, изменения которых видны клиентам и попадают в журнал изменений
+FEED_VARIANT_FIELDS = {
+    "price": models.ChangeKind.PRICE,
+    "stock": models.ChangeKind.STOCK,
+    "status": models.ChangeKind.STATUS,
+}
+
+
+def _product_detail_options():
+    """Eager loading для карточки товара: варианты с атрибутами, фото, категория, бренд."""
+    return (
+        selectinload(models.Product.variants)
+        .selectinload(models.ProductVariant.attributes)
+        .joinedload(models.VariantAttribute.attribute),
+        selectinload(models.Product.images),
+        joinedload(models.Product.category),
+        joinedload(models.Product.brand),
+    )
 
 
 def get_product_by_id(db: Session, product_id: int) -> Optional[models.Product]:
@@ -18,14 +89,7 @@ def get_product_by_id(db: Session, product_id: int) -> Optional[models.Product]:
     # Основной запрос с eager loading всех связанных данных
     stmt = (
         select(models.Product)
-        .options(
-            selectinload(models.Product.variants)
-            .selectinload(models.ProductVariant.attributes)
-            .joinedload(models.VariantAttribute.attribute),
-            selectinload(models.Product.images),
-            joinedload(models.Product.category),
-            joinedload(models.Product.brand),
-        )
+        .options(*_product_detail_options())
         .where(models.Product.id == product_id)
     )
 
@@ -35,6 +99,31 @@ def get_product_by_id(db: Session, product_id: int) -> Optional[models.Product]:
     return product
 
 
+def get_products_by_ids(
+    db: Session, product_ids: List[int]
+) -> Tuple[List[models.Product], List[int]]:
+    """
+    Получает несколько товаров за фиксированное число запросов
+    (по одному на каждую eager-связь, независимо от количества id).
+
+    Returns:
+        (товары в порядке запроса без повторов, id ненайденных товаров)
+    """
+    unique_ids = list(dict.fromkeys(product_ids))
+    stmt = (
+        select(models.Product)
+        .options(*_product_detail_options())
+        .where(models.Product.id.in_(unique_ids))
+    )
+    products = {product.id: product for product in db.scalars(stmt).unique()}
+
+    found = [
+        products[product_id] for product_id in unique_ids if product_id in products
+    ]
+    missing = [product_id for product_id in unique_ids if product_id not in products]
+    return found, missing
+
+
 def get_products(
     db: Session,
     skip: int = 0,
@@ -45,8 +134,171 @@ def get_products(
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     sort_by: Optional[str] = None,
-) -> Tuple[List[models.Product], int]:
+    with_total: bool = True,
+    search_query: Optional[str] = None,
+) -> Tuple[List[models.Product], Optional[int], bool]:
+    """
+    Получает страницу товаров каталога.
+
+    Возвращает (товары, общее количество, есть ли следующая страница).
+    При with_total=False количество не считается (None), а has_more
+    определяется выборкой limit + 1 строк.
+    search_query ограничивает выборку полнотекстовым поиском; без явной
+    сортировки результаты упорядочиваются по релевантности (bm25).
+    """
+    params: Dict[str, Any] = {}
+
+    if search_query is not None:
+        params["match"] = _build_fts_match(search_query)
+        if not params["match"]:
+            return [], 0, False  # В запросе нет ни одного слова
+
+    # Фильтрация по категориям
+    if category_slug:
+        category_ids = _get_category_ids(db, category_slug)
+        if category_ids is None:
+            return [], 0, False  # Категория не найдена
+        params["category_ids"] = category_ids
+
+    if brand_slugs:
+        params["brand_slugs"] = list(brand_slugs)
+    if min_price is not None:
+        params["min_price"] = min_price
+    if max_price is not None:
+        params["max_price"] = max_price
+    if size_values:
+        params["size_values"] = list(size_values)
+    variant_filters_exist = any(
+        [min_price is not None, max_price is not None, size_values]
+    )
+
+    # Форма запроса: какие фильтры заданы и как сортировать. Значения фильтров
+    # передаются параметрами, поэтому запрос строится один раз на форму
+    shape = _ListingShape(
+        category="category_ids" in params,
+        search="match" in params,
+        brands="brand_slugs" in params,
+        min_price="min_price" in params,
+        max_price="max_price" in params,
+        sizes="size_values" in params,
+        sort_by=sort_by if sort_by in _LISTING_SORTS else None,
+    )
+
+    if not with_total:
+        # Без подсчета: берем на одну строку больше, чтобы узнать о следующей странице
+        rows = list(
+            db.scalars(
+                _get_listing_statement(shape, "page"),
+                {**params, "skip": skip, "limit": limit + 1},
+            )
+            .unique()
+            .all()
+        )
+        products = rows[:limit]
+        total_count = None
+        has_more = len(rows) > limit
+    else:
+        # Сортировка на количество не влияет - в ключ не входит
+        count_key = (
+            category_slug,
+            tuple(sorted(set(brand_slugs or []))),
+            tuple(sorted(set(size_values or []))),
+            min_price,
+            max_price,
+            params.get("match"),
+        )
+        found, total_count = _product_count_cache.get(count_key)
+        page_params = {**params, "skip": skip, "limit": limit}
+
+        if found:
+            products = list(
+                db.scalars(_get_listing_statement(shape, "page"), page_params)
+                .unique()
+                .all()
+            )
+        else:
+            # Количество и страница одним запросом через оконную функцию
+            rows = (
+                db.execute(_get_listing_statement(shape, "window"), page_params)
+                .unique()
+                .all()
+            )
+            products = [row[0] for row in rows]
+            # Пустая страница (например, skip за концом выборки) - считаем отдельно
+            if rows:
+                total_count = rows[0][1]
+            else:
+                total_count = (
+                    db.scalar(_get_listing_statement(shape, "count"), params) or 0
+                )
+            _product_count_cache.set(count_key, total_count)
+
+        has_more = skip + len(products) < total_count
+
+    # Фильтрация вариантов в результатах
+    for product in products:
+        # Сначала фильтруем по остаткам на складе и статусу
+        product.variants = [
+            v
+            for v in product.variants
+            if v.stock > 0 and v.status == models.VariantStatus.ACTIVE
+        ]
+
+        # Затем применяем дополнительные фильтры, если они есть
+        if variant_filters_exist:
+            filtered_variants = []
+            for variant in product.variants:
+                # Проверяем фильтр по цене
+                if min_price is not None and variant.price < min_price:
+                    continue
+                if max_price is not None and variant.price > max_price:
+                    continue
+
+                # Проверяем фильтр по размеру
+                if size_values:
+                    variant_sizes = [
+                        attr.attribute.value
+                        for attr in variant.attributes
+                        if attr.attribute.type == "size"
+                    ]
+                    if not any(size in size_values for size in variant_sizes):
+                        continue
+
+                filtered_variants.append(variant)
+
+            product.variants = filtered_variants
+
+    return products, total_count, has_more
+
+
+class _ListingShape(NamedTuple):
+    """Какие фильтры заданы в запросе витрины (без их значений)"""
+
+    category: bool
+    search: bool
+    brands: bool
+    min_price: bool
+    max_price: bool
+    sizes: bool
+    sort_by: Optional[str]
+
+
+_LISTING_SORTS = ("price_asc", "price_desc", "name_asc", "name_desc")
+
+
+def _get_listing_statement(shape: _ListingShape, kind: str):
+    """
+    Шаблон запроса витрины для формы фильтров: kind "page" - страница,
+    "window" - страница с общим количеством, "count" - только количество.
+    """
+    found, stmt = _listing_statements.get((shape, kind))
+    if not found:
+        stmt = _build_listing_statement(shape, kind)
+        _listing_statements.set((shape, kind), stmt)
+    return stmt
+
 
+def _build_listing_statement(shape: _ListingShape, kind: str):
     # Базовый запрос с eager loading
     stmt = select(models.Product).options(
         selectinload(models.Product.variants)
@@ -69,25 +321,33 @@ def get_products(
     )
 
     # Фильтрация по категориям
-    if category_slug:
-        category_tree = _build_category_tree(db)
-        start_category = category_tree.get(category_slug)
-        if start_category:
-            category_ids = _get_descendant_and_self_ids(start_category)
-            stmt = stmt.where(models.Product.category_id.in_(category_ids))
-        else:
-            return [], 0  # Категория не найдена
+    if shape.category:
+        stmt = stmt.where(
+            models.Product.category_id.in_(bindparam("category_ids", expanding=True))
+        )
+
+    # Полнотекстовый поиск
+    fts_match = None
+    if shape.search:
+        fts_match = (
+            select(
+                literal_column("products_fts.rowid").label("product_id"),
+                func.bm25(literal_column("products_fts"), *_FTS_WEIGHTS).label("rank"),
+            )
+            .select_from(_products_fts)
+            .where(literal_column("products_fts").op("MATCH")(bindparam("match")))
+            .subquery()
+        )
+        stmt = stmt.join(fts_match, models.Product.id == fts_match.c.product_id)
 
     # Фильтрация по брендам
-    if brand_slugs:
-        stmt = stmt.join(models.Brand).where(models.Brand.slug.in_(brand_slugs))
+    if shape.brands:
+        stmt = stmt.join(models.Brand).where(
+            models.Brand.slug.in_(bindparam("brand_slugs", expanding=True))
+        )
 
     # Фильтрация по вариантам (цена, размер)
-    variant_filters_exist = any(
-        [min_price is not None, max_price is not None, size_values]
-    )
-    if variant_filters_exist:
-        # Создаем подзапрос для фильтрации вариантов
+    if shape.min_price or shape.max_price or shape.sizes:
         variant_subquery = select(models.ProductVariant.product_id).distinct()
 
         # Добавляем фильтр активных вариантов в наличии
@@ -96,28 +356,38 @@ def get_products(
             models.ProductVariant.status == models.VariantStatus.ACTIVE,
         ]
 
-        if min_price is not None:
-            variant_conditions.append(models.ProductVariant.price >= min_price)
+        if shape.min_price:
+            variant_conditions.append(
+                models.ProductVariant.price >= bindparam("min_price")
+            )
 
-        if max_price is not None:
-            variant_conditions.append(models.ProductVariant.price <= max_price)
+        if shape.max_price:
+            variant_conditions.append(
+                models.ProductVariant.price <= bindparam("max_price")
+            )
 
-        if size_values:
+        if shape.sizes:
             variant_subquery = variant_subquery.join(models.VariantAttribute).join(
                 models.Attribute
             )
             variant_conditions.extend(
                 [
                     models.Attribute.type == "size",
-                    models.Attribute.value.in_(size_values),
+                    models.Attribute.value.in_(
+                        bindparam("size_values", expanding=True)
+                    ),
                 ]
             )
 
         variant_subquery = variant_subquery.where(and_(*variant_conditions))
         stmt = stmt.where(models.Product.id.in_(variant_subquery))
 
+    if kind == "count":
+        count_stmt = stmt.with_only_columns(models.Product.id).distinct()
+        return select(func.count()).select_from(count_stmt.subquery())
+
     # Логика сортировки
-    if sort_by in ["price_asc", "price_desc"]:
+    if shape.sort_by in ["price_asc", "price_desc"]:
         # Подзапрос для получения минимальной цены активных вариантов
         min_price_subquery = (
             select(
@@ -139,64 +409,74 @@ def get_products(
         )
         order_by_col = (
             asc(min_price_subquery.c.min_price)
-            if sort_by == "price_asc"
+            if shape.sort_by == "price_asc"
             else desc(min_price_subquery.c.min_price)
         )
         stmt = stmt.order_by(order_by_col)
-    elif sort_by == "name_asc":
+    elif shape.sort_by == "name_asc":
         stmt = stmt.order_by(asc(models.Product.name))
-    elif sort_by == "name_desc":
+    elif shape.sort_by == "name_desc":
         stmt = stmt.order_by(desc(models.Product.name))
+    elif fts_match is not None:  # Сортировка по релевантности для поиска
+        stmt = stmt.order_by(asc(fts_match.c.rank), models.Product.id)
     else:  # Сортировка по умолчанию
         stmt = stmt.order_by(desc(models.Product.created_at))
 
-    # Получение общего количества до пагинации
-    # Создаем копию запроса без order_by для подсчета
-    count_stmt = stmt.with_only_columns(models.Product.id).distinct()
-    # Убираем order_by из запроса для подсчета (он не нужен и может вызывать проблемы)
-    count_stmt = count_stmt.order_by(None)
-    total_count = (
-        db.scalar(select(func.count()).select_from(count_stmt.subquery())) or 0
-    )
+    if kind == "window":
+        stmt = stmt.add_columns(func.count().over().label("total_count"))
+    return stmt.offset(bindparam("skip")).limit(bindparam("limit"))
 
-    # Применение пагинации и получение результатов
-    stmt = stmt.offset(skip).limit(limit)
-    products = list(db.scalars(stmt).unique().all())
 
-    # Фильтрация вариантов в результатах
-    for product in products:
-        # Сначала фильтруем по остаткам на складе и статусу
-        product.variants = [
-            v
-            for v in product.variants
-            if v.stock > 0 and v.status == models.VariantStatus.ACTIVE
-        ]
+def _build_fts_match(search_query: str) -> str:
+    """
+    Превращает пользовательский запрос в безопасное выражение FTS5 MATCH.
+    Каждое слово ищется как префикс ("кроссов" найдет "Кроссовки"),
+    все слова должны присутствовать.
+    """
+    terms = re.findall(r"\w+", search_query.lower())
+    return " ".join(f'"{term}"*' for term in terms)
 
-        # Затем применяем дополнительные фильтры, если они есть
-        if variant_filters_exist:
-            filtered_variants = []
-            for variant in product.variants:
-                # Проверяем фильтр по цене
-                if min_price is not None and variant.price < min_price:
-                    continue
-                if max_price is not None and variant.price > max_price:
-                    continue
 
-                # Проверяем фильтр по размеру
-                if size_values:
-                    variant_sizes = [
-                        attr.attribute.value
-                        for attr in variant.attributes
-                        if attr.attribute.type == "size"
-                    ]
-                    if not any(size in size_values for size in variant_sizes):
-                        continue
+def _count_products(db: Session, stmt) -> int:
+    """
+    Считает количество уникальных товаров в запросе без пагинации и сортировки.
+    """
+    count_stmt = stmt.with_only_columns(models.Product.id).distinct()
+    # Убираем order_by из запроса для подсчета (он не нужен и может вызывать проблемы)
+    count_stmt = count_stmt.order_by(None)
+    return db.scalar(select(func.count()).select_from(count_stmt.subquery())) or 0
 
-                filtered_variants.append(variant)
 
-            product.variants = filtered_variants
+def _invalidate_catalog_caches(
+    product_ids: Iterable[int], content_changed: bool = False
+) -> None:
+    """
+    Сбрасывает кэши каталога после изменения остатков или статусов вариантов.
+    content_changed - изменилось не только количество (цена, статус):
+    сбрасывается и статическая часть карточек товаров.
+    Кэширующий прокси очищается только отсюда, то есть процессом,
+    выполнившим изменение.
+    """
+    product_ids = list(product_ids)
+    cache.invalidate("listings")
+    cache.invalidate("products", product_ids)
+    if content_changed:
+        cache.invalidate("product_content", product_ids)
+    surrogate.purge_products(product_ids)
 
-    return products, total_count
+
+def _publish_catalog_invalidation(
+    db: Session, product_ids: Iterable[int], content_changed: bool = False
+) -> None:
+    """
+    Ставит ту же инвалидацию в шину для остальных процессов.
+    Вызывается до коммита, в транзакции самого изменения.
+    """
+    product_ids = list(product_ids)
+    cache_bus.publish(db, "listings")
+    cache_bus.publish(db, "products", product_ids)
+    if content_changed:
+        cache_bus.publish(db, "product_content", product_ids)
 
 
 # Вспомогательные функции (нужно будет реализовать отдельно)
@@ -234,36 +514,57 @@ def _get_descendant_and_self_ids(category) -> List[int]:
     return ids
 
 
+def _get_category_ids(db: Session, category_slug: str) -> Optional[List[int]]:
+    """
+    ID категории и всех её потомков или None, если категории нет.
+    Дерево берется из снимка каталога; категорий, которых в нем еще нет, -
+    из базы.
+    """
+    current = snapshot.get_snapshot()
+    if current is not None:
+        category_id = current.find_category(category_slug)
+        if category_id is not None:
+            return current.get_category_subtree(category_id)
+
+    start_category = _build_category_tree(db).get(category_slug)
+    if not start_category:
+        return None
+    return _get_descendant_and_self_ids(start_category)
+
+
 def get_filters_for_category(db: Session, category_slug: str) -> Dict[str, Any]:
     """
     Получает доступные фильтры для категории.
     Оптимизированная версия с минимальным количеством запросов.
     """
 
-    # Получаем категорию с прямыми детьми для подкатегорий
-    start_category_with_children = db.scalar(
-        select(models.Category)
-        .options(selectinload(models.Category.children))
-        .where(models.Category.slug == category_slug)
-    )
-
-    if not start_category_with_children:
-        return {"brands": [], "sizes": [], "subcategories": []}
-
-    # Получаем подкатегории (прямые дочерние)
-    subcategories = [
-        {"name": child.name, "slug": child.slug}
-        for child in start_category_with_children.children
-    ]
-
-    # Для фильтрации брендов и размеров нужны ID всех потомков
-    category_tree = _build_category_tree(db)
-    tree_start_node = category_tree.get(category_slug)
+    # Подкатегории (прямые дочерние) и ID всех потомков для фильтрации
+    # брендов и размеров - из снимка каталога, если категория в нем есть
+    current = snapshot.get_snapshot()
+    category_id = None if current is None else current.find_category(category_slug)
+    if category_id is not None:
+        subcategories = [
+            {"name": child.name, "slug": child.slug}
+            for child in current.get_category_children(category_id)
+        ]
+        category_ids = current.get_category_subtree(category_id)
+    else:
+        start_category_with_children = db.scalar(
+            select(models.Category)
+            .options(selectinload(models.Category.children))
+            .where(models.Category.slug == category_slug)
+        )
 
-    if not tree_start_node:
-        return {"brands": [], "sizes": [], "subcategories": subcategories}
+        if not start_category_with_children:
+            return {"brands": [], "sizes": [], "subcategories": []}
 
-    category_ids = _get_descendant_and_self_ids(tree_start_node)
+        subcategories = [
+            {"name": child.name, "slug": child.slug}
+            for child in start_category_with_children.children
+        ]
+        category_ids = _get_category_ids(db, category_slug)
+        if category_ids is None:
+            return {"brands": [], "sizes": [], "subcategories": subcategories}
 
     # Получаем бренды
     brands_query = (
@@ -317,7 +618,15 @@ def get_filters_for_category(db: Session, category_slug: str) -> Dict[str, Any]:
         key=lambda x: (str.isdigit(x), x),  # Сначала буквенные размеры, потом цифровые
     )
 
-    return {"brands": brands, "sizes": sizes, "subcategories": subcategories}
+    # Распределение цен поддерева берется из предрассчитанных счетчиков
+    price = price_stats.get_price_histogram(db, category_ids)
+
+    return {
+        "brands": brands,
+        "sizes": sizes,
+        "subcategories": subcategories,
+        "price": price,
+    }
 
 
 def get_products_for_admin(
@@ -353,10 +662,8 @@ def get_products_for_admin(
 
     # Фильтрация по категориям
     if category_slug:
-        category_tree = _build_category_tree(db)
-        start_category = category_tree.get(category_slug)
-        if start_category:
-            category_ids = _get_descendant_and_self_ids(start_category)
+        category_ids = _get_category_ids(db, category_slug)
+        if category_ids is not None:
             stmt = stmt.where(models.Product.category_id.in_(category_ids))
         else:
             return [], 0  # Категория не найдена
@@ -444,11 +751,7 @@ def get_products_for_admin(
         stmt = stmt.order_by(desc(models.Product.created_at))
 
     # Получение общего количества до пагинации
-    count_stmt = stmt.with_only_columns(models.Product.id).distinct()
-    count_stmt = count_stmt.order_by(None)
-    total_count = (
-        db.scalar(select(func.count()).select_from(count_stmt.subquery())) or 0
-    )
+    total_count = _count_products(db, stmt)
 
     # Применение пагинации и получение результатов
     stmt = stmt.offset(skip).limit(limit)
@@ -490,6 +793,114 @@ def get_products_for_admin(
     return products, total_count
 
 
+def update_variant(
+    db: Session, variant_id: int, variant_update: schemas.AdminVariantUpdate
+) -> Optional[models.ProductVariant]:
+    """
+    Обновляет цену, остаток, порог дозаказа или статус варианта
+    (в том числе пополнение склада).
+
+    Returns:
+        ProductVariant | None: Обновленный вариант или None если не найден
+    """
+    variant = db.get(models.ProductVariant, variant_id)
+    if not variant:
+        return None
+
+    changes = []
+    for field, value in variant_update.model_dump(exclude_unset=True).items():
+        if value is None or getattr(variant, field) == value:
+            continue
+        setattr(variant, field, value)
+        if field in FEED_VARIANT_FIELDS:
+            changes.append((variant.product_id, variant_id, FEED_VARIANT_FIELDS[field]))
+
+    low_stock_changed = low_stock.sync(db, [variant_id])
+    changefeed.record(db, changes)
+    product_id = variant.product_id
+    content_changed = any(kind != models.ChangeKind.STOCK for _, _, kind in changes)
+    _publish_catalog_invalidation(db, [product_id], content_changed)
+
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    _invalidate_catalog_caches([product_id], content_changed)
+    if low_stock_changed:
+        low_stock.notify()
+    db.refresh(variant)
+    return variant
+
+
+def _check_cart_item(
+    cart_item: schemas.CartItem, variant: Optional[models.ProductVariant]
+) -> Optional[str]:
+    """
+    Проверяет, можно ли заказать позицию корзины.
+    Возвращает текст ошибки или None, если позиция доступна.
+    """
+    if not variant:
+        return f"Вариант товара с ID {cart_item.ProductVariantId} не найден"
+
+    if variant.status != models.VariantStatus.ACTIVE:
+        return f"Товар '{variant.product.name}' недоступен для заказа"
+
+    if variant.stock < cart_item.quantity:
+        return (
+            f"Недостаточно товара '{variant.product.name}'. "
+            f"Доступно: {variant.stock}, запрошено: {cart_item.quantity}"
+        )
+
+    return None
+
+
+def quote_cart(db: Session, cart: List[schemas.CartItem]) -> Dict[str, Any]:
+    """
+    Проверяет и рассчитывает корзину без создания заказа.
+    Использует те же проверки, что и create_order, но не прерывается
+    на первой ошибке, а возвращает доступность каждой позиции.
+    Все варианты читаются одним запросом.
+    """
+    variant_ids = [item.ProductVariantId for item in cart]
+    stmt = (
+        select(models.ProductVariant)
+        .options(joinedload(models.ProductVariant.product))
+        .where(models.ProductVariant.id.in_(variant_ids))
+    )
+    variants_dict = {variant.id: variant for variant in db.scalars(stmt)}
+
+    total_amount = Decimal("0")
+    lines = []
+    for cart_item in cart:
+        variant = variants_dict.get(cart_item.ProductVariantId)
+        error = _check_cart_item(cart_item, variant)
+
+        unit_price = variant.price if variant else None
+        total_price = unit_price * cart_item.quantity if variant else None
+        if not error:
+            total_amount += total_price
+
+        lines.append(
+            {
+                "variant_id": cart_item.ProductVariantId,
+                "quantity": cart_item.quantity,
+                "available": error is None,
+                "available_stock": variant.stock if variant else 0,
+                "unit_price": unit_price,
+                "total_price": total_price,
+                "error": error,
+            }
+        )
+
+    return {
+        "items": lines,
+        "total_amount": total_amount,
+        "is_valid": all(line["available"] for line in lines),
+    }
+
+
 def create_order(
     db: Session, checkout_form: schemas.CheckoutForm, max_retries: int = 3
 ) -> models.Order:
@@ -529,21 +940,9 @@ def create_order(
                 # ИСПРАВЛЕНО: используем VariantId для получения варианта
                 variant = variants_dict.get(cart_item.ProductVariantId)
 
-                if not variant:
-                    raise ValueError(
-                        f"Вариант товара с ID {cart_item.ProductVariantId} не найден"
-                    )
-
-                if variant.status != models.VariantStatus.ACTIVE:
-                    raise ValueError(
-                        f"Товар '{variant.product.name}' недоступен для заказа"
-                    )
-
-                if variant.stock < cart_item.quantity:
-                    raise ValueError(
-                        f"Недостаточно товара '{variant.product.name}'. "
-                        f"Доступно: {variant.stock}, запрошено: {cart_item.quantity}"
-                    )
+                error = _check_cart_item(cart_item, variant)
+                if error:
+                    raise ValueError(error)
 
                 unit_price = variant.price
                 total_price = unit_price * cart_item.quantity
@@ -559,33 +958,7 @@ def create_order(
                     }
                 )
 
-            # Создаем заказ
-            # ИСПРАВЛЕНО: добавлен shipping_city согласно схеме CheckoutForm
-            order = models.Order(
-                customer_name=checkout_form.name,
-                customer_phone=checkout_form.phone,
-                shipping_city=checkout_form.shipping_city,  # Добавлено поле города
-                total_amount=total_amount,
-                status=models.OrderStatus.PENDING,
-            )
-
-            db.add(order)
-            db.flush()
-
-            # Создаем элементы заказа
-            order_items = [
-                models.OrderItem(
-                    order_id=order.id,
-                    variant_id=item_data["variant_id"],
-                    quantity=item_data["quantity"],
-                    unit_price=item_data["unit_price"],
-                    total_price=item_data["total_price"],
-                )
-                for item_data in order_items_data
-            ]
-
-            db.add_all(order_items)
-
+            # Фаза 1 (база каталога): списываем остатки и резервируем их под заказ.
             # Оптимистичное обновление остатков - обновляем только если остаток не изменился
             # Это эквивалент row-level locking через optimistic concurrency control
             failed_updates = []
@@ -622,10 +995,54 @@ def create_order(
                         f"Остатки товаров изменились: {', '.join(failed_updates)}"
                     )
 
-            # Все обновления прошли успешно
+            reservation = models.StockReservation(
+                items=json.dumps(
+                    [
+                        [item_data["variant_id"], item_data["quantity"]]
+                        for item_data in order_items_data
+                    ]
+                )
+            )
+            db.add(reservation)
+
+            low_stock_changed = low_stock.sync(
+                db, [item_data["variant_id"] for item_data in order_items_data]
+            )
+            changefeed.record(
+                db,
+                [
+                    (
+                        variants_dict[item_data["variant_id"]].product_id,
+                        item_data["variant_id"],
+                        models.ChangeKind.STOCK,
+                    )
+                    for item_data in order_items_data
+                ],
+            )
+
+            # Позиции для накопительных таблиц продаж; бренд и категорию
+            # читаем до коммита - после него объекты будут expired
+            sale_lines = [
+                analytics.SaleLine(
+                    variant_id=item_data["variant_id"],
+                    brand_id=variants_dict[item_data["variant_id"]].product.brand_id,
+                    category_id=variants_dict[
+                        item_data["variant_id"]
+                    ].product.category_id,
+                    quantity=item_data["quantity"],
+                    total_price=item_data["total_price"],
+                )
+                for item_data in order_items_data
+            ]
+            product_ids = {variant.product_id for variant in variants}
+            _publish_catalog_invalidation(db, product_ids)
+            db.flush()
+            reservation_id = reservation.id
             db.commit()
-            db.refresh(order)
-            return order
+            _invalidate_catalog_caches(product_ids)
+            if low_stock_changed:
+                low_stock.notify()
+            break
 
         except ValueError:
             # Ошибки валидации не требуют повтора
@@ -648,8 +1065,145 @@ def create_order(
                 continue
             else:
                 raise ValueError("Ошибка при создании заказа")
+    else:
+        raise ValueError("Не удалось создать заказ после всех попыток")
 
-    raise ValueError("Не удалось создать заказ после всех попыток")
+    # Фаза 2 (база заказов): заказ под резерв. Если записать его не удалось,
+    # остатки возвращаются; если процесс упал между фазами - их вернет
+    # orders_db.sweep_reservations
+    for attempt in range(max_retries):
+        try:
+            # ИСПРАВЛЕНО: добавлен shipping_city согласно схеме CheckoutForm
+            order = models.Order(
+                customer_name=checkout_form.name,
+                customer_phone=checkout_form.phone,
+                shipping_city=checkout_form.shipping_city,  # Добавлено поле города
+                total_amount=total_amount,
+                status=models.OrderStatus.PENDING,
+                reservation_id=reservation_id,
+            )
+
+            db.add(order)
+            db.flush()
+            order_events.record(db, order.id, models.OrderEventKind.CREATED)
+
+            # Создаем элементы заказа
+            db.add_all(
+                [
+                    models.OrderItem(
+                        order_id=order.id,
+                        variant_id=item_data["variant_id"],
+                        quantity=item_data["quantity"],
+                        unit_price=item_data["unit_price"],
+                        total_price=item_data["total_price"],
+                    )
+                    for item_data in order_items_data
+                ]
+            )
+
+            # Учитываем заказ в накопительных таблицах продаж (в той же транзакции)
+            analytics.apply_order(
+                db, dt.datetime.now(dt.timezone.utc).date(), sale_lines
+            )
+
+            db.commit()
+            order_events.notify()
+            db.refresh(order)
+            return order
+
+        except OperationalError:
+            # База заказов занята - повторяем только вторую фазу
+            db.rollback()
+            if attempt < max_retries - 1:
+                time.sleep(random.uniform(0.05, 0.1))
+                continue
+
+        except Exception:
+            db.rollback()
+
+        break
+
+    release_stock_reservation(db, reservation_id)
+    raise ValueError("Ошибка при создании заказа")
+
+
+def release_stock_reservation(db: Session, reservation_id: int) -> bool:
+    """
+    Возвращает на склад остатки резерва, под который не создан заказ,
+    и удаляет резерв. Возвращает False, если резерв уже снят.
+    """
+    reservation = db.get(models.StockReservation, reservation_id)
+    if not reservation:
+        return False
+
+    items = json.loads(reservation.items)
+    deleted = db.execute(
+        delete(models.StockReservation).where(
+            models.StockReservation.id == reservation_id
+        )
+    ).rowcount
+    if not deleted:
+        db.rollback()
+        return False
+
+    _restock_and_commit(db, items)
+    return True
+
+
+def apply_stock_return(db: Session, stock_return_id: int) -> bool:
+    """
+    Возвращает на склад остатки отмененного заказа и удаляет запись
+    о возврате. Возвращает False, если запись уже обработана.
+    """
+    stock_return = db.get(models.StockReturn, stock_return_id)
+    if not stock_return:
+        return False
+
+    items = json.loads(stock_return.items)
+    deleted = db.execute(
+        delete(models.StockReturn).where(models.StockReturn.id == stock_return_id)
+    ).rowcount
+    if not deleted:
+        db.rollback()
+        return False
+
+    _restock_and_commit(db, items)
+    return True
+
+
+def _restock_and_commit(db: Session, items: List[Tuple[int, int]]) -> None:
+    """
+    Возвращает остатки [variant_id, quantity] в текущей транзакции базы
+    каталога вместе со списком дозаказа и журналом изменений и фиксирует ее.
+    """
+    for variant_id, quantity in items:
+        db.execute(
+            update(models.ProductVariant)
+            .where(models.ProductVariant.id == variant_id)
+            .values(stock=models.ProductVariant.stock + quantity)
+        )
+
+    variant_ids = [variant_id for variant_id, _ in items]
+    variant_products = db.execute(
+        select(models.ProductVariant.id, models.ProductVariant.product_id).where(
+            models.ProductVariant.id.in_(variant_ids)
+        )
+    ).all()
+    product_ids = {product_id for _, product_id in variant_products}
+    low_stock_changed = low_stock.sync(db, variant_ids)
+    changefeed.record(
+        db,
+        [
+            (product_id, variant_id, models.ChangeKind.STOCK)
+            for variant_id, product_id in variant_products
+        ],
+    )
+    _publish_catalog_invalidation(db, product_ids)
+    db.commit()
+
+    _invalidate_catalog_caches(product_ids)
+    if low_stock_changed:
+        low_stock.notify()
 
 
 def get_order_by_id(db: Session, order_id: int) -> Optional[models.Order]:
@@ -679,6 +1233,107 @@ def get_order_by_id(db: Session, order_id: int) -> Optional[models.Order]:
     return db.execute(stmt).scalar_one_or_none()
 
 
+def _encode_order_cursor(created_at_raw: str, order_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at_raw}|{order_id}".encode()).decode()
+
+
+def _decode_order_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        created_at_raw, order_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        )
+        return created_at_raw, int(order_id)
+    except ValueError:
+        raise ValueError("Некорректный курсор пагинации")
+
+
+def get_orders_for_admin(
+    db: Session,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    status: Optional[models.OrderStatus] = None,
+    date_from: Optional[dt.date] = None,
+    date_to: Optional[dt.date] = None,
+    phone: Optional[str] = None,
+    name: Optional[str] = None,
+    city: Optional[str] = None,
+    include_items: bool = False,
+) -> Tuple[List[models.Order], Optional[str]]:
+    """
+    Список заказов для админки, от новых к старым, с keyset-пагинацией
+    по (created_at, id) на индексе ix_orders_created_at_id.
+
+    Args:
+        db: Сессия базы данных
+        limit: Размер страницы
+        cursor: Курсор из предыдущего ответа (next_cursor)
+        status, date_from, date_to, phone, name, city: Фильтры;
+            date_to включительно, name - поиск по началу имени
+        include_items: Загружать ли позиции заказов
+
+    Returns:
+        (заказы, курсор следующей страницы или None)
+
+    Raises:
+        ValueError: При некорректном курсоре
+    """
+    # created_at сравнивается как хранимый текст: значения по умолчанию из
+    # SQLite записаны без микросекунд, а привязанный datetime - с ними
+    created_at_raw = type_coerce(models.Order.created_at, String)
+
+    stmt = select(models.Order, created_at_raw.label("created_at_raw")).order_by(
+        created_at_raw.desc(), models.Order.id.desc()
+    )
+
+    if cursor:
+        cursor_created_at, cursor_id = _decode_order_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(created_at_raw, models.Order.id)
+            < tuple_(cursor_created_at, cursor_id)
+        )
+
+    if status:
+        stmt = stmt.where(models.Order.status == status)
+    if date_from:
+        stmt = stmt.where(created_at_raw >= date_from.isoformat())
+    if date_to:
+        stmt = stmt.where(created_at_raw < (date_to + dt.timedelta(days=1)).isoformat())
+    if phone:
+        stmt = stmt.where(models.Order.customer_phone == phone)
+    if name:
+        stmt = stmt.where(models.Order.customer_name.startswith(name))
+    if city:
+        stmt = stmt.where(models.Order.shipping_city == city)
+
+    if include_items:
+        stmt = stmt.options(
+            selectinload(models.Order.items)
+            .selectinload(models.OrderItem.variant)
+            .selectinload(models.ProductVariant.product),
+            selectinload(models.Order.items)
+            .selectinload(models.OrderItem.variant)
+            .selectinload(models.ProductVariant.attributes),
+        )
+    else:
+        # Без позиций: items остается пустым и не подгружается при сериализации
+        stmt = stmt.options(noload(models.Order.items))
+
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = db.execute(stmt.limit(limit + 1)).all()
+    orders = [order for order, _ in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last_order, last_created_at_raw = rows[limit - 1]
+        next_cursor = _encode_order_cursor(last_created_at_raw, last_order.id)
+
+    return orders, next_cursor
+
+
+class OrderStatusConflict(ValueError):
+    """Переход заказа в новый статус из текущего невозможен."""
+
+
 def update_order_status(
     db: Session, order_id: int, status: models.OrderStatus
 ) -> Optional[models.Order]:
@@ -692,29 +1347,86 @@ def update_order_status(
 
     Returns:
         Order | None: Обновленный заказ или None если не найден
+
+    Raises:
+        OrderStatusConflict: При попытке вывести заказ из отмены
     """
     order = db.get(models.Order, order_id)
     if not order:
         return None
 
-    order.status = status
-
-    # Если заказ отменяется, возвращаем товары на склад
-    if status == models.OrderStatus.CANCELLED:
-        stmt = (
-            select(models.OrderItem)
-            .options(selectinload(models.OrderItem.variant))
-            .where(models.OrderItem.order_id == order_id)
+    previous_status = order.status
+    # Остатки отмененного заказа уже вернулись на склад и могли быть проданы:
+    # возврат в работу снова учел бы его в продажах без списания остатков
+    if (
+        previous_status == models.OrderStatus.CANCELLED
+        and status != models.OrderStatus.CANCELLED
+    ):
+        raise OrderStatusConflict(
+            f"Заказ {order_id} отменен, его статус нельзя изменить"
+        )
+    stock_return_id = None
+    # Фаза 1 (база каталога): при отмене записываем, что вернуть на склад.
+    # Если процесс упадет после смены статуса, остатки вернет
+    # orders_db.sweep_stock_returns
+    if (
+        status == models.OrderStatus.CANCELLED
+        and previous_status != models.OrderStatus.CANCELLED
+    ):
+        items = db.execute(
+            select(models.OrderItem.variant_id, models.OrderItem.quantity).where(
+                models.OrderItem.order_id == order_id
+            )
+        ).all()
+        stock_return = models.StockReturn(
+            order_id=order_id,
+            items=json.dumps(
+                [[variant_id, quantity] for variant_id, quantity in items]
+            ),
         )
-        order_items = db.execute(stmt).scalars().all()
+        db.add(stock_return)
+        try:
+            db.flush()
+            stock_return_id = stock_return.id
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise
 
-        for item in order_items:
-            item.variant.stock += item.quantity
+    # Фаза 2 (база заказов): новый статус
+    order.status = status
+    if previous_status != status:
+        order_events.record(db, order_id, models.OrderEventKind.STATUS_CHANGED)
+
+    # Отмена и возврат вычитают заказ из продаж, обратный переход - добавляет
+    if analytics.is_counted(previous_status) != analytics.is_counted(status):
+        analytics.apply_order(
+            db,
+            order.created_at.date(),
+            analytics.get_order_lines(db, order_id),
+            sign=1 if analytics.is_counted(status) else -1,
+        )
 
+    # Сначала фиксируем заказ, затем возвращаем остатки: при сбое между
+    # фазами товар не будет продан дважды, а запись о возврате останется
     try:
         db.commit()
-        db.refresh(order)
-        return order
     except Exception as e:
         db.rollback()
         raise
+    if previous_status != status:
+        order_events.notify()
+
+    # Фаза 3 (база каталога): возвращаем товары на склад и удаляем запись
+    if stock_return_id is not None:
+        try:
+            apply_stock_return(db, stock_return_id)
+        except OperationalError:
+            # База каталога занята - остатки вернет orders_db.sweep_stock_returns
+            db.rollback()
+            logger.warning(
+                "Возврат остатков заказа %s отложен", order_id, exc_info=True
+            )
+
+    db.refresh(order)
+    return order
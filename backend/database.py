@@ -1,21 +1,134 @@
-from sqlalchemy import create_engine
+import os
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./shop.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Заказы лежат в отдельном файле: запись заказа не берет блокировку
+# базы каталога. ORDERS_DATABASE_PATH=./shop.db возвращает общую базу
+# (так сравнивается пропускная способность, см. bench_checkout.py)
+ORDERS_DATABASE_PATH = os.environ.get("ORDERS_DATABASE_PATH", "./orders.db")
+SQLALCHEMY_ORDERS_DATABASE_URL = f"sqlite:///{ORDERS_DATABASE_PATH}"
+
+# Размер пула соединений каждого движка; пул потоков воркера подгоняется
+# под него (см. THREADPOOL_SIZE), чтобы потоки не ждали свободного соединения
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+THREADPOOL_SIZE = DB_POOL_SIZE + DB_MAX_OVERFLOW
+
+# Сколько соединение ждет чужую блокировку, прежде чем получить
+# "database is locked", миллисекунды
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _on_connect_writer(dbapi_connection, connection_record):
+    _on_connect(dbapi_connection, connection_record)
+    # Режим журнала хранится в самой базе; WAL включает первое соединение
+    # на запись, соединения только для чтения его уже застают
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.close()
+
+
+def _create_engine(url: str, read_only: bool = False):
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    event.listen(
+        new_engine, "connect", _on_connect if read_only else _on_connect_writer
+    )
+    return new_engine
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+orders_engine = _create_engine(SQLALCHEMY_ORDERS_DATABASE_URL)
+
+# Отдельный пул только для чтения: такие соединения не могут взять
+# блокировку на запись. В режиме WAL чтение не ждет запись и не мешает
+# ей зафиксироваться, поэтому этот пул не конкурирует с оформлением заказов
+SQLALCHEMY_READ_DATABASE_URL = "sqlite:///file:./shop.db?mode=ro&uri=true"
+SQLALCHEMY_READ_ORDERS_DATABASE_URL = (
+    f"sqlite:///file:{ORDERS_DATABASE_PATH}?mode=ro&uri=true"
+)
+
+read_engine = _create_engine(SQLALCHEMY_READ_DATABASE_URL, read_only=True)
+read_orders_engine = _create_engine(
+    SQLALCHEMY_READ_ORDERS_DATABASE_URL, read_only=True
 )
-SessionLocal = sessionmaker(autocommit=False, bind=engine)
+
 
 class Base(DeclarativeBase):
     pass
 
 
+class OrdersBase(Base):
+    """Модели стороны заказов: хранятся в базе ORDERS_DATABASE_PATH"""
+
+    __abstract__ = True
+
+
+# Сессия выбирает движок по классу модели
+SessionLocal = sessionmaker(
+    autocommit=False, binds={Base: engine, OrdersBase: orders_engine}
+)
+ReadSessionLocal = sessionmaker(
+    autocommit=False, binds={Base: read_engine, OrdersBase: read_orders_engine}
+)
+
+# Использование кэша скомпилированных запросов SQLAlchemy всеми движками:
+# промахи означают компиляцию SQL на пути запроса
+_statement_stats = {"hits": 0, "misses": 0, "uncached": 0}
+_statement_stats_lock = threading.Lock()
+
+
+def _count_statement_cache(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    if context.cache_hit == CACHE_HIT:
+        key = "hits"
+    elif context.cache_hit == CACHE_MISS:
+        key = "misses"
+    else:
+        key = "uncached"
+    with _statement_stats_lock:
+        _statement_stats[key] += 1
+
+
+ENGINES = (engine, orders_engine, read_engine, read_orders_engine)
+
+for _engine in ENGINES:
+    event.listen(_engine, "before_cursor_execute", _count_statement_cache)
+
+
+def get_statement_cache_stats():
+    with _statement_stats_lock:
+        return dict(_statement_stats)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,70 @@
+"""
+Внутрипроцессные уведомления для long-poll запросов.
+
+Канал хранит номер версии. publish() увеличивает его и будит ожидающих -
+вызывается из любого потока, обычно из crud после коммита. wait() вызывается
+из асинхронного обработчика и возвращается, как только версия отличается
+от известной клиенту, или по таймауту.
+"""
+
+import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+# Все каналы процесса по имени
+_channels: Dict[str, "Channel"] = {}
+
+
+def _resolve(future: asyncio.Future, version: int) -> None:
+    if not future.done():
+        future.set_result(version)
+
+
+class Channel:
+    def __init__(self, name: str):
+        self.name = name
+        self.version = 0
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def publish(self) -> int:
+        with self._lock:
+            self.version += 1
+            version = self.version
+            waiters, self._waiters = self._waiters, []
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, version)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                pass
+        return version
+
+    async def wait(self, known_version: int, timeout: float) -> int:
+        """
+        Ждет изменения версии. Если известная клиенту версия уже устарела
+        (в том числе после перезапуска процесса), возвращается сразу.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.version != known_version:
+                return self.version
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return self.version
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+
+def get_channel(name: str) -> Channel:
+    channel = _channels.get(name)
+    if channel is None:
+        channel = _channels.setdefault(name, Channel(name))
+    return channel
@@ -0,0 +1,240 @@
+"""
+Статический снимок каталога для сборки фронтенда (Next.js).
+
+    python export_static.py [каталог] [--full]
+
+По умолчанию пишет в frontend/public/catalog:
+    listings/<slug категории>/<страница>.json.gz - как GET /api/products
+        ?category_slug=...&limit=12&skip=... (без фильтров, порядок по умолчанию)
+    filters/<slug категории>.json.gz - как GET /api/products/filters
+    products/<id>.json.gz - как GET /api/products/{id}
+    manifest.json - версия каталога и sha256 несжатого содержимого файлов
+
+Повторный запуск берет из журнала каталога (changefeed) изменения после
+версии манифеста и пересобирает только измененные товары и категории,
+в которые они входят (с родительскими). Файл перезаписывается, только
+если изменилось его содержимое (по sha256 из манифеста). --full, а также
+reset_required журнала пересобирают все (новые товары и категории журнал
+не отражает).
+
+Остатки в снимке - на момент выгрузки; живые остатки фронтенд берет
+из GET /api/variants/availability.
+"""
+
+import datetime as dt
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import changefeed
+import crud
+import models
+import product_cache
+import schemas
+
+PAGE_SIZE = 12
+MANIFEST_NAME = "manifest.json"
+DEFAULT_OUT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "public", "catalog"
+)
+
+
+def _encode(payload: Any) -> bytes:
+    """JSON в том же виде, что отдает API."""
+    return json.dumps(
+        payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class _Writer:
+    """Пишет файлы снимка, пропуская те, чье содержимое не изменилось."""
+
+    def __init__(self, out_dir: str, files: Dict[str, Dict[str, Any]]):
+        self.out_dir = out_dir
+        self.files = files
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def write(self, path: str, content: bytes) -> None:
+        digest = hashlib.sha256(content).hexdigest()
+        target = os.path.join(self.out_dir, path)
+        if self.files.get(path, {}).get("sha256") == digest and os.path.exists(target):
+            self.unchanged += 1
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # mtime=0: одинаковое содержимое дает одинаковый файл
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        with open(target + ".tmp", "wb") as f:
+            f.write(compressed)
+        os.replace(target + ".tmp", target)
+        self.files[path] = {
+            "sha256": digest,
+            "size": len(content),
+            "gzip_size": len(compressed),
+        }
+        self.written += 1
+
+    def remove(self, paths: Iterable[str]) -> None:
+        for path in list(paths):
+            self.files.pop(path, None)
+            try:
+                os.remove(os.path.join(self.out_dir, path))
+            except FileNotFoundError:
+                pass
+            self.removed += 1
+
+
+def _export_category(db: Session, writer: _Writer, slug: str) -> None:
+    prefix = f"listings/{slug}/"
+    produced = set()
+    page = 1
+    while True:
+        products, total_count, has_more = crud.get_products(
+            db, skip=(page - 1) * PAGE_SIZE, limit=PAGE_SIZE, category_slug=slug
+        )
+        listing = schemas.ProductList.model_validate(
+            {"products": products, "total_count": total_count, "has_more": has_more},
+            from_attributes=True,
+        )
+        path = f"{prefix}{page}.json.gz"
+        writer.write(path, _encode(listing.model_dump(mode="json")))
+        produced.add(path)
+        if not has_more:
+            break
+        page += 1
+    # Страницы, которых больше нет
+    writer.remove(
+        path
+        for path in writer.files
+        if path.startswith(prefix) and path not in produced
+    )
+
+    filters = schemas.FilterOptions.model_validate(
+        crud.get_filters_for_category(db, category_slug=slug), from_attributes=True
+    )
+    writer.write(f"filters/{slug}.json.gz", _encode(filters.model_dump(mode="json")))
+
+
+def _export_product(db: Session, writer: _Writer, product_id: int) -> None:
+    path = f"products/{product_id}.json.gz"
+    payload = product_cache.get_product_detail(db, product_id=product_id)
+    if payload is None:
+        writer.remove([path])
+    else:
+        writer.write(path, payload.body)
+
+
+def _get_changed_products(db: Session, since: int) -> Tuple[Optional[Set[int]], int]:
+    """
+    id товаров, измененных после версии since, и новая версия.
+    None вместо множества - журнал не покрывает since.
+    """
+    product_ids = set()
+    while True:
+        page = changefeed.get_changes(
+            db, since=since, limit=changefeed.MAX_CHANGES_PAGE
+        )
+        if page["reset_required"]:
+            return None, page["version"]
+        product_ids.update(change["product_id"] for change in page["changes"])
+        since = page["version"]
+        if not page["has_more"]:
+            return product_ids, since
+
+
+def _with_ancestors(db: Session, product_ids: Set[int]) -> Set[str]:
+    """slug категорий товаров вместе со всеми родительскими."""
+    categories = {
+        category_id: (slug, parent_id)
+        for category_id, slug, parent_id in db.execute(
+            select(models.Category.id, models.Category.slug, models.Category.parent_id)
+        )
+    }
+    category_ids = set(
+        db.scalars(
+            select(models.Product.category_id).where(models.Product.id.in_(product_ids))
+        )
+    )
+    slugs = set()
+    for category_id in category_ids:
+        while category_id in categories:
+            slug, category_id = categories[category_id]
+            slugs.add(slug)
+    return slugs
+
+
+def export(db: Session, out_dir: str = DEFAULT_OUT_DIR, full: bool = False) -> _Writer:
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    product_ids = None
+    if manifest is not None and not full:
+        product_ids, version = _get_changed_products(db, manifest["version"])
+    if product_ids is None:
+        # Версия до чтения данных: изменения во время выгрузки попадут в следующую
+        version = changefeed.get_version(db)
+
+    writer = _Writer(out_dir, dict(manifest["files"]) if manifest else {})
+    if product_ids is None:
+        slugs = set(db.scalars(select(models.Category.slug)))
+        product_ids = set(db.scalars(select(models.Product.id)))
+        # Удаленные категории и товары
+        expected_prefixes = tuple(
+            [f"listings/{slug}/" for slug in slugs]
+            + [f"filters/{slug}." for slug in slugs]
+            + [f"products/{product_id}." for product_id in product_ids]
+        )
+        writer.remove(
+            path for path in writer.files if not path.startswith(expected_prefixes)
+        )
+    else:
+        slugs = _with_ancestors(db, product_ids)
+
+    for slug in sorted(slugs):
+        _export_category(db, writer, slug)
+    for product_id in sorted(product_ids):
+        _export_product(db, writer, product_id)
+
+    manifest = {
+        "version": version,
+        "generated_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "page_size": PAGE_SIZE,
+        "files": dict(sorted(writer.files.items())),
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return writer
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import SessionLocal
+
+    args = [arg for arg in sys.argv[1:] if arg != "--full"]
+    if len(args) > 1:
+        sys.exit("Использование: python export_static.py [каталог] [--full]")
+
+    db = SessionLocal()
+    try:
+        writer = export(
+            db, args[0] if args else DEFAULT_OUT_DIR, full="--full" in sys.argv[1:]
+        )
+        print(
+            f"✅ Записано файлов: {writer.written}, без изменений: "
+            f"{writer.unchanged}, удалено: {writer.removed}"
+        )
+    finally:
+        db.close()
@@ -0,0 +1,155 @@
+"""
+Страницы витрины и поиска (GET /api/products, /api/products/search)
+и фильтры категорий (GET /api/products/filters).
+
+Одинаковые одновременные запросы страницы (например, после рассылки
+тысячи клиентов открывают одну категорию с одной сортировкой) выполняются
+один раз: запросы объединяются по нормализованному ключу фильтров
+(singleflight), а результат разделяется в виде готового JSON вместе со
+сжатыми вариантами (compression.Precompressed).
+
+Фильтры категорий и первые страницы категорий без фильтров запрашиваются
+чаще всего и меняются редко: они отдаются из кэша stale-while-revalidate
+(см. swr) и обновляются в фоне.
+
+Результаты возвращаются вместе с ключами для кэширующего прокси
+(см. surrogate); отданное из кэша устаревшим помечается fresh=False.
+
+После изменения каталога (пространство имён "listings") новые запросы
+не присоединяются к выполнениям, начатым до изменения.
+"""
+
+import json
+import os
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+import cache
+import compression
+import crud
+import schemas
+import singleflight
+import surrogate
+import swr
+from surrogate import Tagged
+
+# Сколько объединенный запрос ждет ведущего, прежде чем выполниться сам
+LISTING_TIMEOUT = float(os.environ.get("LISTING_SINGLEFLIGHT_TIMEOUT", "5"))
+
+_group = singleflight.Group("listings", timeout=LISTING_TIMEOUT)
+cache.subscribe("listings", lambda keys: _group.forget())
+
+_first_pages = swr.SWRCache(
+    "category_first_pages", soft_ttl=30, hard_ttl=300, namespace="listings"
+)
+_filters = swr.SWRCache(
+    "category_filters", soft_ttl=60, hard_ttl=600, namespace="listings"
+)
+
+
+def _normalize(values: Optional[List[str]]) -> tuple:
+    return tuple(sorted(set(values or [])))
+
+
+def _encode(data) -> bytes:
+    # Тот же формат, что у JSONResponse
+    return json.dumps(
+        data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _load_listing(db: Session, search_query: Optional[str], **filters) -> Tagged:
+    products, total_count, has_more = crud.get_products(
+        db, search_query=search_query, **filters
+    )
+    listing = schemas.ProductList.model_validate(
+        {"products": products, "total_count": total_count, "has_more": has_more},
+        from_attributes=True,
+    )
+    return Tagged(
+        compression.Precompressed(_encode(listing.model_dump(mode="json"))),
+        surrogate.listing_keys(db, filters["category_slug"], products),
+    )
+
+
+def _load_filters(db: Session, category_slug: str) -> Tagged:
+    filters = crud.get_filters_for_category(db, category_slug=category_slug)
+    keys = surrogate.listing_keys(db, category_slug, []) + tuple(
+        surrogate.brand_key(brand["id"]) for brand in filters["brands"]
+    )
+    options = schemas.FilterOptions.model_validate(filters, from_attributes=True)
+    return Tagged(
+        compression.Precompressed(_encode(options.model_dump(mode="json"))), keys
+    )
+
+
+def get_listing(
+    db: Session,
+    skip: int = 0,
+    limit: int = 12,
+    category_slug: Optional[str] = None,
+    brand_slugs: Optional[List[str]] = None,
+    size_values: Optional[List[str]] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort_by: Optional[str] = None,
+    with_total: bool = True,
+    search_query: Optional[str] = None,
+) -> Tagged:
+    """
+    JSON страницы (schemas.ProductList) со сжатыми вариантами и ключами
+    прокси; параметры - как у crud.get_products.
+    """
+    filters = dict(
+        skip=skip,
+        limit=limit,
+        category_slug=category_slug,
+        brand_slugs=brand_slugs,
+        size_values=size_values,
+        min_price=min_price,
+        max_price=max_price,
+        sort_by=sort_by,
+        with_total=with_total,
+    )
+    if (
+        category_slug
+        and not skip
+        and not brand_slugs
+        and not size_values
+        and min_price is None
+        and max_price is None
+        and search_query is None
+    ):
+        page, fresh = _first_pages.get(
+            db,
+            (category_slug, sort_by, limit, with_total),
+            lambda session: _load_listing(session, None, **filters),
+        )
+        return page._replace(fresh=fresh)
+
+    # Порядок и повторы брендов и размеров на выборку не влияют
+    key = (
+        category_slug or None,
+        _normalize(brand_slugs),
+        _normalize(size_values),
+        min_price,
+        max_price,
+        sort_by,
+        search_query,
+        skip,
+        limit,
+        with_total,
+    )
+    return _group.do(key, lambda: _load_listing(db, search_query, **filters))
+
+
+def get_filters(db: Session, category_slug: str) -> Tagged:
+    """
+    JSON фильтров категории (schemas.FilterOptions) со сжатыми вариантами
+    и ключами прокси. Значение общее для всех запросов - изменять его нельзя.
+    """
+    filters, fresh = _filters.get(
+        db, category_slug, lambda session: _load_filters(session, category_slug)
+    )
+    return filters._replace(fresh=fresh)
@@ -0,0 +1,209 @@
+"""
+Список вариантов на дозаказ (таблица low_stock_variants).
+
+Вариант попадает в список, когда его остаток опускается до порога
+reorder_threshold, и покидает его после пополнения выше порога.
+crud вызывает sync() для вариантов, у которых изменились остаток, порог
+или статус, в той же транзакции, поэтому чтение списка не сканирует
+варианты. Полный пересчет (с созданием таблиц списка) нужен только
+для уже существующей базы:
+    python low_stock.py rebuild
+
+Версия списка для long-poll хранится в базе (low_stock_state) и меняется,
+только когда вариант входит в список или покидает его, поэтому она
+одинакова во всех воркерах. Канал events будит ожидающие запросы своего
+процесса, а затем версия перечитывается из базы.
+"""
+
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import Session
+
+import cache
+import cache_bus
+import events
+import models
+
+# Снятые с продажи варианты не дозаказываются
+TRACKED_STATUSES = (models.VariantStatus.ACTIVE, models.VariantStatus.SOLD_OUT)
+
+# Будит long-poll запросы процесса после коммита, изменившего список
+channel = events.get_channel("low_stock")
+
+
+def is_low(stock: int, reorder_threshold: int, status: models.VariantStatus) -> bool:
+    return status in TRACKED_STATUSES and stock <= reorder_threshold
+
+
+def get_version(db: Session) -> int:
+    """Текущая версия списка, общая для всех процессов."""
+    return (
+        db.scalar(
+            select(models.LowStockState.version).where(models.LowStockState.id == 1)
+        )
+        or 0
+    )
+
+
+def _bump_version(db: Session) -> None:
+    stmt = sqlite.insert(models.LowStockState).values(id=1, version=1)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={"version": models.LowStockState.version + 1},
+        )
+    )
+    cache_bus.publish(db, "low_stock")
+
+
+def sync(db: Session, variant_ids: Iterable[int]) -> bool:
+    """
+    Приводит записи списка для указанных вариантов в соответствие с их
+    остатками. Возвращает True, если вариант вошел в список или покинул
+    его; изменение остатка варианта, уже стоящего в списке, версию не
+    меняет. Коммит и уведомление своего процесса (notify) остаются
+    за вызывающим кодом, остальные процессы узнают об изменении через
+    шину инвалидации.
+    """
+    variant_ids = list(set(variant_ids))
+    if not variant_ids:
+        return False
+
+    variants = db.execute(
+        select(
+            models.ProductVariant.id,
+            models.ProductVariant.product_id,
+            models.ProductVariant.stock,
+            models.ProductVariant.reorder_threshold,
+            models.ProductVariant.status,
+        ).where(models.ProductVariant.id.in_(variant_ids))
+    ).all()
+    listed = {
+        variant_id: (stock, reorder_threshold)
+        for variant_id, stock, reorder_threshold in db.execute(
+            select(
+                models.LowStockVariant.variant_id,
+                models.LowStockVariant.stock,
+                models.LowStockVariant.reorder_threshold,
+            ).where(models.LowStockVariant.variant_id.in_(variant_ids))
+        )
+    }
+
+    changed = False
+    for variant_id, product_id, stock, reorder_threshold, status in variants:
+        low = is_low(stock, reorder_threshold, status)
+        if low and variant_id not in listed:
+            db.execute(
+                insert(models.LowStockVariant).values(
+                    variant_id=variant_id,
+                    product_id=product_id,
+                    stock=stock,
+                    reorder_threshold=reorder_threshold,
+                )
+            )
+        elif not low and variant_id in listed:
+            db.execute(
+                delete(models.LowStockVariant).where(
+                    models.LowStockVariant.variant_id == variant_id
+                )
+            )
+        else:
+            # Вариант остается по ту же сторону порога: список прежний,
+            # обновляются только показанные в нем остаток и порог
+            if low and listed[variant_id] != (stock, reorder_threshold):
+                db.execute(
+                    update(models.LowStockVariant)
+                    .where(models.LowStockVariant.variant_id == variant_id)
+                    .values(stock=stock, reorder_threshold=reorder_threshold)
+                )
+            continue
+        changed = True
+
+    if changed:
+        _bump_version(db)
+    return changed
+
+
+def notify() -> int:
+    """Сообщает ожидающим long-poll запросам об изменении списка."""
+    return channel.publish()
+
+
+def _on_remote_change(keys) -> None:
+    notify()
+
+
+cache.subscribe("low_stock", _on_remote_change)
+
+
+def rebuild(db: Session) -> int:
+    """Пересчитывает список по всем вариантам. Возвращает его размер."""
+    db.execute(delete(models.LowStockVariant))
+    db.execute(
+        insert(models.LowStockVariant).from_select(
+            ["variant_id", "product_id", "stock", "reorder_threshold"],
+            select(
+                models.ProductVariant.id,
+                models.ProductVariant.product_id,
+                models.ProductVariant.stock,
+                models.ProductVariant.reorder_threshold,
+            ).where(
+                models.ProductVariant.status.in_(TRACKED_STATUSES),
+                models.ProductVariant.stock <= models.ProductVariant.reorder_threshold,
+            ),
+        )
+    )
+    _bump_version(db)
+    db.commit()
+    notify()
+    return db.scalar(select(func.count()).select_from(models.LowStockVariant))
+
+
+def get_low_stock_variants(db: Session) -> List[Dict[str, Any]]:
+    """Варианты на дозаказ: сначала те, что дольше всего в списке."""
+    stmt = (
+        select(
+            models.LowStockVariant.variant_id,
+            models.LowStockVariant.product_id,
+            models.Product.name.label("product_name"),
+            models.ProductVariant.sku,
+            models.LowStockVariant.stock,
+            models.LowStockVariant.reorder_threshold,
+            models.LowStockVariant.since,
+        )
+        .join(models.Product, models.Product.id == models.LowStockVariant.product_id)
+        .join(
+            models.ProductVariant,
+            models.ProductVariant.id == models.LowStockVariant.variant_id,
+        )
+        .order_by(models.LowStockVariant.since, models.LowStockVariant.variant_id)
+    )
+    return [row._asdict() for row in db.execute(stmt)]
+
+
+if __name__ == "__main__":
+    import sys
+
+    import database
+
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("Использование: python low_stock.py rebuild")
+
+    # В базе, созданной до появления списка, нет его таблиц, шины
+    # инвалидации и порогов вариантов. Сессия привязана к двум базам,
+    # поэтому движок указывается явно
+    models.add_missing_columns()
+    for table in (
+        models.LowStockVariant.__table__,
+        models.LowStockState.__table__,
+        models.CacheInvalidation.__table__,
+    ):
+        table.create(database.engine, checkfirst=True)
+
+    db = database.SessionLocal()
+    try:
+        print(f"✅ Вариантов на дозаказ: {rebuild(db)}")
+    finally:
+        db.close()
@@ -1,10 +1,45 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import anyio.to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import products, checkout, admin
+from fastapi.responses import JSONResponse
+
+import cache_bus
+import orders_db
+import snapshot
+import warmup
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from database import THREADPOOL_SIZE
+from routers import products, checkout, admin, cart, analytics, catalog, variants
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Синхронные обработчики выполняются в пуле потоков anyio
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Инвалидации кэшей из других воркеров
+    cache_bus.start()
+    # Прогрев идет в фоне, пока /ready не сообщит о готовности
+    warmup_task = asyncio.create_task(asyncio.to_thread(warmup.run))
+    # Возврат остатков по резервам, оставшимся без заказа
+    sweeper_task = asyncio.create_task(orders_db.run_sweeper())
+    # Общий снимок каталога; строит один воркер машины (см. snapshot.py)
+    snapshot_task = asyncio.create_task(snapshot.run_builder())
+    yield
+    warmup_task.cancel()
+    sweeper_task.cancel()
+    snapshot_task.cancel()
+    cache_bus.stop()
 
-app = FastAPI()
 
+app = FastAPI(lifespan=lifespan)
+
+# Контроль допуска по классам запросов (см. admission.py); внутри CORS,
+# чтобы браузер мог прочитать ответ 503
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -12,11 +47,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Сжатие ответов по Accept-Encoding (см. compression.py)
+app.add_middleware(CompressionMiddleware)
 
 app.include_router(products.router, prefix="/api")
+app.include_router(variants.router, prefix="/api")
 app.include_router(checkout.router, prefix="/api")
+app.include_router(cart.router, prefix="/api")
+app.include_router(catalog.router, prefix="/api")
 # app.include_router(categories.router, prefix="/api")
 app.include_router(admin.router, prefix="/api")
+app.include_router(analytics.router, prefix="/api")
+
+
+@app.get("/ready")
+def read_ready():
+    """
+    Readiness probe: 503 until the startup warm-up has finished.
+    """
+    state = warmup.get_state()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=state)
+    return state
 
 
 # @app.get("/")
@@ -1,12 +1,13 @@
-from database import Base
+from database import Base, OrdersBase, engine, orders_engine
 
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from typing import List, Optional
 from decimal import Decimal
 
 from sqlalchemy import (
     Column,
+    Date,
     DateTime,
     ForeignKey,
     Integer,
@@ -16,6 +17,7 @@ from sqlalchemy import (
     UniqueConstraint,
     Index,
     Boolean,
+    event,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
@@ -158,6 +160,10 @@ class ProductVariant(Base, TimestampMixin):
     price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
 
     stock: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Остаток, при котором вариант попадает в список на дозаказ
+    reorder_threshold: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
 
     # Relationships
     product: Mapped["Product"] = relationship("Product", back_populates="variants")
@@ -165,7 +171,11 @@ class ProductVariant(Base, TimestampMixin):
         "VariantAttribute", back_populates="variant", cascade="all, delete-orphan"
     )
     order_items: Mapped[List["OrderItem"]] = relationship(
-        "OrderItem", back_populates="variant"
+        "OrderItem",
+        primaryjoin="ProductVariant.id == OrderItem.variant_id",
+        foreign_keys="OrderItem.variant_id",
+        back_populates="variant",
+        viewonly=True,
     )
 
     __table_args__ = (
@@ -186,6 +196,12 @@ class ProductVariant(Base, TimestampMixin):
             raise ValueError("Stock cannot be negative")
         return value
 
+    @validates("reorder_threshold")
+    def validate_reorder_threshold(self, key, value):
+        if value < 0:
+            raise ValueError("Reorder threshold cannot be negative")
+        return value
+
 
 class Attribute(Base, TimestampMixin):
     """Атрибуты продуктов (цвет, размер и т.д.)"""
@@ -253,8 +269,8 @@ class ProductImage(Base, TimestampMixin):
     __table_args__ = (Index("ix_images_product_id", "product_id"),)
 
 
-class Order(Base, TimestampMixin):
-    """Заказы"""
+class Order(OrdersBase, TimestampMixin):
+    """Заказы (база заказов)"""
 
     __tablename__ = "orders"
 
@@ -280,6 +296,10 @@ class Order(Base, TimestampMixin):
     delivered_at: Mapped[Optional[datetime]] = mapped_column(
         DateTime(timezone=True), nullable=True
     )
+    # Резерв остатков в базе каталога, под который создан заказ
+    reservation_id: Mapped[Optional[int]] = mapped_column(
+        Integer, nullable=True, unique=True
+    )
 
     # Relationships
     items: Mapped[List["OrderItem"]] = relationship(
@@ -290,11 +310,13 @@ class Order(Base, TimestampMixin):
         Index("ix_orders_status", "status"),
         Index("ix_orders_customer_name", "customer_name"),
         Index("ix_orders_customer_phone", "customer_phone"),
+        # Keyset-пагинация списка заказов в админке
+        Index("ix_orders_created_at_id", "created_at", "id"),
     )
 
 
-class OrderItem(Base, TimestampMixin):
-    """Элементы заказа"""
+class OrderItem(OrdersBase, TimestampMixin):
+    """Элементы заказа (база заказов)"""
 
     __tablename__ = "order_items"
 
@@ -302,9 +324,8 @@ class OrderItem(Base, TimestampMixin):
     order_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False
     )
-    variant_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("product_variants.id"), nullable=False
-    )
+    # Вариант лежит в базе каталога - внешний ключ между файлами невозможен
+    variant_id: Mapped[int] = mapped_column(Integer, nullable=False)
     quantity: Mapped[int] = mapped_column(Integer, nullable=False)
     unit_price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
     total_price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
@@ -312,10 +333,394 @@ class OrderItem(Base, TimestampMixin):
     # Relationships
     order: Mapped["Order"] = relationship("Order", back_populates="items")
     variant: Mapped["ProductVariant"] = relationship(
-        "ProductVariant", back_populates="order_items"
+        "ProductVariant",
+        primaryjoin="OrderItem.variant_id == ProductVariant.id",
+        foreign_keys=[variant_id],
+        back_populates="order_items",
     )
 
     __table_args__ = (
         Index("ix_order_items_variant_id", "variant_id"),
         Index("ix_order_items_order_id", "order_id"),
     )
+
+
+class StockReservation(Base):
+    """
+    Остатки, списанные под заказ, который еще не записан в базу заказов.
+    Первая фаза оформления списывает остатки и создает резерв в одной
+    транзакции базы каталога, вторая - создает заказ с reservation_id.
+    Резервы без заказа возвращают остатки (см. orders_db.sweep_reservations).
+    """
+
+    __tablename__ = "stock_reservations"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # JSON-список [variant_id, quantity]
+    items: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_stock_reservations_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class StockReturn(Base):
+    """
+    Остатки, которые нужно вернуть на склад после отмены заказа. Запись
+    создается до смены статуса в базе заказов, а остатки возвращаются
+    и запись удаляется одной транзакцией базы каталога. Записи, оставшиеся
+    после сбоя, завершает orders_db.sweep_stock_returns: возвращает
+    остатки, если заказ отменен, иначе просто удаляет запись.
+    """
+
+    __tablename__ = "stock_returns"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # JSON-список [variant_id, quantity]
+    items: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_stock_returns_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class LowStockVariant(Base):
+    """
+    Варианты, остаток которых опустился до порога дозаказа.
+    Поддерживается в crud при изменении остатков, а не вычисляется запросом.
+    """
+
+    __tablename__ = "low_stock_variants"
+
+    variant_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("product_variants.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    product_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False
+    )
+    stock: Mapped[int] = mapped_column(Integer, nullable=False)
+    reorder_threshold: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Когда вариант пересек порог
+    since: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    variant: Mapped["ProductVariant"] = relationship("ProductVariant")
+    product: Mapped["Product"] = relationship("Product")
+
+    __table_args__ = (Index("ix_low_stock_variants_since", "since"),)
+
+
+class LowStockState(Base):
+    """
+    Состояние списка на дозаказ (одна строка): version растет, когда
+    вариант входит в список или покидает его. Общая для всех процессов
+    версия для long-poll.
+    """
+
+    __tablename__ = "low_stock_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class SalesRollupMixin:
+    """Накопительные показатели продаж за день"""
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    orders_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    units: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(12, 2), default=0, nullable=False)
+
+
+class SalesDaily(OrdersBase, SalesRollupMixin):
+    """Продажи по дням"""
+
+    __tablename__ = "sales_daily"
+
+
+class SalesDailyVariant(OrdersBase, SalesRollupMixin):
+    """Продажи по дням в разрезе вариантов"""
+
+    __tablename__ = "sales_daily_variants"
+
+    variant_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    __table_args__ = (Index("ix_sales_daily_variants_variant_id", "variant_id"),)
+
+
+class SalesDailyBrand(OrdersBase, SalesRollupMixin):
+    """Продажи по дням в разрезе брендов"""
+
+    __tablename__ = "sales_daily_brands"
+
+    brand_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+
+class SalesDailyCategory(OrdersBase, SalesRollupMixin):
+    """Продажи по дням в разрезе категорий"""
+
+    __tablename__ = "sales_daily_categories"
+
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+
+class ChangeKind(str, Enum):
+    """Что изменилось в записи каталога"""
+
+    PRICE = "price"
+    STOCK = "stock"
+    STATUS = "status"
+    CONTENT = "content"
+
+
+class CatalogChange(Base):
+    """
+    Журнал изменений каталога для инкрементальной синхронизации клиентов.
+    id монотонно растет (AUTOINCREMENT не переиспользует номера удаленных
+    строк) и служит версией каталога.
+    """
+
+    __tablename__ = "catalog_changes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    product_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # None - изменение товара целиком, а не отдельного варианта
+    variant_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    kind: Mapped[ChangeKind] = mapped_column(String(20), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_catalog_changes_key", "product_id", "variant_id", "kind"),
+        Index("ix_catalog_changes_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class CatalogFeedState(Base):
+    """
+    Состояние журнала изменений (одна строка): изменения с версией
+    не больше min_version удалены по сроку хранения.
+    """
+
+    __tablename__ = "catalog_feed_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    min_version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class CacheInvalidation(Base):
+    """
+    Шина инвалидации кэшей между процессами: какие пространства имён
+    и ключи изменились (см. cache_bus).
+    """
+
+    __tablename__ = "cache_invalidations"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # Процесс-источник: свои записи процесс не применяет повторно
+    origin: Mapped[str] = mapped_column(String(64), nullable=False)
+    namespace: Mapped[str] = mapped_column(String(50), nullable=False)
+    # JSON-список ключей; NULL - всё пространство имён
+    keys: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_cache_invalidations_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class OrderEventKind(str, Enum):
+    """Событие заказа для потока админки"""
+
+    CREATED = "order_created"
+    STATUS_CHANGED = "order_status_changed"
+
+
+class OrderEvent(OrdersBase):
+    """
+    Журнал событий заказов (база заказов) для потока админки (см.
+    order_events). id служит номером события SSE: переподключившийся
+    клиент продолжает с Last-Event-ID.
+    """
+
+    __tablename__ = "order_events"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[OrderEventKind] = mapped_column(String(30), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_order_events_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+# Полнотекстовый поиск по товарам (SQLite FTS5).
+# rowid виртуальной таблицы совпадает с products.id; бренд и категория
+# денормализованы и поддерживаются триггерами.
+# unicode61 корректно приводит к нижнему регистру кириллицу,
+# remove_diacritics 2 дополнительно отождествляет "ё"/"е" и "й"/"и".
+PRODUCTS_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, brand, category,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description, brand, category)
+        VALUES (
+            new.id,
+            new.name,
+            new.description,
+            (SELECT name FROM brands WHERE id = new.brand_id),
+            (SELECT name FROM categories WHERE id = new.category_id)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au
+    AFTER UPDATE OF name, description, brand_id, category_id ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+        INSERT INTO products_fts(rowid, name, description, brand, category)
+        VALUES (
+            new.id,
+            new.name,
+            new.description,
+            (SELECT name FROM brands WHERE id = new.brand_id),
+            (SELECT name FROM categories WHERE id = new.category_id)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS brands_fts_au AFTER UPDATE OF name ON brands BEGIN
+        UPDATE products_fts SET brand = new.name
+        WHERE rowid IN (SELECT id FROM products WHERE brand_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS brands_fts_ad AFTER DELETE ON brands BEGIN
+        UPDATE products_fts SET brand = NULL
+        WHERE rowid IN (SELECT id FROM products WHERE brand_id = old.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS categories_fts_au AFTER UPDATE OF name ON categories BEGIN
+        UPDATE products_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM products WHERE category_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS categories_fts_ad AFTER DELETE ON categories BEGIN
+        UPDATE products_fts SET category = NULL
+        WHERE rowid IN (SELECT id FROM products WHERE category_id = old.id);
+    END
+    """,
+]
+
+PRODUCTS_FTS_REBUILD = [
+    "DELETE FROM products_fts",
+    """
+    INSERT INTO products_fts(rowid, name, description, brand, category)
+    SELECT p.id, p.name, p.description, b.name, c.name
+    FROM products p
+    LEFT JOIN brands b ON b.id = p.brand_id
+    LEFT JOIN categories c ON c.id = p.category_id
+    """,
+]
+
+
+def create_products_fts(target, connection, tables=None, **kw):
+    """
+    Создает FTS-индекс с триггерами и заполняет его текущими товарами.
+    Вызывается из metadata.create_all(), в том числе для уже существующей базы.
+    """
+    if tables is not None and Product.__table__ not in tables:
+        return  # Создаются таблицы другой базы (заказов)
+    for ddl in PRODUCTS_FTS_DDL + PRODUCTS_FTS_REBUILD:
+        connection.exec_driver_sql(ddl)
+
+
+def drop_products_fts(target, connection, tables=None, **kw):
+    if tables is not None and Product.__table__ not in tables:
+        return
+    connection.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+
+
+event.listen(Base.metadata, "after_create", create_products_fts)
+event.listen(Base.metadata, "before_drop", drop_products_fts)
+
+
+# Таблицы каждой базы: заказы и все, что обновляется вместе с ними,
+# хранятся отдельно от каталога
+ORDERS_TABLES = [
+    mapper.local_table
+    for mapper in Base.registry.mappers
+    if issubclass(mapper.class_, OrdersBase)
+]
+CATALOG_TABLES = [
+    table for table in Base.metadata.sorted_tables if table not in ORDERS_TABLES
+]
+
+
+def create_tables(drop: bool = False) -> None:
+    """Создает таблицы каталога и заказов, каждую в своей базе."""
+    for bind, tables in ((engine, CATALOG_TABLES), (orders_engine, ORDERS_TABLES)):
+        if drop:
+            Base.metadata.drop_all(bind, tables=tables)
+        Base.metadata.create_all(bind, tables=tables)
+
+
+# Колонки, добавленные в таблицы каталога после их создания: create_all()
+# существующие таблицы не изменяет. (таблица, колонка, определение)
+ADDED_COLUMNS = [
+    ("product_variants", "reorder_threshold", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+def add_missing_columns() -> List[str]:
+    """
+    Добавляет в существующие таблицы базы каталога недостающие колонки
+    из ADDED_COLUMNS. Повторный вызов ничего не меняет. Возвращает
+    добавленные колонки ("таблица.колонка").
+    """
+    added = []
+    with engine.begin() as conn:
+        for table_name, column_name, definition in ADDED_COLUMNS:
+            columns = {
+                row[1]
+                for row in conn.exec_driver_sql(f"PRAGMA table_info({table_name})")
+            }
+            # Таблицы еще нет - ее со всеми колонками создаст create_all()
+            if columns and column_name not in columns:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"
+                )
+                added.append(f"{table_name}.{column_name}")
+    return added
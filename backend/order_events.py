@@ -0,0 +1,210 @@
+"""
+Поток событий заказов для админки (GET /api/admin/orders/events, SSE).
+
+crud записывает событие в order_events в той же транзакции, что и сам
+заказ, и после коммита вызывает notify(). В каждом воркере один
+концентратор читает новые события одним запросом на всех клиентов и
+раздает их через ограниченные очереди; события других воркеров он
+находит опросом раз в POLL_INTERVAL, пока подключен хотя бы один клиент.
+Без клиентов концентратор остановлен и ничего не стоит.
+
+Клиент, не успевающий читать, отключается и переподключается с
+Last-Event-ID: пропущенное дочитывается из журнала. Если журнал уже не
+покрывает его позицию, клиент получает событие reset и перечитывает
+список заказов целиком.
+"""
+
+import asyncio
+import os
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session, noload
+
+import events
+import models
+import schemas
+from database import ReadSessionLocal
+
+POLL_INTERVAL = float(os.environ.get("ORDER_EVENTS_INTERVAL", "1"))
+RETENTION_DAYS = 7
+# Сообщений в очереди клиента до отключения
+CLIENT_BUFFER = 100
+# Сколько событий дочитывается при переподключении до reset
+BACKFILL_LIMIT = 1000
+KEEPALIVE_SECONDS = 15
+
+channel = events.get_channel("order_events")
+
+# (номер события, готовое сообщение SSE)
+Message = Tuple[int, str]
+
+
+def record(db: Session, order_id: int, kind: models.OrderEventKind) -> None:
+    """Добавляет событие в транзакцию изменения заказа."""
+    db.add(models.OrderEvent(order_id=order_id, kind=kind))
+
+
+def notify() -> int:
+    """Будит концентратор этого воркера после коммита."""
+    return channel.publish()
+
+
+def trim(db: Session, days: int = RETENTION_DAYS) -> int:
+    """Удаляет события старше days дней. Возвращает число удаленных."""
+    deleted = db.execute(
+        delete(models.OrderEvent).where(
+            models.OrderEvent.created_at < func.datetime("now", f"-{int(days)} days")
+        )
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+def _get_last_id() -> int:
+    db = ReadSessionLocal()
+    try:
+        return db.scalar(select(func.max(models.OrderEvent.id))) or 0
+    finally:
+        db.close()
+
+
+def _load_messages(after_id: int, limit: int) -> List[Message]:
+    """
+    События после after_id с текущим состоянием заказов; заказы читаются
+    одним запросом на всю пачку.
+    """
+    db = ReadSessionLocal()
+    try:
+        rows = db.execute(
+            select(
+                models.OrderEvent.id,
+                models.OrderEvent.order_id,
+                models.OrderEvent.kind,
+            )
+            .where(models.OrderEvent.id > after_id)
+            .order_by(models.OrderEvent.id)
+            .limit(limit)
+        ).all()
+        order_ids = {row.order_id for row in rows}
+        # Позиции в сообщение не входят - не загружаем их, как список заказов
+        orders = {
+            order.id: schemas.AdminOrderListItem.model_validate(order)
+            for order in db.scalars(
+                select(models.Order)
+                .options(noload(models.Order.items))
+                .where(models.Order.id.in_(order_ids))
+            )
+        }
+        return [
+            (
+                row.id,
+                f"id: {row.id}\nevent: {row.kind}\n"
+                f"data: {orders[row.order_id].model_dump_json(exclude={'items'})}\n\n",
+            )
+            for row in rows
+            if row.order_id in orders
+        ]
+    finally:
+        db.close()
+
+
+class _Hub:
+    def __init__(self):
+        self.clients: Set[asyncio.Queue] = set()
+        self.last_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def subscribe(self) -> Tuple[asyncio.Queue, int]:
+        """
+        Регистрирует клиента. Возвращает его очередь и номер события,
+        после которого в очередь попадает все новое.
+        """
+        if self.last_id is None:
+            self.last_id = await asyncio.to_thread(_get_last_id)
+        # Одно место зарезервировано под отметку переполнения (None)
+        queue = asyncio.Queue(CLIENT_BUFFER + 1)
+        self.clients.add(queue)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return queue, self.last_id
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.clients.discard(queue)
+
+    def _fan_out(self, messages: List[Message]) -> None:
+        for queue in list(self.clients):
+            for message in messages:
+                if queue.qsize() >= CLIENT_BUFFER:
+                    queue.put_nowait(None)
+                    self.clients.discard(queue)
+                    break
+                queue.put_nowait(message)
+
+    async def _run(self) -> None:
+        try:
+            while self.clients:
+                version = channel.version
+                try:
+                    messages = await asyncio.to_thread(
+                        _load_messages, self.last_id, BACKFILL_LIMIT
+                    )
+                except Exception as e:
+                    print(f"Ошибка чтения событий заказов: {e}")
+                    messages = []
+                if messages:
+                    self.last_id = messages[-1][0]
+                    self._fan_out(messages)
+                    if len(messages) == BACKFILL_LIMIT:
+                        continue
+                await channel.wait(version, POLL_INTERVAL)
+        finally:
+            # Следующий клиент начнет с актуального конца журнала
+            self.task = None
+            self.last_id = None
+
+
+_hub = _Hub()
+
+
+async def stream(request, last_event_id: Optional[int] = None):
+    """Сообщения SSE для одного клиента."""
+    queue, sent_id = await _hub.subscribe()
+    try:
+        # Клиент переподключается быстро - пропущенное дочитается
+        yield "retry: 1000\n\n"
+
+        if last_event_id is not None and last_event_id < sent_id:
+            backlog = await asyncio.to_thread(
+                _load_messages, last_event_id, BACKFILL_LIMIT
+            )
+            backlog = [message for message in backlog if message[0] <= sent_id]
+            complete = bool(backlog) and backlog[-1][0] == sent_id
+            # Номера идут подряд; разрыв значит, что часть журнала удалена
+            if not complete or backlog[0][0] != last_event_id + 1:
+                yield f"id: {sent_id}\nevent: reset\ndata: {{}}\n\n"
+            else:
+                for _, message in backlog:
+                    yield message
+        elif last_event_id is not None:
+            # Клиент уже видел события, которые этот воркер еще не прочитал
+            sent_id = last_event_id
+
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+                continue
+
+            if item is None:
+                # Очередь переполнена: клиент переподключится с Last-Event-ID
+                return
+            event_id, message = item
+            if event_id > sent_id:
+                sent_id = event_id
+                yield message
+    finally:
+        _hub.unsubscribe(queue)
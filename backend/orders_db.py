@@ -0,0 +1,227 @@
+"""
+Обслуживание базы заказов (ORDERS_DATABASE_PATH, см. database.py).
+
+    python orders_db.py migrate - переносит заказы и таблицы продаж
+                                  из shop.db в базу заказов
+    python orders_db.py sweep   - снимает зависшие резервы остатков,
+                                  завершает возвраты остатков отмененных
+                                  заказов и удаляет устаревшие события заказов
+
+Оформление заказа двухфазное: остатки списываются вместе с резервом
+в базе каталога, затем заказ с reservation_id пишется в базу заказов.
+sweep_reservations() удаляет резервы, под которые заказ создан, и
+возвращает остатки по резервам без заказа (процесс упал между фазами).
+
+Отмена заказа устроена так же: запись о возврате остатков создается
+в базе каталога до смены статуса в базе заказов. sweep_stock_returns()
+возвращает остатки по записям отмененных заказов и удаляет записи,
+статус заказа которых так и не сменился.
+
+Воркеры выполняют обе очистки периодически (run_sweeper из lifespan).
+Для базы, перенесенной раньше появления новых таблиц каталога, повторный
+migrate создает их.
+"""
+
+import asyncio
+import os
+from typing import Dict, Tuple
+
+from sqlalchemy import delete, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+import crud
+import models
+import order_events
+from database import (
+    ORDERS_DATABASE_PATH,
+    SessionLocal,
+    engine,
+    orders_engine,
+)
+
+# Резерв старше этого срока без заказа считается брошенным, секунды
+RESERVATION_TIMEOUT = 300
+SWEEP_INTERVAL = 60
+SWEEP_BATCH = 500
+MIGRATE_BATCH = 1000
+
+
+def sweep_reservations(
+    db: Session, older_than: float = RESERVATION_TIMEOUT
+) -> Tuple[int, int]:
+    """
+    Обрабатывает резервы старше older_than секунд.
+    Возвращает (удалено завершенных, возвращено на склад).
+    """
+    reservation_ids = db.scalars(
+        select(models.StockReservation.id)
+        .where(
+            models.StockReservation.created_at
+            < func.datetime("now", f"-{int(older_than)} seconds")
+        )
+        .order_by(models.StockReservation.id)
+        .limit(SWEEP_BATCH)
+    ).all()
+    if not reservation_ids:
+        return 0, 0
+
+    completed = set(
+        db.scalars(
+            select(models.Order.reservation_id).where(
+                models.Order.reservation_id.in_(reservation_ids)
+            )
+        )
+    )
+    if completed:
+        db.execute(
+            delete(models.StockReservation).where(
+                models.StockReservation.id.in_(completed)
+            )
+        )
+        db.commit()
+
+    released = 0
+    for reservation_id in reservation_ids:
+        if reservation_id not in completed:
+            released += crud.release_stock_reservation(db, reservation_id)
+    return len(completed), released
+
+
+def sweep_stock_returns(
+    db: Session, older_than: float = RESERVATION_TIMEOUT
+) -> Tuple[int, int]:
+    """
+    Обрабатывает записи о возврате остатков старше older_than секунд.
+    Возвращает (удалено без возврата, возвращено на склад).
+    """
+    stock_returns = db.execute(
+        select(models.StockReturn.id, models.StockReturn.order_id)
+        .where(
+            models.StockReturn.created_at
+            < func.datetime("now", f"-{int(older_than)} seconds")
+        )
+        .order_by(models.StockReturn.id)
+        .limit(SWEEP_BATCH)
+    ).all()
+    if not stock_returns:
+        return 0, 0
+
+    cancelled = set(
+        db.scalars(
+            select(models.Order.id).where(
+                models.Order.id.in_({order_id for _, order_id in stock_returns}),
+                models.Order.status == models.OrderStatus.CANCELLED,
+            )
+        )
+    )
+    # Статус не сменился (сбой до второй фазы) - возвращать нечего
+    abandoned = [
+        stock_return_id
+        for stock_return_id, order_id in stock_returns
+        if order_id not in cancelled
+    ]
+    if abandoned:
+        db.execute(
+            delete(models.StockReturn).where(models.StockReturn.id.in_(abandoned))
+        )
+        db.commit()
+
+    returned = 0
+    for stock_return_id, order_id in stock_returns:
+        if order_id in cancelled:
+            returned += crud.apply_stock_return(db, stock_return_id)
+    return len(abandoned), returned
+
+
+def sweep() -> Tuple[int, int, int]:
+    """
+    Снимает зависшие резервы, завершает возвраты остатков и удаляет
+    устаревшие события заказов. Возвращает (завершенных резервов,
+    возвращено по резервам, возвращено по отмененным заказам).
+    """
+    db = SessionLocal()
+    try:
+        order_events.trim(db)
+        completed, released = sweep_reservations(db)
+        _, returned = sweep_stock_returns(db)
+        return completed, released, returned
+    finally:
+        db.close()
+
+
+async def run_sweeper(interval: float = SWEEP_INTERVAL) -> None:
+    """Периодическая очистка резервов в фоне воркера."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception as e:
+            print(f"Ошибка очистки резервов остатков: {e}")
+
+
+def migrate() -> Dict[str, int]:
+    """
+    Добавляет недостающие колонки таблиц каталога, переносит таблицы заказов
+    из базы каталога в базу заказов и удаляет их из базы каталога.
+    Возвращает число перенесенных строк по таблицам.
+    """
+    for column in models.add_missing_columns():
+        print(f"✅ Добавлена колонка {column}")
+
+    # Общая база (ORDERS_DATABASE_PATH=./shop.db): переносить некуда
+    if os.path.abspath(engine.url.database) == os.path.abspath(ORDERS_DATABASE_PATH):
+        return {}
+
+    source_tables = set(inspect(engine).get_table_names())
+    tables = [
+        table
+        for table in models.Base.metadata.sorted_tables
+        if table in models.ORDERS_TABLES and table.name in source_tables
+    ]
+
+    models.Base.metadata.create_all(orders_engine, tables=models.ORDERS_TABLES)
+    copied = {}
+    with engine.connect() as source, orders_engine.begin() as target:
+        for table in tables:
+            if target.scalar(select(func.count()).select_from(table)):
+                raise ValueError(f"В базе заказов уже есть данные таблицы {table.name}")
+
+            # Колонки, добавленные после переноса (reservation_id), остаются пустыми
+            columns = [
+                table.c[column["name"]]
+                for column in inspect(source).get_columns(table.name)
+                if column["name"] in table.c
+            ]
+            result = source.execute(select(*columns))
+            copied[table.name] = 0
+            while rows := result.fetchmany(MIGRATE_BATCH):
+                target.execute(insert(table), [row._asdict() for row in rows])
+                copied[table.name] += len(rows)
+
+    with engine.begin() as source:
+        for table in reversed(tables):
+            table.drop(source)
+
+    # Новые таблицы каталога (резервы остатков)
+    models.create_tables()
+    return copied
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1:]
+    if command == ["migrate"]:
+        copied = migrate()
+        if not copied:
+            print("✅ Переносить нечего")
+        for table_name, count in copied.items():
+            print(f"✅ {table_name}: перенесено строк {count}")
+    elif command == ["sweep"]:
+        completed, released, returned = sweep()
+        print(
+            f"✅ Завершенных резервов: {completed}, возвращено на склад: {released}, "
+            f"по отмененным заказам: {returned}"
+        )
+    else:
+        sys.exit("Использование: python orders_db.py migrate|sweep")
@@ -0,0 +1,187 @@
+"""
+Распределение цен доступных к заказу вариантов по категориям.
+
+Для каждой категории хранится счетчик "цена в копейках -> число вариантов".
+Полное состояние строится один раз - из снимка каталога, а товары,
+измененные после снимка, из базы (snapshot.get_view); без снимка -
+проходом по вариантам в базе. Дальше состояние обновляется только по
+товарам, о которых сообщила инвалидация "products".
+Гистограмма поддерева собирается слиянием счетчиков, без обращения к базе.
+"""
+
+import threading
+from collections import Counter
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import cache
+import models
+import snapshot
+
+# Число интервалов гистограммы
+PRICE_BUCKETS = 10
+
+_lock = threading.Lock()
+_ready = False
+# variant_id -> (product_id, category_id, цена в копейках) для доступных вариантов
+_variants: Dict[int, Tuple[int, int, int]] = {}
+# product_id -> id его доступных вариантов
+_product_variants: Dict[int, Set[int]] = {}
+# category_id -> Counter(цена в копейках -> число вариантов)
+_category_prices: Dict[int, Counter] = {}
+# Готовые гистограммы по набору категорий поддерева
+_histograms: Dict[Tuple[int, ...], Optional[Dict[str, Any]]] = {}
+_pending_product_ids: Set[int] = set()
+
+
+def _to_cents(price: Decimal) -> int:
+    return int(Decimal(price) * 100)
+
+
+def _variants_stmt():
+    return select(
+        models.ProductVariant.id,
+        models.ProductVariant.product_id,
+        models.Product.category_id,
+        models.ProductVariant.price,
+        models.ProductVariant.stock,
+        models.ProductVariant.status,
+    ).join(models.Product)
+
+
+def _remove_product_locked(product_id: int) -> None:
+    for variant_id in _product_variants.pop(product_id, ()):
+        _, category_id, cents = _variants.pop(variant_id)
+        prices = _category_prices[category_id]
+        prices[cents] -= 1
+        if prices[cents] <= 0:
+            del prices[cents]
+
+
+def _add_variant_locked(
+    variant_id: int, product_id: int, category_id: int, cents: int
+) -> None:
+    _variants[variant_id] = (product_id, category_id, cents)
+    _product_variants.setdefault(product_id, set()).add(variant_id)
+    _category_prices.setdefault(category_id, Counter())[cents] += 1
+
+
+def _add_variants_locked(rows: Iterable[Tuple]) -> None:
+    for variant_id, product_id, category_id, price, stock, status in rows:
+        if category_id is None or stock <= 0 or status != models.VariantStatus.ACTIVE:
+            continue
+        _add_variant_locked(variant_id, product_id, category_id, _to_cents(price))
+
+
+def _rebuild_locked(db: Session) -> None:
+    global _ready
+
+    _variants.clear()
+    _product_variants.clear()
+    _category_prices.clear()
+    _histograms.clear()
+    _pending_product_ids.clear()
+    view = snapshot.get_view(db)
+    if view is None:
+        _add_variants_locked(
+            db.execute(
+                _variants_stmt().where(
+                    models.ProductVariant.stock > 0,
+                    models.ProductVariant.status == models.VariantStatus.ACTIVE,
+                )
+            )
+        )
+        _ready = True
+        return
+
+    for row in view.snapshot.iter_sellable_variants():
+        variant_id, product_id, category_id, cents = row
+        if category_id is not None and product_id not in view.changed:
+            _add_variant_locked(variant_id, product_id, category_id, cents)
+    if view.changed:
+        _add_variants_locked(
+            db.execute(
+                _variants_stmt().where(
+                    models.ProductVariant.product_id.in_(list(view.changed))
+                )
+            )
+        )
+    _ready = True
+
+
+def _apply_pending_locked(db: Session) -> None:
+    if not _pending_product_ids:
+        return
+    product_ids = list(_pending_product_ids)
+    _pending_product_ids.clear()
+
+    rows = db.execute(
+        _variants_stmt().where(models.ProductVariant.product_id.in_(product_ids))
+    ).all()
+    for product_id in product_ids:
+        _remove_product_locked(product_id)
+    _add_variants_locked(rows)
+    _histograms.clear()
+
+
+def _build_histogram(prices: Counter) -> Optional[Dict[str, Any]]:
+    if not prices:
+        return None
+
+    low, high = min(prices), max(prices)
+    bucket_count = PRICE_BUCKETS if high > low else 1
+    width = (high - low) / bucket_count
+    counts = [0] * bucket_count
+    for cents, count in prices.items():
+        index = int((cents - low) / width) if width else 0
+        counts[min(index, bucket_count - 1)] += count
+
+    return {
+        "min_price": low / 100,
+        "max_price": high / 100,
+        "buckets": [
+            {
+                "from_price": round((low + width * i) / 100, 2),
+                "to_price": round((low + width * (i + 1)) / 100, 2),
+                "count": count,
+            }
+            for i, count in enumerate(counts)
+        ],
+    }
+
+
+def get_price_histogram(
+    db: Session, category_ids: List[int]
+) -> Optional[Dict[str, Any]]:
+    """
+    Минимальная и максимальная цена и гистограмма с PRICE_BUCKETS интервалами
+    по доступным вариантам категорий поддерева. None, если вариантов нет.
+    """
+    key = tuple(sorted(category_ids))
+    with _lock:
+        if not _ready:
+            _rebuild_locked(db)
+        _apply_pending_locked(db)
+
+        if key not in _histograms:
+            prices = Counter()
+            for category_id in key:
+                prices.update(_category_prices.get(category_id, {}))
+            _histograms[key] = _build_histogram(prices)
+        return _histograms[key]
+
+
+def _mark_products_changed(product_ids: Optional[List[int]]) -> None:
+    global _ready
+
+    with _lock:
+        if product_ids is None:
+            _ready = False
+            return
+        _pending_product_ids.update(product_ids)
+
+
+cache.subscribe("products", _mark_products_changed)
@@ -0,0 +1,309 @@
+"""
+Кэш карточек товаров (GET /api/products/{product_id}).
+
+Карточка хранится двумя частями:
+- статическая: готовый JSON без остатков (описание, фото, бренд, категория,
+  варианты с ценами и атрибутами). LRU с ограничением по памяти
+  (PRODUCT_CACHE_MB), сбрасывается при изменении цены или статуса
+  вариантов товара (пространство имён "product_content");
+- остатки: вариант -> остаток, сбрасывается при любом изменении остатков
+  товара (пространство имён "products": оформление, отмена, админка).
+
+Ответ склеивается из фрагментов статической части и текущих остатков,
+поэтому изменение остатка не требует повторной сериализации карточки.
+Склеенная карточка хранится вместе со своими сжатыми вариантами
+(compression.Precompressed), пока не сменится одна из ее частей.
+
+Статическая часть хранит и фрагменты вариантов в формате корзины
+(schemas.CartVariant), поэтому пакетные запросы товаров и вариантов
+(GET /api/products/batch, /api/variants/batch) собираются из
+того же кэша, а из базы загружаются только отсутствующие в нем товары.
+"""
+
+import json
+import os
+import re
+import secrets
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import cache
+import compression
+import crud
+import models
+import schemas
+
+PRODUCT_CACHE_MB = float(os.environ.get("PRODUCT_CACHE_MB", "32"))
+CACHE_TTL = 600
+
+# Остаток варианта в JSON статической части заменяется меткой; случайная
+# часть не дает совпасть с текстом описания
+_STOCK_MARKER = f"__stock_{secrets.token_hex(8)}__"
+_STOCK_MARKER_RE = re.compile(re.escape(json.dumps(_STOCK_MARKER)).encode())
+
+
+class _StaticDetail(NamedTuple):
+    variant_ids: Tuple[int, ...]
+    # len(fragments) == len(variant_ids) + 1: остатки вставляются между ними
+    fragments: Tuple[bytes, ...]
+    # Варианты в формате корзины: (до остатка, после остатка)
+    cart_fragments: Tuple[Tuple[bytes, bytes], ...]
+
+
+def _static_size(entry: _StaticDetail) -> int:
+    return sum(len(fragment) for fragment in entry.fragments) + sum(
+        len(before) + len(after) for before, after in entry.cart_fragments
+    )
+
+
+_static = cache.TTLCache(
+    "product_detail",
+    ttl=CACHE_TTL,
+    maxsize=100_000,
+    maxbytes=int(PRODUCT_CACHE_MB * 1024 * 1024),
+    sizeof=_static_size,
+)
+_stock = cache.TTLCache("product_stock", ttl=CACHE_TTL, maxsize=100_000)
+# Склеенные карточки: (статическая часть, остатки, тело); годна, пока
+# части в кэшах те же объекты
+_bodies = cache.TTLCache(
+    "product_detail_bodies",
+    ttl=CACHE_TTL,
+    maxsize=100_000,
+    maxbytes=int(PRODUCT_CACHE_MB * 1024 * 1024),
+    sizeof=lambda value: value[2].size(),
+)
+
+# Вариант -> товар для пакетного запроса вариантов (товар варианта не меняется)
+_variant_products: Dict[int, int] = {}
+
+# Версии растут при каждой инвалидации: результат запроса, начатого до
+# изменения, не должен попасть в кэш после его инвалидации
+_lock = threading.Lock()
+_versions = {"content": 0, "stock": 0}
+
+
+def _encode(data) -> bytes:
+    # Тот же формат, что у JSONResponse
+    return json.dumps(
+        data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _serialize_static(product: models.Product) -> _StaticDetail:
+    data = schemas.ProductDetail.model_validate(product).model_dump(mode="json")
+    variant_ids = []
+    for variant in data["variants"]:
+        variant_ids.append(variant["id"])
+        variant["stock"] = _STOCK_MARKER
+
+    cart_fragments = []
+    for variant in product.variants:
+        cart_data = schemas.CartVariant.model_validate(variant).model_dump(mode="json")
+        cart_data["stock"] = _STOCK_MARKER
+        before, after = _STOCK_MARKER_RE.split(_encode(cart_data))
+        cart_fragments.append((before, after))
+        _variant_products[variant.id] = product.id
+
+    return _StaticDetail(
+        tuple(variant_ids),
+        tuple(_STOCK_MARKER_RE.split(_encode(data))),
+        tuple(cart_fragments),
+    )
+
+
+def _render(entry: _StaticDetail, stock: Dict[int, int]) -> bytes:
+    parts = [entry.fragments[0]]
+    for variant_id, fragment in zip(entry.variant_ids, entry.fragments[1:]):
+        parts.append(str(stock[variant_id]).encode())
+        parts.append(fragment)
+    return b"".join(parts)
+
+
+def _render_cart_variant(
+    entry: _StaticDetail, stock: Dict[int, int], variant_id: int
+) -> bytes:
+    before, after = entry.cart_fragments[entry.variant_ids.index(variant_id)]
+    return b"".join((before, str(stock[variant_id]).encode(), after))
+
+
+def _store(
+    target: cache.TTLCache, kind: str, version: int, product_id: int, value
+) -> None:
+    with _lock:
+        if _versions[kind] == version:
+            target.set(product_id, value)
+
+
+def _load_stock(db: Session, product_ids: List[int]) -> Dict[int, Dict[int, int]]:
+    stock: Dict[int, Dict[int, int]] = {product_id: {} for product_id in product_ids}
+    for product_id, variant_id, variant_stock in db.execute(
+        select(
+            models.ProductVariant.product_id,
+            models.ProductVariant.id,
+            models.ProductVariant.stock,
+        ).where(models.ProductVariant.product_id.in_(product_ids))
+    ):
+        stock[product_id][variant_id] = variant_stock
+    return stock
+
+
+def _get_entries(
+    db: Session, product_ids: List[int]
+) -> Dict[int, Tuple[_StaticDetail, Dict[int, int]]]:
+    """
+    Статические части и остатки товаров; отсутствующие в кэше загружаются
+    за фиксированное число запросов. Ненайденных товаров в результате нет.
+    """
+    entries = {}
+    static_hits = {}
+    for product_id in product_ids:
+        found, entry = _static.get(product_id)
+        if found:
+            static_hits[product_id] = entry
+
+    stock_hits = {}
+    for product_id in static_hits:
+        found, stock = _stock.get(product_id)
+        if found:
+            stock_hits[product_id] = stock
+    to_load_stock = [
+        product_id for product_id in static_hits if product_id not in stock_hits
+    ]
+    if to_load_stock:
+        version = _versions["stock"]
+        for product_id, stock in _load_stock(db, to_load_stock).items():
+            _store(_stock, "stock", version, product_id, stock)
+            stock_hits[product_id] = stock
+
+    for product_id, entry in static_hits.items():
+        stock = stock_hits[product_id]
+        # Набор вариантов изменился без сброса статической части
+        if stock.keys() == set(entry.variant_ids):
+            entries[product_id] = (entry, stock)
+        else:
+            _static.invalidate([product_id])
+
+    to_load = [product_id for product_id in product_ids if product_id not in entries]
+    if to_load:
+        content_version, stock_version = _versions["content"], _versions["stock"]
+        products, _ = crud.get_products_by_ids(db, product_ids=to_load)
+        for product in products:
+            entry = _serialize_static(product)
+            stock = {variant.id: variant.stock for variant in product.variants}
+            _store(_static, "content", content_version, product.id, entry)
+            _store(_stock, "stock", stock_version, product.id, stock)
+            entries[product.id] = (entry, stock)
+    return entries
+
+
+def get_product_detail(
+    db: Session, product_id: int
+) -> Optional[compression.Precompressed]:
+    """
+    JSON карточки товара (schemas.ProductDetail) со сжатыми вариантами
+    или None, если товара нет. Значение общее - изменять его нельзя.
+    """
+    entry = _get_entries(db, [product_id]).get(product_id)
+    if entry is None:
+        return None
+    static, stock = entry
+    found, body = _bodies.get(product_id)
+    if found and body[0] is static and body[1] is stock:
+        return body[2]
+    payload = compression.Precompressed(_render(static, stock))
+    _bodies.set(product_id, (static, stock, payload))
+    return payload
+
+
+def get_product_details(
+    db: Session, product_ids: List[int]
+) -> Tuple[List[Tuple[int, bytes]], List[int]]:
+    """
+    Returns:
+        ([(id товара, JSON карточки)] в порядке запроса без повторов,
+        id ненайденных товаров)
+    """
+    unique_ids = list(dict.fromkeys(product_ids))
+    entries = _get_entries(db, unique_ids)
+    found = [
+        (product_id, _render(*entries[product_id]))
+        for product_id in unique_ids
+        if product_id in entries
+    ]
+    missing = [product_id for product_id in unique_ids if product_id not in entries]
+    return found, missing
+
+
+def get_cart_variants(
+    db: Session, variant_ids: List[int]
+) -> Tuple[List[Tuple[int, bytes]], List[int]]:
+    """
+    Варианты в формате корзины (schemas.CartVariant).
+
+    Returns:
+        ([(id товара, JSON варианта)] в порядке запроса без повторов,
+        id ненайденных вариантов)
+    """
+    unique_ids = list(dict.fromkeys(variant_ids))
+    unknown = [
+        variant_id for variant_id in unique_ids if variant_id not in _variant_products
+    ]
+    if unknown:
+        for variant_id, product_id in db.execute(
+            select(models.ProductVariant.id, models.ProductVariant.product_id).where(
+                models.ProductVariant.id.in_(unknown)
+            )
+        ):
+            _variant_products[variant_id] = product_id
+
+    product_ids = list(
+        dict.fromkeys(
+            _variant_products[variant_id]
+            for variant_id in unique_ids
+            if variant_id in _variant_products
+        )
+    )
+    entries = _get_entries(db, product_ids)
+
+    found = []
+    missing = []
+    for variant_id in unique_ids:
+        product_id = _variant_products.get(variant_id)
+        entry = entries.get(product_id)
+        if entry is None or variant_id not in entry[0].variant_ids:
+            missing.append(variant_id)
+        else:
+            found.append((product_id, _render_cart_variant(*entry, variant_id)))
+    return found, missing
+
+
+def render_batch(
+    field: str, items: List[Tuple[int, bytes]], missing_ids: List[int]
+) -> bytes:
+    """JSON пакетного ответа {field: [...], "missing_ids": [...]} из фрагментов."""
+    return b"".join(
+        (
+            b'{"' + field.encode() + b'":[',
+            b",".join(payload for _, payload in items),
+            b'],"missing_ids":',
+            _encode(missing_ids),
+            b"}",
+        )
+    )
+
+
+def _on_change(kind: str, target: cache.TTLCache):
+    def invalidate(product_ids: Optional[List[int]]) -> None:
+        with _lock:
+            _versions[kind] += 1
+            target.invalidate(product_ids)
+
+    return invalidate
+
+
+cache.subscribe("product_content", _on_change("content", _static))
+cache.subscribe("products", _on_change("stock", _stock))
@@ -0,0 +1,70 @@
+"""
+Заглушка кэширующего прокси: записывает запросы очистки (см. surrogate).
+
+    python purge_recorder.py [порт]
+
+Запуск API с SURROGATE_PURGE_URL=http://127.0.0.1:<порт>/ отправляет
+очистку сюда. Полученные ключи печатаются и доступны по GET /purges
+(список пачек в порядке получения); DELETE /purges очищает список.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+DEFAULT_PORT = 8099
+
+
+class PurgeRecorder(ThreadingHTTPServer):
+    def __init__(self, port: int = DEFAULT_PORT, header: str = "Surrogate-Key"):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.header = header
+        self.purges: List[List[str]] = []
+        self.lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: PurgeRecorder
+
+    def _reply(self, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self._reply(self.server.purges)
+
+    def do_DELETE(self):
+        with self.server.lock:
+            self.server.purges.clear()
+        self._reply([])
+
+    def do_PURGE(self):
+        keys = self.headers.get(self.server.header, "").split()
+        with self.server.lock:
+            self.server.purges.append(keys)
+        print(f"PURGE {' '.join(keys)}")
+        self._reply({"purged": len(keys)})
+
+    # Прокси могут принимать очистку и обычным POST
+    do_POST = do_PURGE
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    server = PurgeRecorder(port)
+    print(f"✅ Запись очисток на http://127.0.0.1:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
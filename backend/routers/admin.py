@@ -1,10 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
+import datetime as dt
+import time
 
+import admission
+import cache
 import crud
+import database
+import low_stock
+import models
+import order_events
 import schemas
-from database import get_db
+import singleflight
+import snapshot
+import surrogate
+import swr
+from database import ReadSessionLocal, get_db
 from enum import Enum
 
 router = APIRouter(
@@ -61,6 +75,160 @@ def read_all_products_for_admin(
     return {"products": products, "total_count": total_count}
 
 
+@router.patch("/variants/{variant_id}", response_model=schemas.AdminProductVariant)
+def update_variant_endpoint(
+    variant_update: schemas.AdminVariantUpdate,
+    variant_id: int = Path(..., description="ID варианта"),
+    db: Session = Depends(get_db),
+):
+    """
+    Update price, stock (restock), reorder threshold or status of a variant.
+    """
+    try:
+        variant = crud.update_variant(db, variant_id, variant_update)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not variant:
+        raise HTTPException(status_code=404, detail="Вариант не найден")
+    return variant
+
+
+def _read_low_stock_version() -> int:
+    db = ReadSessionLocal()
+    try:
+        return low_stock.get_version(db)
+    finally:
+        db.close()
+
+
+def _read_low_stock() -> Tuple[int, List[dict]]:
+    db = ReadSessionLocal()
+    try:
+        return low_stock.get_version(db), low_stock.get_low_stock_variants(db)
+    finally:
+        db.close()
+
+
+@router.get("/low-stock", response_model=schemas.LowStockList)
+async def read_low_stock(
+    version: Optional[int] = Query(
+        None,
+        description="Version from the previous response: wait until the list changes",
+    ),
+    timeout: float = Query(25, ge=0, le=60, description="Long-poll timeout, seconds"),
+):
+    """
+    Variants at or below their reorder threshold, read from the maintained
+    low-stock table. With version set the request is held until a variant
+    enters or leaves the list, or the timeout expires. The version is
+    stored in the database, so it is the same on every worker. A waiting
+    request holds no database connection: each check opens a short-lived
+    read session.
+    """
+    deadline = time.monotonic() + timeout
+    while version is not None:
+        # Taken before reading the version so a commit in between still wakes us
+        seen = low_stock.channel.version
+        current_version = await run_in_threadpool(_read_low_stock_version)
+        remaining = deadline - time.monotonic()
+        if current_version != version or remaining <= 0:
+            break
+        await low_stock.channel.wait(seen, remaining)
+
+    current_version, variants = await run_in_threadpool(_read_low_stock)
+    return {"version": current_version, "variants": variants}
+
+
+@router.get("/cache-stats")
+def read_cache_stats():
+    """
+    Hit/miss counters of the in-process caches (including listing statement
+    templates) and of SQLAlchemy's compiled statement cache in this worker,
+    plus how many catalog requests were coalesced into a shared query and
+    how often stale-while-revalidate caches served stale entries, and the
+    state of caching proxy purges sent by this worker and of the shared
+    catalog snapshot it has mapped.
+    """
+    return {
+        "caches": cache.get_stats(),
+        "statements": database.get_statement_cache_stats(),
+        "singleflight": singleflight.get_stats(),
+        "swr": swr.get_stats(),
+        "surrogate_purge": surrogate.get_stats(),
+        "snapshot": snapshot.get_stats(),
+    }
+
+
+@router.get("/admission-stats")
+def read_admission_stats():
+    """
+    Admission control state per request class in this worker: limits,
+    in-flight and waiting requests, admitted/rejected counters and the
+    average service time used to estimate queue wait.
+    """
+    return admission.get_stats()
+
+
+@router.get("/orders", response_model=schemas.AdminOrderList)
+def read_orders_for_admin(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor from the previous page"
+    ),
+    status: Optional[models.OrderStatus] = Query(None),
+    date_from: Optional[dt.date] = Query(None),
+    date_to: Optional[dt.date] = Query(None, description="Inclusive"),
+    phone: Optional[str] = Query(None),
+    name: Optional[str] = Query(None, description="Customer name prefix"),
+    city: Optional[str] = Query(None),
+    include_items: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    """
+    List orders, newest first, with keyset pagination on (created_at, id).
+    Order items are loaded only with include_items=true.
+    """
+    try:
+        orders, next_cursor = crud.get_orders_for_admin(
+            db,
+            limit=limit,
+            cursor=cursor,
+            status=status,
+            date_from=date_from,
+            date_to=date_to,
+            phone=phone,
+            name=name,
+            city=city,
+            include_items=include_items,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"orders": orders, "next_cursor": next_cursor}
+
+
+@router.get("/orders/events")
+async def stream_order_events(
+    request: Request,
+    last_event_id: Optional[int] = Header(
+        None, description="Sent by EventSource on reconnect"
+    ),
+):
+    """
+    Server-sent events for the dashboard: order_created and
+    order_status_changed, each with the order as in the order list.
+    After a reconnect with Last-Event-ID the missed events are replayed;
+    a reset event means they are no longer available and the list should
+    be reloaded.
+    """
+    return StreamingResponse(
+        order_events.stream(request, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.patch("/{order_id}/status", response_model=schemas.Order)
 def update_order_status_endpoint(
     status_update: schemas.OrderStatusUpdate,
@@ -83,6 +251,7 @@ def update_order_status_endpoint(
     - refunded: Возвращен
 
     При отмене заказа (cancelled) товары автоматически возвращаются на склад.
+    Статус отмененного заказа изменить нельзя (409).
     """
     try:
         updated_order = crud.update_order_status(
@@ -96,6 +265,10 @@ def update_order_status_endpoint(
 
         return updated_order
 
+    except HTTPException:
+        raise
+    except crud.OrderStatusConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -128,4 +301,3 @@ def get_order_endpoint(order_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Заказ не найден")
 
     return order
-
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+import datetime as dt
+
+import analytics
+import schemas
+from database import get_read_db
+
+router = APIRouter(
+    prefix="/admin/analytics",
+    tags=["admin"],
+)
+
+
+@router.get("/daily", response_model=List[schemas.SalesDay])
+def read_sales_by_day(
+    date_from: Optional[dt.date] = Query(None),
+    date_to: Optional[dt.date] = Query(None, description="Inclusive"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Orders, units and revenue per day.
+    """
+    return analytics.get_sales_by_day(db, date_from=date_from, date_to=date_to)
+
+
+@router.get("/brands", response_model=List[schemas.SalesByBrand])
+def read_sales_by_brand(
+    date_from: Optional[dt.date] = Query(None),
+    date_to: Optional[dt.date] = Query(None, description="Inclusive"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Sales per brand for the period, highest revenue first.
+    """
+    return analytics.get_sales_by_brand(db, date_from=date_from, date_to=date_to)
+
+
+@router.get("/categories", response_model=List[schemas.SalesByCategory])
+def read_sales_by_category(
+    date_from: Optional[dt.date] = Query(None),
+    date_to: Optional[dt.date] = Query(None, description="Inclusive"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Sales per category for the period, highest revenue first.
+    """
+    return analytics.get_sales_by_category(db, date_from=date_from, date_to=date_to)
+
+
+@router.get("/variants", response_model=List[schemas.SalesByVariant])
+def read_top_variants(
+    date_from: Optional[dt.date] = Query(None),
+    date_to: Optional[dt.date] = Query(None, description="Inclusive"),
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Best-selling variants for the period by revenue.
+    """
+    return analytics.get_top_variants(
+        db, date_from=date_from, date_to=date_to, limit=limit
+    )
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+import crud
+import schemas
+from database import get_read_db
+
+router = APIRouter(
+    prefix="/cart",
+    tags=["cart"],
+)
+
+
+@router.post("/quote", response_model=schemas.CartQuote)
+def quote_cart_endpoint(
+    quote_request: schemas.CartQuoteRequest, db: Session = Depends(get_read_db)
+):
+    """
+    Validate and price a cart without creating an order.
+    Uses the same checks as checkout and reports availability per line.
+    """
+    return crud.quote_cart(db=db, cart=quote_request.cart)
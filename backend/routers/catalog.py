@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+import changefeed
+import schemas
+from database import get_read_db
+
+router = APIRouter(
+    prefix="/catalog",
+    tags=["catalog"],
+)
+
+
+@router.get("/changes", response_model=schemas.CatalogChanges)
+def read_catalog_changes(
+    since: int = Query(0, ge=0, description="version from the previous response"),
+    limit: int = Query(500, ge=1, le=changefeed.MAX_CHANGES_PAGE),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Products and variants changed after the given catalog version, one entry
+    per product/variant with the kinds of change and current variant values.
+    Repeat with since=version while has_more is true. reset_required means
+    the log no longer covers the client's version and a full reload is needed.
+    """
+    return changefeed.get_changes(db, since=since, limit=limit)
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
+import compression
 import crud
+import listings
+import product_cache
 import schemas
+import suggest
+import surrogate
 from database import get_db
 
 router = APIRouter(
@@ -14,6 +19,7 @@ router = APIRouter(
 
 @router.get("/", response_model=schemas.ProductList)
 def read_products(
+    request: Request,
     skip: int = 0,
     limit: int = 12,
     category_slug: Optional[str] = Query(None),
@@ -24,9 +30,16 @@ def read_products(
     sort_by: Optional[str] = Query(
         None, description="Sort by: 'price_asc', 'price_desc', 'name_asc', 'name_desc'"
     ),
+    with_total: bool = Query(
+        True, description="Set to false to skip total_count and rely on has_more"
+    ),
     db: Session = Depends(get_db),
 ):
-    products, total_count = crud.get_products(
+    """
+    Catalog page. Identical concurrent requests share one query and its
+    serialized result. Tagged with surrogate keys for a caching proxy.
+    """
+    page = listings.get_listing(
         db,
         skip=skip,
         limit=limit,
@@ -36,22 +49,133 @@ def read_products(
         min_price=min_price,
         max_price=max_price,
         sort_by=sort_by,
+        with_total=with_total,
+    )
+    return surrogate.tag(
+        compression.response(request, page.value),
+        page.keys,
+        cacheable=page.fresh,
     )
 
-    return {"products": products, "total_count": total_count}
+
+@router.get("/search", response_model=schemas.ProductList)
+def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = 0,
+    limit: int = 12,
+    category_slug: Optional[str] = Query(None),
+    brand_slugs: Optional[List[str]] = Query(None, alias="brands"),
+    size_values: Optional[List[str]] = Query(None, alias="sizes"),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    sort_by: Optional[str] = Query(
+        None,
+        description="Sort by: 'price_asc', 'price_desc', 'name_asc', 'name_desc'. "
+        "Defaults to relevance",
+    ),
+    with_total: bool = Query(
+        True, description="Set to false to skip total_count and rely on has_more"
+    ),
+    db: Session = Depends(get_db),
+):
+    """
+    Full-text search over product name, description, brand and category,
+    combined with the regular listing filters. Identical concurrent searches
+    share one query.
+    """
+    page = listings.get_listing(
+        db,
+        skip=skip,
+        limit=limit,
+        category_slug=category_slug,
+        brand_slugs=brand_slugs,
+        size_values=size_values,
+        min_price=min_price,
+        max_price=max_price,
+        sort_by=sort_by,
+        with_total=with_total,
+        search_query=q,
+    )
+    return surrogate.tag(
+        compression.response(request, page.value),
+        page.keys,
+        cacheable=page.fresh,
+    )
+
+
+@router.get("/suggest", response_model=schemas.SuggestionList)
+def suggest_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=20),
+    db: Session = Depends(get_db),
+):
+    """
+    Typeahead suggestions over product, brand and category names.
+    Tolerates typos and a wrong keyboard layout.
+    """
+    return {"suggestions": suggest.suggest(db, q, limit=limit)}
 
 
 @router.get("/filters", response_model=schemas.FilterOptions)
-def get_filters(category_slug: str, db: Session = Depends(get_db)):
+def get_filters(category_slug: str, request: Request, db: Session = Depends(get_db)):
     """
-    Retrieve available brands and sizes for a given category.
+    Retrieve available brands and sizes for a given category. Served from
+    a stale-while-revalidate cache refreshed in the background.
     """
-    return crud.get_filters_for_category(db, category_slug=category_slug)
+    filters = listings.get_filters(db, category_slug=category_slug)
+    return surrogate.tag(
+        compression.response(request, filters.value),
+        filters.keys,
+        cacheable=filters.fresh,
+    )
+
+
+def batch_response(field: str, items, missing_ids: List[int]) -> Response:
+    """
+    JSON body {field: [...], "missing_ids": [...]} assembled from cached
+    fragments, tagged with the products of the items. Also used by the
+    variant batch endpoint.
+    """
+    # A product created later has no key to purge by: do not cache misses
+    return surrogate.tag(
+        Response(
+            content=product_cache.render_batch(field, items, missing_ids),
+            media_type="application/json",
+        ),
+        [surrogate.product_key(product_id) for product_id, _ in items],
+        cacheable=not missing_ids,
+    )
+
+
+@router.get("/batch", response_model=schemas.ProductBatch)
+def read_products_batch(
+    ids: List[int] = Query(..., description="Product ids, e.g. ?ids=1&ids=2"),
+    db: Session = Depends(get_db),
+):
+    """
+    Retrieve several products at once in request order; unknown ids are
+    reported in missing_ids. Served from the product detail cache; only
+    products missing from it are loaded.
+    """
+    if len(ids) > crud.MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {crud.MAX_BATCH_IDS} ids per request"
+        )
+    products, missing_ids = product_cache.get_product_details(db, product_ids=ids)
+    return batch_response("products", products, missing_ids)
 
 
 @router.get("/{product_id}", response_model=schemas.ProductDetail)
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    db_product = crud.get_product_by_id(db, product_id=product_id)
-    if db_product is None:
+def read_product(product_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Product card, served pre-serialized and pre-compressed from the product
+    detail cache.
+    """
+    payload = product_cache.get_product_detail(db, product_id=product_id)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return db_product
+    return surrogate.tag(
+        compression.response(request, payload),
+        [surrogate.product_key(product_id)],
+    )
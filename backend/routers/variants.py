@@ -0,0 +1,122 @@
+import json
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+import availability
+import changefeed
+import crud
+import product_cache
+import schemas
+from database import ReadSessionLocal, get_db, get_read_db
+from routers.products import batch_response
+
+router = APIRouter(
+    prefix="/variants",
+    tags=["variants"],
+)
+
+# Comment line sent on an idle stream so proxies keep the connection open
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def _check_ids(ids: List[int]) -> None:
+    if len(ids) > crud.MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {crud.MAX_BATCH_IDS} ids per request"
+        )
+
+
+@router.get("/availability", response_model=schemas.VariantAvailabilityList)
+def read_availability(
+    ids: List[int] = Query(..., description="Variant ids, e.g. ?ids=1&ids=2"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Stock, status and price of the given variants, served from an in-memory
+    map that is refreshed on every stock, price or status change. Cheap
+    enough for frequent polling from the product page.
+    """
+    _check_ids(ids)
+    variants, missing_ids = availability.get_availability(db, ids)
+    return {"variants": variants, "missing_ids": missing_ids}
+
+
+@router.get("/batch", response_model=schemas.VariantBatch)
+def read_variants_batch(
+    ids: List[int] = Query(..., description="Variant ids, e.g. ?ids=1&ids=2"),
+    db: Session = Depends(get_db),
+):
+    """
+    Retrieve several variants with their product summary (cart view),
+    served from the product detail cache like the product batch.
+    """
+    _check_ids(ids)
+    variants, missing_ids = product_cache.get_cart_variants(db, variant_ids=ids)
+    return batch_response("variants", variants, missing_ids)
+
+
+def _read_changes(
+    since: Optional[int], variant_ids: List[int]
+) -> Tuple[int, List[dict]]:
+    """
+    Catalog change-feed version and the current availability of the variants
+    changed after since (all of them when since is None or too old).
+    """
+    db = ReadSessionLocal()
+    try:
+        changed = None
+        if since is None:
+            version = changefeed.get_version(db)
+        else:
+            version, changed = changefeed.get_changed_variants(db, since, variant_ids)
+        if changed is not None:
+            variant_ids = [
+                variant_id for variant_id in variant_ids if variant_id in changed
+            ]
+        return version, availability.load_availability(db, variant_ids)
+    finally:
+        db.close()
+
+
+async def _availability_events(request: Request, variant_ids: List[int]):
+    sent = {}
+    version = None
+    while True:
+        # Taken before reading the feed so a commit in between still wakes us
+        seen = availability.channel.version
+        version, items = await run_in_threadpool(_read_changes, version, variant_ids)
+        changed = [item for item in items if sent.get(item["id"]) != item]
+        if changed:
+            sent.update((item["id"], item) for item in changed)
+            yield f"event: availability\ndata: {json.dumps(changed)}\n\n"
+
+        # Woken by a catalog change in this worker or, through cache_bus, in
+        # another one; on timeout send a keepalive and re-check the feed anyway
+        if await availability.channel.wait(seen, SSE_KEEPALIVE_SECONDS) == seen:
+            yield ": keepalive\n\n"
+        if await request.is_disconnected():
+            return
+
+
+@router.get("/availability/stream")
+async def stream_availability(
+    request: Request,
+    ids: List[int] = Query(..., description="Variant ids, e.g. ?ids=1&ids=2"),
+):
+    """
+    Server-sent events for the given variants. The first "availability"
+    event carries all of them; later events carry only the variants whose
+    stock, status or price changed. Data is a list of VariantAvailability.
+    Changes are found in the catalog change feed, so a change made through
+    any worker reaches every stream.
+    """
+    _check_ids(ids)
+    return StreamingResponse(
+        _availability_events(request, list(dict.fromkeys(ids))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,6 +1,6 @@
 from decimal import Decimal
 from enum import Enum
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 import datetime as dt
 import models
@@ -95,9 +95,45 @@ class ProductDetail(Product):  # Inherits from Product
     pass
 
 
+class ProductBatch(BaseModel):
+    products: List[ProductDetail]
+    missing_ids: List[int]
+
+
+class CartVariantProduct(BaseModel):
+    id: int
+    name: str
+    brand: Optional[Brand] = None
+    images: List[Image] = []
+    model_config = ConfigDict(from_attributes=True)
+
+
+class CartVariant(ProductVariant):
+    status: str
+    sku: Optional[str] = None
+    product: CartVariantProduct
+
+
+class VariantBatch(BaseModel):
+    variants: List[CartVariant]
+    missing_ids: List[int]
+
+
 class ProductList(BaseModel):
     products: List[Product]
-    total_count: int
+    total_count: Optional[int] = None
+    has_more: bool = False
+
+
+class Suggestion(BaseModel):
+    type: str
+    id: int
+    name: str
+    slug: str
+
+
+class SuggestionList(BaseModel):
+    suggestions: List[Suggestion]
 
 
 class SubCategory(BaseModel):
@@ -105,10 +141,23 @@ class SubCategory(BaseModel):
     slug: str
 
 
+class PriceBucket(BaseModel):
+    from_price: float
+    to_price: float
+    count: int
+
+
+class PriceHistogram(BaseModel):
+    min_price: float
+    max_price: float
+    buckets: List[PriceBucket]
+
+
 class FilterOptions(BaseModel):
     brands: List[Brand]
     sizes: List[str]
     subcategories: List[SubCategory]
+    price: Optional[PriceHistogram] = None
 
 
 # Schemas for Checkout/Cart
@@ -118,6 +167,26 @@ class CartItem(BaseModel):
     
 
 
+class CartQuoteRequest(BaseModel):
+    cart: List[CartItem]
+
+
+class CartQuoteItem(BaseModel):
+    variant_id: int
+    quantity: int
+    available: bool
+    available_stock: int
+    unit_price: Optional[Decimal] = None
+    total_price: Optional[Decimal] = None
+    error: Optional[str] = None
+
+
+class CartQuote(BaseModel):
+    items: List[CartQuoteItem]
+    total_amount: Decimal
+    is_valid: bool
+
+
 class CheckoutForm(BaseModel):
     name: str
     phone: str
@@ -144,6 +213,19 @@ class VariantStatusSchema(str, Enum):
     DISCONTINUED = "discontinued"
 
 
+# Variant availability
+class VariantAvailability(BaseModel):
+    id: int
+    stock: int
+    status: VariantStatusSchema
+    price: float
+
+
+class VariantAvailabilityList(BaseModel):
+    variants: List[VariantAvailability]
+    missing_ids: List[int]
+
+
 # AdminProduct
 class AdminProductVariant(BaseModel):
     id: int
@@ -152,6 +234,7 @@ class AdminProductVariant(BaseModel):
     sku: Optional[str] = None
     status: VariantStatusSchema
     product_id: int
+    reorder_threshold: int = 0
     attributes: List[VariantAttribute] = []
     created_at: Optional[dt.datetime] = None
     updated_at: Optional[dt.datetime] = None
@@ -178,6 +261,29 @@ class AdminProductList(BaseModel):
     total_count: int
 
 
+class AdminVariantUpdate(BaseModel):
+    price: Optional[Decimal] = Field(None, gt=0)
+    stock: Optional[int] = Field(None, ge=0)
+    reorder_threshold: Optional[int] = Field(None, ge=0)
+    status: Optional[VariantStatusSchema] = None
+
+
+# Low stock
+class LowStockVariant(BaseModel):
+    variant_id: int
+    product_id: int
+    product_name: str
+    sku: Optional[str] = None
+    stock: int
+    reorder_threshold: int
+    since: dt.datetime
+
+
+class LowStockList(BaseModel):
+    version: int
+    variants: List[LowStockVariant]
+
+
 # AdminOrder
 class AdminOrderProductVariant(BaseModel):
     id: int
@@ -238,5 +344,71 @@ class AdminOrder(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class AdminOrderListItem(BaseModel):
+    id: int
+    status: str
+    total_amount: Decimal
+    customer_name: str
+    customer_phone: str
+    shipping_city: Optional[str] = None
+    created_at: dt.datetime
+    updated_at: Optional[dt.datetime] = None
+    # Заполняется только при include_items=true
+    items: List[AdminOrderItem] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class AdminOrderList(BaseModel):
+    orders: List[AdminOrderListItem]
+    next_cursor: Optional[str] = None
+
+
+# Analytics
+class SalesTotals(BaseModel):
+    orders_count: int
+    units: int
+    revenue: Decimal
+
+
+class SalesDay(SalesTotals):
+    day: dt.date
+
+
+class SalesByBrand(SalesTotals):
+    brand_id: int
+    name: str
+
+
+class SalesByCategory(SalesTotals):
+    category_id: int
+    name: str
+
+
+class SalesByVariant(SalesTotals):
+    variant_id: int
+
+
+# Catalog change feed
+class CatalogChange(BaseModel):
+    product_id: int
+    variant_id: Optional[int] = None
+    kinds: List[models.ChangeKind]
+    version: int
+    # Текущие значения варианта; deleted - вариант удален
+    price: Optional[Decimal] = None
+    stock: Optional[int] = None
+    status: Optional[VariantStatusSchema] = None
+    deleted: bool = False
+
+
+class CatalogChanges(BaseModel):
+    version: int
+    # Версия клиента старше хранимого журнала - нужна полная загрузка
+    reset_required: bool = False
+    has_more: bool = False
+    changes: List[CatalogChange]
+
+
 class OrderStatusUpdate(BaseModel):
-    status: models.OrderStatus
\ No newline at end of file
+    status: models.OrderStatus
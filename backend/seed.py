@@ -2,12 +2,13 @@
 Скрипт для заполнения базы данных тестовыми данными
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from decimal import Decimal
 from datetime import datetime, timedelta
 import random
 
+import low_stock
+import models
+
 # Импорт моделей (предполагается, что они в файле models.py)
 from models import (
     Base,
@@ -24,17 +25,12 @@ from models import (
     OrderStatus,
 )
 
-# Настройка базы данных
-SQLALCHEMY_DATABASE_URL = "sqlite:///./shop.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, bind=engine)
+# Настройка базы данных: каталог и заказы в своих файлах (см. database.py)
+from database import SessionLocal
 
 
 def create_tables():
-    Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
+    models.create_tables(drop=True)
     print("✅ Таблицы созданы")
 
 
@@ -319,6 +315,7 @@ def create_products_and_variants(categories, brands, attributes):
                     sku=f"{product_data['slug']}-{i+1:03d}",
                     price=Decimal(str(variant_data["price"])),
                     stock=variant_data["stock"],
+                    reorder_threshold=variant_data.get("reorder_threshold", 3),
                     status=variant_data.get(
                         "status", VariantStatus.ACTIVE
                     ),  # Используем переданный статус или ACTIVE по умолчанию
@@ -351,6 +348,14 @@ def create_products_and_variants(categories, brands, attributes):
         db.close()
 
 
+def create_low_stock_list():
+    db = SessionLocal()
+    try:
+        print(f"📉 Вариантов на дозаказ: {low_stock.rebuild(db)}")
+    finally:
+        db.close()
+
+
 def main():
     print("🚀 Начинаем заполнение базы данных...")
     create_tables()
@@ -358,6 +363,7 @@ def main():
     brands = create_brands()
     attributes = create_attributes()
     create_products_and_variants(categories, brands, attributes)
+    create_low_stock_list()
     print("\n✅ База данных успешно заполнена!")
 
 
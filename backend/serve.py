@@ -0,0 +1,228 @@
+"""
+Запуск приложения в production: мастер-процесс импортирует приложение
+и модели, открывает сокет и порождает воркеры через fork, поэтому код
+и данные, загруженные при импорте, делятся между воркерами (copy-on-write).
+
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+
+Сигналы мастеру:
+    SIGHUP          - поочередный перезапуск воркеров: новый воркер
+                      запускается до остановки старого, старый дообслуживает
+                      начатые запросы (в том числе оформление заказов)
+    SIGTERM, SIGINT - плавная остановка всех воркеров
+
+Сокет открывается с SO_REUSEPORT: при выкладке новой версии кода новый
+мастер запускается на том же порту, после чего старому отправляется SIGTERM.
+
+Каждый воркер после прогрева печатает свое потребление памяти.
+"""
+
+import argparse
+import os
+import resource
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+import uvicorn
+
+import database
+import warmup
+from main import app
+
+# Как долго воркер дообслуживает начатые запросы при остановке
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
+
+def _memory_mb() -> Dict[str, float]:
+    """RSS и собственная (не разделяемая с мастером) память процесса, МБ."""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(
+                (parts[0].rstrip(":"), int(parts[1]))
+                for parts in (line.split() for line in f)
+                if len(parts) >= 3 and parts[2] == "kB"
+            )
+        return {
+            "rss": round(fields["Rss"] / 1024, 1),
+            "private": round(
+                (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024, 1
+            ),
+        }
+    except (OSError, KeyError):
+        # Не Linux: доступен только пиковый RSS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divider = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return {"rss": round(max_rss / divider, 1), "private": None}
+
+
+def _report_memory_when_ready() -> None:
+    while not warmup.is_ready():
+        time.sleep(0.2)
+    memory = _memory_mb()
+    print(
+        f"👷 Воркер {os.getpid()} готов: RSS {memory['rss']} МБ, "
+        f"собственная память {memory['private']} МБ"
+    )
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, args: argparse.Namespace) -> None:
+    # Соединения мастера не должны использоваться в дочернем процессе
+    for engine in database.ENGINES:
+        engine.dispose(close=False)
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+
+    threading.Thread(target=_report_memory_when_ready, daemon=True).start()
+
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+    )
+    # uvicorn сам обрабатывает SIGTERM: перестает принимать соединения
+    # и дожидается завершения начатых запросов
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Master:
+    def __init__(self, sock: socket.socket, args: argparse.Namespace):
+        self.sock = sock
+        self.args = args
+        self.workers: Dict[int, float] = {}  # pid -> время запуска
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                _run_worker(self.sock, self.args)
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                # Воркер не должен возвращаться в цикл мастера
+                os._exit(exit_code)
+        self.workers[pid] = time.monotonic()
+        return pid
+
+    def stop_worker(self, pid: int) -> None:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def reap(self, block: bool = False) -> Optional[int]:
+        """Собирает завершившиеся воркеры; возвращает pid последнего."""
+        reaped = None
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                break
+            if pid == 0:
+                break
+            self.workers.pop(pid, None)
+            reaped = pid
+            if block:
+                break
+        return reaped
+
+    def rolling_restart(self) -> None:
+        for old_pid in list(self.workers):
+            self.spawn()
+            self.stop_worker(old_pid)
+            # Дожидаемся выхода старого воркера, чтобы число процессов
+            # не превышало workers + 1
+            deadline = time.monotonic() + self.args.graceful_timeout + 5
+            while old_pid in self.workers and time.monotonic() < deadline:
+                self.reap()
+                time.sleep(0.1)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        for _ in range(self.args.workers):
+            self.spawn()
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                print("🔄 Перезапуск воркеров")
+                self.rolling_restart()
+
+            # Упавшие воркеры перезапускаются
+            self.reap()
+            while len(self.workers) < self.args.workers and not self.stopping:
+                self.spawn()
+            time.sleep(0.5)
+
+        print("🛑 Остановка воркеров")
+        for pid in list(self.workers):
+            self.stop_worker(pid)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.reap(block=True) is not None:
+            pass
+
+    def _on_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def _on_reload(self, signum, frame) -> None:
+        self.reload_requested = True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Запуск API с несколькими воркерами")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--graceful-timeout", type=int, default=DEFAULT_GRACEFUL_TIMEOUT
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    sock = _bind_socket(args.host, args.port)
+    memory = _memory_mb()
+    print(
+        f"🚀 Мастер {os.getpid()}: {args.workers} воркеров на "
+        f"{args.host}:{args.port}, пул потоков {database.THREADPOOL_SIZE} "
+        f"на воркер, RSS после загрузки приложения {memory['rss']} МБ"
+    )
+    Master(sock, args).run()
+
+
+if __name__ == "__main__":
+    main()
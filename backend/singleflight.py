@@ -0,0 +1,142 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight).
+
+Пока выполняется вызов по ключу, остальные запросы с тем же ключом не
+выполняют его повторно, а ждут и получают тот же результат (или то же
+исключение). Ожидание ограничено таймаутом: не дождавшийся запрос
+выполняет вызов сам, поэтому зависший ведущий не держит остальных.
+
+Вызывающие могут быть как в пуле потоков (do), так и в цикле событий
+(do_async) и ждать одного и того же выполнения. Результат разделяется
+между запросами, поэтому он не должен быть привязан к сессии: например,
+готовый JSON, а не объекты ORM.
+"""
+
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import anyio.to_thread
+
+# Все группы процесса - для статистики
+_groups: Dict[str, "Group"] = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        # Ожидающие из циклов событий: (цикл, future)
+        self.futures: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Group:
+    def __init__(self, name: str, timeout: float):
+        """timeout - сколько ожидающий ждет ведущего, секунды."""
+        self.name = name
+        self.timeout = timeout
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        _groups[name] = self
+
+    def _join(self, key: Hashable) -> Tuple[_Call, bool]:
+        """Текущее выполнение по ключу и признак, что ведущий - вызывающий."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.executions += 1
+            return call, True
+
+    def _finish(
+        self, key: Hashable, call: _Call, result: Any, error: Optional[BaseException]
+    ) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            call.result, call.error = result, error
+            call.done.set()
+            futures, call.futures = call.futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _lead(self, key: Hashable, call: _Call, fn: Callable[[], Any]) -> Any:
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, call, None, e)
+            raise
+        self._finish(key, call, result, None)
+        return result
+
+    def _result(self, call: _Call) -> Any:
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Выполняет fn или дожидается результата уже идущего вызова."""
+        call, leader = self._join(key)
+        if leader:
+            return self._lead(key, call, fn)
+        if call.done.wait(self.timeout):
+            return self._result(call)
+        with self._lock:
+            self.timeouts += 1
+        return fn()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        То же для цикла событий: синхронная fn выполняется в пуле потоков,
+        ожидание потока не занимает.
+        """
+        call, leader = self._join(key)
+        if leader:
+            return await anyio.to_thread.run_sync(self._lead, key, call, fn)
+
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            if not call.done.is_set():
+                call.futures.append((asyncio.get_running_loop(), future))
+            else:
+                future.set_result(None)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            return await anyio.to_thread.run_sync(fn)
+        return self._result(call)
+
+    def forget(self) -> None:
+        """
+        Новые запросы не присоединяются к уже идущим выполнениям (например,
+        после инвалидации данных): их результат мог устареть.
+        """
+        with self._lock:
+            self._calls.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+            }
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Счетчики по всем группам процесса."""
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,658 @@
+"""
+Общий для всех воркеров снимок каталога в файле, отображаемом в память.
+
+Снимок - неизменяемый колоночный файл: массивы id, цен, остатков,
+статусов, брендов и категорий товаров и вариантов плюс таблицы строк
+(названия, slug, sku). Воркер открывает его через mmap и читает колонки
+через memoryview без копирования, так что страницы файла одни на всех
+воркеров машины (page cache), а открытие не требует разбора данных.
+
+Формат (порядок байт - машинный, файл не переносится между машинами):
+    заголовок HEADER: магия, поколение (версия каталога, см. changefeed),
+        время построения, число секций;
+    таблица секций SECTION: имя, смещение, размер;
+    секции, выровненные по 8 байт: колонки COLUMNS и таблицы строк
+        STRINGS (<имя>.offsets - смещения, n + 1; <имя>.data - UTF-8).
+Строки колонок отсортированы по id; отсутствующий id - NONE.
+
+Снимок строится в SNAPSHOT_DIR под новым именем и подменяется
+атомарно: символическая ссылка current переключается через os.replace.
+Открытые воркерами прежние снимки остаются валидными до закрытия.
+Строит один воркер машины (flock на build.lock). Раз в SNAPSHOT_INTERVAL
+он проверяет версию каталога; если она изменилась, снимок
+перестраивается после затишья - SNAPSHOT_QUIET секунд без изменений,
+но не позже чем через SNAPSHOT_MAX_LAG секунд после прошлой сборки. Без
+изменений снимок перестраивается раз в SNAPSHOT_MAX_AGE (новые товары и
+категории журнал изменений не отражает).
+
+Снимок отстает от базы, поэтому читатели берут его через get_view():
+снимок плюс товары, измененные после его поколения (по журналу
+изменений, затем по инвалидациям "products", в том числе из других
+воркеров через шину). Данные этих товаров читаются из базы, остальных -
+из снимка. Так из снимка строятся дерево категорий (crud, surrogate),
+индекс подсказок (suggest), гистограммы цен (price_stats) и наличие
+вариантов (availability) вместо отдельных копий в каждом воркере.
+
+    python snapshot.py build|info
+"""
+
+import asyncio
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from decimal import Decimal
+from time import monotonic
+from typing import Any, Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import cache
+import changefeed
+import models
+from database import ReadSessionLocal
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "./snapshots")
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", "5"))
+SNAPSHOT_QUIET = int(os.environ.get("SNAPSHOT_QUIET", "5"))
+SNAPSHOT_MAX_LAG = float(os.environ.get("SNAPSHOT_MAX_LAG", "60"))
+SNAPSHOT_MAX_AGE = float(os.environ.get("SNAPSHOT_MAX_AGE", "300"))
+# Как часто читатель проверяет, не сменился ли снимок, секунды
+CHECK_INTERVAL = 1.0
+# Сколько последних снимков хранить на диске
+KEEP_SNAPSHOTS = 2
+
+CURRENT_NAME = "current"
+LOCK_NAME = "build.lock"
+
+MAGIC = b"CATSNAP2"
+HEADER = struct.Struct("=8sQQI")
+SECTION = struct.Struct("=24sQQ")
+ALIGN = 8
+NONE = -1
+
+# Колонка -> код типа (array и memoryview.cast)
+COLUMNS = {
+    "category.id": "i",
+    "category.parent": "i",
+    "brand.id": "i",
+    "product.id": "i",
+    "product.brand": "i",
+    "product.category": "i",
+    "variant.id": "i",
+    "variant.product": "i",
+    # Цена в копейках
+    "variant.price": "q",
+    "variant.stock": "i",
+    # Номер в таблице строк status
+    "variant.status": "B",
+}
+STRINGS = (
+    "category.slug",
+    "category.name",
+    "brand.slug",
+    "brand.name",
+    "product.name",
+    "product.slug",
+    "variant.sku",
+    "status",
+)
+
+
+class CategoryRow(NamedTuple):
+    id: int
+    slug: str
+    name: str
+    parent_id: Optional[int]
+
+
+class BrandRow(NamedTuple):
+    id: int
+    slug: str
+    name: str
+
+
+class ProductRow(NamedTuple):
+    id: int
+    name: str
+    brand_id: Optional[int]
+    category_id: Optional[int]
+    slug: str
+
+
+class VariantRow(NamedTuple):
+    id: int
+    product_id: int
+    sku: Optional[str]
+    price: Decimal
+    stock: int
+    status: str
+
+
+def _optional(value: int) -> Optional[int]:
+    return None if value == NONE else value
+
+
+class StringTable:
+    """Строки снимка; декодируются при обращении."""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return str(self._data[start:end], "utf-8")
+
+
+class Snapshot:
+    """Открытый снимок. Колонки - memoryview поверх mmap, без копий."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.size = stat.st_size
+
+        view = memoryview(self._mmap)
+        magic, self.generation, built_at, count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не снимок каталога")
+        self.built_at = built_at / 1000
+        sections = {}
+        for i in range(count):
+            name, offset, size = SECTION.unpack_from(
+                view, HEADER.size + i * SECTION.size
+            )
+            sections[name.rstrip(b"\0").decode()] = view[offset : offset + size]
+
+        self.columns: Dict[str, memoryview] = {
+            name: sections[name].cast(code) for name, code in COLUMNS.items()
+        }
+        self.strings: Dict[str, StringTable] = {
+            name: StringTable(
+                sections[f"{name}.offsets"].cast("I"), sections[f"{name}.data"]
+            )
+            for name in STRINGS
+        }
+        # Указатели по дереву категорий строятся при первом обращении
+        self._category_slugs: Optional[Dict[str, int]] = None
+        self._category_children: Optional[Dict[int, List[int]]] = None
+
+    def _find(self, table: str, row_id: int) -> Optional[int]:
+        ids = self.columns[f"{table}.id"]
+        index = bisect.bisect_left(ids, row_id)
+        if index < len(ids) and ids[index] == row_id:
+            return index
+        return None
+
+    def count(self, table: str) -> int:
+        return len(self.columns[f"{table}.id"])
+
+    def get_category(self, category_id: int) -> Optional[CategoryRow]:
+        i = self._find("category", category_id)
+        if i is None:
+            return None
+        return CategoryRow(
+            category_id,
+            self.strings["category.slug"][i],
+            self.strings["category.name"][i],
+            _optional(self.columns["category.parent"][i]),
+        )
+
+    def get_categories(self) -> List[CategoryRow]:
+        return [
+            self.get_category(category_id)
+            for category_id in self.columns["category.id"]
+        ]
+
+    def _build_category_pointers(self) -> None:
+        ids = self.columns["category.id"]
+        parents = self.columns["category.parent"]
+        slugs = self.strings["category.slug"]
+        children: Dict[int, List[int]] = {}
+        for i, category_id in enumerate(ids):
+            if parents[i] != NONE:
+                children.setdefault(parents[i], []).append(category_id)
+        self._category_children = children
+        self._category_slugs = {slugs[i]: ids[i] for i in range(len(ids))}
+
+    def find_category(self, slug: str) -> Optional[int]:
+        """id категории по slug."""
+        if self._category_slugs is None:
+            self._build_category_pointers()
+        return self._category_slugs.get(slug)
+
+    def get_category_children(self, category_id: int) -> List[CategoryRow]:
+        """Прямые дочерние категории в порядке id."""
+        if self._category_children is None:
+            self._build_category_pointers()
+        return [
+            self.get_category(child_id)
+            for child_id in self._category_children.get(category_id, ())
+        ]
+
+    def get_category_subtree(self, category_id: int) -> List[int]:
+        """Категория и все ее потомки."""
+        if self._category_children is None:
+            self._build_category_pointers()
+        ids = [category_id]
+        for current_id in ids:
+            ids.extend(self._category_children.get(current_id, ()))
+            if len(ids) > self.count("category"):
+                break
+        return ids
+
+    def get_category_ancestors(self, category_id: int) -> List[int]:
+        """Категория и все ее родительские, снизу вверх."""
+        ids = []
+        i = self._find("category", category_id)
+        while i is not None and len(ids) < self.count("category"):
+            ids.append(self.columns["category.id"][i])
+            parent_id = self.columns["category.parent"][i]
+            i = None if parent_id == NONE else self._find("category", parent_id)
+        return ids
+
+    def get_brands(self) -> List[BrandRow]:
+        return [
+            BrandRow(
+                brand_id, self.strings["brand.slug"][i], self.strings["brand.name"][i]
+            )
+            for i, brand_id in enumerate(self.columns["brand.id"])
+        ]
+
+    def get_product(self, product_id: int) -> Optional[ProductRow]:
+        i = self._find("product", product_id)
+        if i is None:
+            return None
+        return ProductRow(
+            product_id,
+            self.strings["product.name"][i],
+            _optional(self.columns["product.brand"][i]),
+            _optional(self.columns["product.category"][i]),
+            self.strings["product.slug"][i],
+        )
+
+    def iter_sellable_variants(self) -> Iterator[Tuple[int, int, Optional[int], int]]:
+        """
+        Активные варианты с остатком: (id, id товара, id категории товара,
+        цена в копейках).
+        """
+        statuses = self.strings["status"]
+        active = next(
+            (
+                code
+                for code in range(len(statuses))
+                if statuses[code] == models.VariantStatus.ACTIVE.value
+            ),
+            None,
+        )
+        columns = self.columns
+        for i, variant_id in enumerate(columns["variant.id"]):
+            if (
+                columns["variant.status"][i] != active
+                or columns["variant.stock"][i] <= 0
+            ):
+                continue
+            product_id = columns["variant.product"][i]
+            product = self._find("product", product_id)
+            category_id = (
+                NONE if product is None else columns["product.category"][product]
+            )
+            price = columns["variant.price"][i]
+            yield variant_id, product_id, _optional(category_id), price
+
+    def get_variant(self, variant_id: int) -> Optional[VariantRow]:
+        i = self._find("variant", variant_id)
+        if i is None:
+            return None
+        return VariantRow(
+            variant_id,
+            self.columns["variant.product"][i],
+            self.strings["variant.sku"][i] or None,
+            Decimal(self.columns["variant.price"][i]).scaleb(-2),
+            self.columns["variant.stock"][i],
+            self.strings["status"][self.columns["variant.status"][i]],
+        )
+
+
+# Сборка
+
+
+def _strings(values: List[Optional[str]]) -> Tuple[array, bytes]:
+    offsets = array("I", [0])
+    data = bytearray()
+    for value in values:
+        data += (value or "").encode("utf-8")
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def _collect(db: Session) -> Dict[str, Any]:
+    """Секции снимка из базы: имя -> array или bytes."""
+    sections: Dict[str, Any] = {}
+    strings: Dict[str, List[Optional[str]]] = {}
+
+    rows = db.execute(
+        select(
+            models.Category.id,
+            models.Category.parent_id,
+            models.Category.slug,
+            models.Category.name,
+        ).order_by(models.Category.id)
+    ).all()
+    sections["category.id"] = array("i", [row.id for row in rows])
+    sections["category.parent"] = array(
+        "i", [NONE if row.parent_id is None else row.parent_id for row in rows]
+    )
+    strings["category.slug"] = [row.slug for row in rows]
+    strings["category.name"] = [row.name for row in rows]
+
+    rows = db.execute(
+        select(models.Brand.id, models.Brand.slug, models.Brand.name).order_by(
+            models.Brand.id
+        )
+    ).all()
+    sections["brand.id"] = array("i", [row.id for row in rows])
+    strings["brand.slug"] = [row.slug for row in rows]
+    strings["brand.name"] = [row.name for row in rows]
+
+    rows = db.execute(
+        select(
+            models.Product.id,
+            models.Product.name,
+            models.Product.brand_id,
+            models.Product.category_id,
+            models.Product.slug,
+        ).order_by(models.Product.id)
+    ).all()
+    sections["product.id"] = array("i", [row.id for row in rows])
+    sections["product.brand"] = array(
+        "i", [NONE if row.brand_id is None else row.brand_id for row in rows]
+    )
+    sections["product.category"] = array(
+        "i", [NONE if row.category_id is None else row.category_id for row in rows]
+    )
+    strings["product.name"] = [row.name for row in rows]
+    strings["product.slug"] = [row.slug for row in rows]
+
+    statuses = [status.value for status in models.VariantStatus]
+    rows = db.execute(
+        select(
+            models.ProductVariant.id,
+            models.ProductVariant.product_id,
+            models.ProductVariant.sku,
+            models.ProductVariant.price,
+            models.ProductVariant.stock,
+            models.ProductVariant.status,
+        ).order_by(models.ProductVariant.id)
+    ).all()
+    status_codes = []
+    for row in rows:
+        if row.status not in statuses:
+            statuses.append(row.status)
+        status_codes.append(statuses.index(row.status))
+    sections["variant.id"] = array("i", [row.id for row in rows])
+    sections["variant.product"] = array("i", [row.product_id for row in rows])
+    sections["variant.price"] = array(
+        "q", [int(round(Decimal(str(row.price)) * 100)) for row in rows]
+    )
+    sections["variant.stock"] = array("i", [row.stock for row in rows])
+    sections["variant.status"] = array("B", status_codes)
+    strings["variant.sku"] = [row.sku for row in rows]
+    strings["status"] = statuses
+
+    for name, values in strings.items():
+        sections[f"{name}.offsets"], sections[f"{name}.data"] = _strings(values)
+    return sections
+
+
+def _write(path: str, generation: int, sections: Dict[str, Any]) -> None:
+    table_end = HEADER.size + SECTION.size * len(sections)
+    layout = []
+    offset = table_end
+    for name, data in sections.items():
+        offset += -offset % ALIGN
+        size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        layout.append((name, offset, size, data))
+        offset += size
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, generation, int(time.time() * 1000), len(sections)))
+        for name, offset, size, _ in layout:
+            f.write(SECTION.pack(name.encode(), offset, size))
+        for name, offset, size, data in layout:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data.tobytes() if isinstance(data, array) else data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_header(path: str) -> Optional[Tuple[int, float]]:
+    """(поколение, время построения) текущего снимка или None."""
+    try:
+        with open(path, "rb") as f:
+            magic, generation, built_at, _ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return (generation, built_at / 1000) if magic == MAGIC else None
+
+
+def _is_quiet(db: Session, since: int) -> bool:
+    """Нет изменений каталога после версии since за последние SNAPSHOT_QUIET секунд."""
+    recent = db.scalar(
+        select(models.CatalogChange.id)
+        .where(
+            models.CatalogChange.id > since,
+            models.CatalogChange.created_at
+            > func.datetime("now", f"-{SNAPSHOT_QUIET} seconds"),
+        )
+        .limit(1)
+    )
+    return recent is None
+
+
+def _is_due(db: Session, current: Optional[Tuple[int, float]], generation: int) -> bool:
+    if current is None:
+        return True
+    age = time.time() - current[1]
+    if age >= SNAPSHOT_MAX_AGE:
+        return True
+    if current[0] == generation:
+        return False
+    # Пока каталог меняется, читатели берут изменения из журнала и базы
+    return age >= SNAPSHOT_MAX_LAG or _is_quiet(db, current[0])
+
+
+def build(db: Session, directory: str = SNAPSHOT_DIR, force: bool = False) -> bool:
+    """
+    Строит новый снимок и делает его текущим, если пора (см. описание
+    модуля) или force. Возвращает True, если снимок построен.
+    """
+    current_path = os.path.join(directory, CURRENT_NAME)
+    # Версия до чтения данных: изменения во время сборки попадут в следующий снимок
+    generation = changefeed.get_version(db)
+    if not force and not _is_due(db, _read_header(current_path), generation):
+        return False
+
+    os.makedirs(directory, exist_ok=True)
+    name = f"catalog-{generation}-{time.time_ns()}.snap"
+    _write(os.path.join(directory, name + ".tmp"), generation, _collect(db))
+    os.replace(os.path.join(directory, name + ".tmp"), os.path.join(directory, name))
+
+    link = os.path.join(directory, CURRENT_NAME + ".tmp")
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(name, link)
+    os.replace(link, current_path)
+
+    # Старые снимки; открытые воркерами остаются доступны до закрытия
+    snapshots = sorted(
+        (entry for entry in os.listdir(directory) if entry.endswith(".snap")),
+        key=lambda entry: os.path.getmtime(os.path.join(directory, entry)),
+    )
+    for entry in snapshots[:-KEEP_SNAPSHOTS]:
+        try:
+            os.remove(os.path.join(directory, entry))
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def refresh(directory: str = SNAPSHOT_DIR) -> bool:
+    """Сборка от имени одного воркера машины; остальные ее пропускают."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_NAME), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        db = ReadSessionLocal()
+        try:
+            return build(db, directory)
+        finally:
+            db.close()
+
+
+async def run_builder(interval: float = SNAPSHOT_INTERVAL) -> None:
+    """Периодическая сборка снимка в фоне воркера."""
+    while True:
+        try:
+            await asyncio.to_thread(refresh)
+        except Exception as e:
+            print(f"Ошибка сборки снимка каталога: {e}")
+        await asyncio.sleep(interval)
+
+
+# Чтение
+
+_current: Optional[Snapshot] = None
+_checked_at = float("-inf")
+_lock = threading.Lock()
+
+
+def get_snapshot() -> Optional[Snapshot]:
+    """
+    Текущий снимок (None - еще не построен). Смена снимка проверяется
+    не чаще раза в CHECK_INTERVAL; прежний снимок освобождается, когда
+    на него не остается ссылок.
+    """
+    global _current, _checked_at
+    if monotonic() - _checked_at < CHECK_INTERVAL:
+        return _current
+    with _lock:
+        if monotonic() - _checked_at < CHECK_INTERVAL:
+            return _current
+        _checked_at = monotonic()
+        path = os.path.join(SNAPSHOT_DIR, CURRENT_NAME)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return _current
+        if _current is None or _current.file_id != (stat.st_dev, stat.st_ino):
+            try:
+                _current = Snapshot(path)
+            except (OSError, ValueError) as e:
+                print(f"Ошибка открытия снимка каталога: {e}")
+        return _current
+
+
+class CatalogView(NamedTuple):
+    """Снимок и товары, измененные после его поколения: их - из базы."""
+
+    snapshot: Snapshot
+    changed: FrozenSet[int]
+
+
+_view_file_id: Optional[Tuple[int, int]] = None
+# None - журнал изменений после поколения снимка еще не прочитан
+_changed: Optional[FrozenSet[int]] = None
+_view_lock = threading.Lock()
+
+
+def get_view(db: Session) -> Optional[CatalogView]:
+    """
+    Текущий снимок с изменившимися после него товарами. None - снимка
+    нет или журнал уже не покрывает его поколение: читать из базы.
+    """
+    global _view_file_id, _changed
+
+    current = get_snapshot()
+    if current is None:
+        return None
+    changed = _changed
+    if changed is not None and _view_file_id == current.file_id:
+        return CatalogView(current, changed)
+    with _view_lock:
+        if _view_file_id != current.file_id:
+            _view_file_id = current.file_id
+            _changed = None
+        if _changed is None:
+            # Инвалидации приходят после коммита: изменения, не попавшие
+            # в журнал на момент чтения, добавит _on_products_changed
+            product_ids = changefeed.get_changed_products(db, current.generation)
+            if product_ids is None:
+                return None
+            _changed = frozenset(product_ids)
+        return CatalogView(current, _changed)
+
+
+def _on_products_changed(product_ids: Optional[List[int]]) -> None:
+    global _changed
+
+    with _view_lock:
+        if product_ids is None:
+            # Что изменилось, неизвестно: журнал будет прочитан заново
+            _changed = None
+        elif _changed is not None:
+            _changed = _changed.union(product_ids)
+
+
+cache.subscribe("products", _on_products_changed)
+
+
+def get_stats() -> Optional[Dict[str, Any]]:
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    return {
+        "generation": snapshot.generation,
+        "age_seconds": round(time.time() - snapshot.built_at, 1),
+        "bytes": snapshot.size,
+        "categories": snapshot.count("category"),
+        "brands": snapshot.count("brand"),
+        "products": snapshot.count("product"),
+        "variants": snapshot.count("variant"),
+        # None - журнал после поколения этого снимка еще не прочитан
+        "changed_products": (
+            len(_changed)
+            if _changed is not None and _view_file_id == snapshot.file_id
+            else None
+        ),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "build":
+        db = ReadSessionLocal()
+        try:
+            build(db, force=True)
+        finally:
+            db.close()
+        print(f"✅ Снимок каталога построен: {get_stats()}")
+    elif command == "info":
+        print(get_stats())
+    else:
+        sys.exit("Использование: python snapshot.py build|info")
@@ -0,0 +1,494 @@
+"""
+Подсказки для строки поиска: внутрипроцессный префиксный и триграммный индекс
+по названиям товаров, брендов и категорий.
+
+Префиксный индекс - отсортированный словарь слов (поиск bisect'ом),
+триграммный - триграммы слов словаря. Опечатки исправляются на уровне
+слов по триграммному сходству, ошибки раскладки - повторным поиском
+по запросу, переведенному между ЙЦУКЕН и QWERTY.
+
+Индекс неизменяем: изменения каталога собираются в новый индекс рядом
+с действующим и публикуются заменой одной ссылки, поэтому запросы
+читают индекс без блокировок и не ждут обновлений.
+"""
+
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, exists, select
+from sqlalchemy.orm import Session
+
+import cache
+import models
+import snapshot
+
+# Типы записей индекса
+KIND_CATEGORY = 0
+KIND_BRAND = 1
+KIND_PRODUCT = 2
+KIND_NAMES = ("category", "brand", "product")
+
+# Нечеткое совпадение слова: доля триграмм слова запроса, найденных в слове словаря
+MIN_SIMILARITY = 0.6
+FUZZY_SCORE = 0.9
+# Ограничения на объем работы одного запроса
+MAX_PREFIX_TOKENS = 64
+MAX_SCANNED = 1000
+MAX_CANDIDATES = 200
+# Изменившихся записей, после которых индекс перестраивается целиком
+MAX_DELTA = 2000
+
+_LATIN_KEYS = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+_CYRILLIC_KEYS = "йцукенгшщзхъфывапролджэячсмитьбюё"
+_LATIN_TO_CYRILLIC = str.maketrans(_LATIN_KEYS, _CYRILLIC_KEYS)
+_CYRILLIC_TO_LATIN = str.maketrans(_CYRILLIC_KEYS, _LATIN_KEYS)
+
+_WORD_RE = re.compile(r"\w+")
+
+# Запись индекса: (тип, id, название, slug)
+Entry = Tuple[int, int, str, str]
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def _tokenize(text: str) -> List[str]:
+    return _WORD_RE.findall(_normalize(text))
+
+
+def _trigrams(token: str, pad_end: bool = True) -> Set[str]:
+    # Слово запроса может быть недописанным, поэтому конец для него не дополняется
+    padded = f"  {token} " if pad_end else f"  {token}"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _layout_variants(query: str) -> List[str]:
+    """Исходный запрос и его варианты в другой раскладке клавиатуры."""
+    lowered = query.lower()
+    variants = [lowered]
+    for converted in (
+        lowered.translate(_LATIN_TO_CYRILLIC),
+        lowered.translate(_CYRILLIC_TO_LATIN),
+    ):
+        if converted not in variants:
+            variants.append(converted)
+    return variants
+
+
+class _Postings:
+    """
+    Неизменяемая часть индекса.
+
+    Словарь слов хранится один раз: отсортированный список для поиска
+    по префиксу и триграммы слов для исправления опечаток. Каждое слово
+    ссылается на array('I') номеров записей, в которых оно встречается.
+    """
+
+    def __init__(self, entries: Iterable[Entry]):
+        self.entries: List[Entry] = []
+        self.entry_tokens: List[Tuple[int, ...]] = []
+        self.entry_by_key: Dict[Tuple[int, int], int] = {}
+        self.postings: List[array] = []
+        self.trigrams: Dict[str, array] = {}
+        vocab: List[str] = []
+        token_ids: Dict[str, int] = {}
+
+        for entry in entries:
+            entry_id = len(self.entries)
+            self.entries.append(entry)
+            self.entry_by_key[(entry[0], entry[1])] = entry_id
+            entry_token_ids = []
+            for token in dict.fromkeys(_tokenize(entry[2])):
+                token_id = token_ids.get(token)
+                if token_id is None:
+                    token_id = len(vocab)
+                    vocab.append(token)
+                    token_ids[token] = token_id
+                    self.postings.append(array("I"))
+                    for gram in _trigrams(token):
+                        self.trigrams.setdefault(gram, array("I")).append(token_id)
+                self.postings[token_id].append(entry_id)
+                entry_token_ids.append(token_id)
+            self.entry_tokens.append(tuple(entry_token_ids))
+
+        # Словарь по алфавиту и номера его слов в том же порядке
+        self.sorted_vocab = sorted(vocab)
+        self.sorted_token_ids = array(
+            "I", (token_ids[token] for token in self.sorted_vocab)
+        )
+
+    def _prefix_matches(self, query_token: str) -> Dict[int, float]:
+        matches: Dict[int, float] = {}
+        position = bisect_left(self.sorted_vocab, query_token)
+        end = min(len(self.sorted_vocab), position + MAX_PREFIX_TOKENS)
+        while position < end and self.sorted_vocab[position].startswith(query_token):
+            matches[self.sorted_token_ids[position]] = 1.0
+            position += 1
+        return matches
+
+    def _similar_tokens(self, query_token: str) -> Dict[int, float]:
+        """Слова словаря, похожие на слово запроса по триграммам (опечатки)."""
+        query_grams = _trigrams(query_token, pad_end=False)
+        overlap = Counter(
+            chain.from_iterable(self.trigrams.get(gram, ()) for gram in query_grams)
+        )
+        min_common = MIN_SIMILARITY * len(query_grams)
+        return {
+            token_id: FUZZY_SCORE * common / len(query_grams)
+            for token_id, common in overlap.items()
+            if common >= min_common
+        }
+
+    def match(
+        self, tokens: List[str], fuzzy: bool, hidden: FrozenSet[int]
+    ) -> Dict[int, float]:
+        """
+        Записи, содержащие слова запроса: по префиксу (вес 1.0), а с fuzzy -
+        и по триграммному сходству для слов без совпадений по префиксу.
+        С fuzzy возвращает пустой результат, если исправлять нечего.
+
+        Кандидаты берутся по самому редкому слову, остальные проверяются
+        по словам самой записи. Нераспознанные слова не отсекают результат,
+        а снижают его вес. Записи из hidden пропускаются.
+        """
+        token_matches = []
+        corrected = False
+        for token in tokens:
+            matches = self._prefix_matches(token)
+            if not matches and fuzzy and len(token) >= 3:
+                matches = self._similar_tokens(token)
+                corrected = corrected or bool(matches)
+            if matches:
+                token_matches.append(matches)
+        if not token_matches or (fuzzy and not corrected):
+            return {}
+
+        token_matches.sort(
+            key=lambda matches: sum(len(self.postings[t]) for t in matches)
+        )
+        rarest, others = token_matches[0], token_matches[1:]
+        token_sets = [frozenset(matches) for matches in others]
+        # Веса нужны только для совпадений по триграммам, по префиксу вес 1.0
+        weighted = [
+            matches
+            for matches in others
+            if any(score != 1.0 for score in matches.values())
+        ]
+        exact_score = len(others) - len(weighted)
+        entry_tokens = self.entry_tokens
+
+        # Записи в списках идут в порядке добавления: категории и бренды первыми
+        results: Dict[int, float] = {}
+        budget = MAX_SCANNED
+        for token_id, token_score in rarest.items():
+            candidates = self.postings[token_id][:budget]
+            budget -= len(candidates)
+            if hidden:
+                candidates = [e for e in candidates if e not in hidden]
+            for token_set in token_sets:
+                candidates = [
+                    e for e in candidates if not token_set.isdisjoint(entry_tokens[e])
+                ]
+            for entry_id in candidates:
+                if len(results) >= MAX_CANDIDATES:
+                    return results
+                score = token_score + exact_score
+                for matches in weighted:
+                    score += max(matches.get(t, 0.0) for t in entry_tokens[entry_id])
+                score /= len(tokens)
+                if score > results.get(entry_id, 0.0):
+                    results[entry_id] = score
+            if budget <= 0:
+                break
+        return results
+
+
+_NOTHING_HIDDEN: FrozenSet[int] = frozenset()
+
+
+class SuggestIndex:
+    """
+    Индекс подсказок. Не меняется после создания: with_changes() возвращает
+    новый индекс, а действующий можно читать из любого числа потоков.
+
+    Основная часть строится целиком. Изменившиеся записи складываются
+    в небольшую добавочную часть (она пересобирается при каждом изменении),
+    а их прежние версии в основной части скрываются. Когда изменений
+    накапливается больше MAX_DELTA, индекс нужно перестроить (compacted()).
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[Entry] = (),
+        _base: Optional[_Postings] = None,
+        _delta: Optional[_Postings] = None,
+        _hidden: FrozenSet[int] = _NOTHING_HIDDEN,
+    ):
+        self._base = _base if _base is not None else _Postings(entries)
+        self._delta = _delta if _delta is not None else _Postings(())
+        self._hidden = _hidden
+
+    def __len__(self) -> int:
+        return len(self._base.entries) - len(self._hidden) + len(self._delta.entries)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return len(self._hidden) + len(self._delta.entries) > MAX_DELTA
+
+    def entries(self) -> List[Entry]:
+        """Действующие записи индекса."""
+        hidden = self._hidden
+        live = [
+            entry
+            for entry_id, entry in enumerate(self._base.entries)
+            if entry_id not in hidden
+        ]
+        return live + self._delta.entries
+
+    def with_changes(self, changes: Dict[Tuple[int, int], Optional[Entry]]):
+        """
+        Новый индекс с изменениями: (тип, id) -> новая запись или None
+        для удаления. Основная часть общая с текущим индексом.
+        """
+        delta = {(entry[0], entry[1]): entry for entry in self._delta.entries}
+        hidden = set(self._hidden)
+        for key, entry in changes.items():
+            base_id = self._base.entry_by_key.get(key)
+            if base_id is not None:
+                hidden.add(base_id)
+            if entry is None:
+                delta.pop(key, None)
+            else:
+                delta[key] = entry
+        return SuggestIndex(
+            _base=self._base,
+            _delta=_Postings(delta.values()),
+            _hidden=frozenset(hidden),
+        )
+
+    def compacted(self) -> "SuggestIndex":
+        """Тот же индекс, перестроенный целиком, без добавочной части."""
+        return SuggestIndex(self.entries())
+
+    def search(self, query: str, limit: int = 8) -> List[Dict]:
+        parts = [(self._base, self._hidden)]
+        if self._delta.entries:
+            parts.append((self._delta, _NOTHING_HIDDEN))
+
+        scores: Dict[Entry, float] = {}
+        variants = _layout_variants(query)
+        # Сначала слова целиком во всех раскладках, опечатки - если этого мало
+        for fuzzy in (False, True):
+            for variant_number, variant in enumerate(variants):
+                # Другая раскладка нужна, только если точных совпадений не хватает
+                exact = sum(1 for score in scores.values() if score >= 1.0)
+                if exact >= limit:
+                    break
+                tokens = _tokenize(variant)
+                if not tokens:
+                    continue
+                # Исходная раскладка важнее переведенной
+                penalty = 0.05 * variant_number
+                for part, hidden in parts:
+                    for entry_id, score in part.match(tokens, fuzzy, hidden).items():
+                        entry = part.entries[entry_id]
+                        if score - penalty > scores.get(entry, 0.0):
+                            scores[entry] = score - penalty
+
+        best = heapq.nsmallest(
+            limit,
+            scores.items(),
+            key=lambda item: (-item[1], item[0][0], len(item[0][2])),
+        )
+        return [
+            {"type": KIND_NAMES[kind], "id": entity_id, "name": name, "slug": slug}
+            for (kind, entity_id, name, slug), _ in best
+        ]
+
+
+# Опубликованный индекс; заменяется целиком, читается без блокировок
+_index: Optional[SuggestIndex] = None
+_index_ready = False
+# Построение и изменение индекса - по одному потоку за раз
+_build_lock = threading.Lock()
+_compacting = False
+# Товары, изменившиеся с момента последнего обращения к индексу
+_pending_product_ids: Set[int] = set()
+_pending_lock = threading.Lock()
+
+
+def _sellable_products_stmt():
+    return select(models.Product.id, models.Product.name, models.Product.slug).where(
+        exists().where(
+            and_(
+                models.ProductVariant.product_id == models.Product.id,
+                models.ProductVariant.stock > 0,
+                models.ProductVariant.status == models.VariantStatus.ACTIVE,
+            )
+        )
+    )
+
+
+def _load_entries(db: Session) -> List[Entry]:
+    entries = [
+        (KIND_CATEGORY, category_id, name, slug)
+        for category_id, name, slug in db.execute(
+            select(models.Category.id, models.Category.name, models.Category.slug)
+        )
+    ]
+    entries += [
+        (KIND_BRAND, brand_id, name, slug)
+        for brand_id, name, slug in db.execute(
+            select(models.Brand.id, models.Brand.name, models.Brand.slug)
+        )
+    ]
+    entries += [
+        (KIND_PRODUCT, product_id, name, slug)
+        for product_id, name, slug in db.execute(_sellable_products_stmt())
+    ]
+    return entries
+
+
+def _snapshot_entries(db: Session, view: snapshot.CatalogView) -> List[Entry]:
+    """Записи из снимка; товары, измененные после него, - из базы."""
+    current = view.snapshot
+    entries = [
+        (KIND_CATEGORY, category.id, category.name, category.slug)
+        for category in current.get_categories()
+    ]
+    entries += [
+        (KIND_BRAND, brand.id, brand.name, brand.slug) for brand in current.get_brands()
+    ]
+    sellable_ids = dict.fromkeys(
+        product_id
+        for _, product_id, _, _ in current.iter_sellable_variants()
+        if product_id not in view.changed
+    )
+    for product_id in sellable_ids:
+        product = current.get_product(product_id)
+        entries.append((KIND_PRODUCT, product_id, product.name, product.slug))
+    if view.changed:
+        entries += [
+            (KIND_PRODUCT, product_id, name, slug)
+            for product_id, name, slug in db.execute(
+                _sellable_products_stmt().where(
+                    models.Product.id.in_(list(view.changed))
+                )
+            )
+        ]
+    return entries
+
+
+def build_index(db: Session) -> None:
+    """
+    Полностью строит индекс: категории, бренды и товары, доступные к заказу.
+    Данные берутся из снимка каталога (см. snapshot.get_view), без него -
+    из базы.
+    """
+    global _index, _index_ready
+
+    # Раньше чтения: изменение во время построения вызовет новое построение
+    _index_ready = True
+    with _pending_lock:
+        _pending_product_ids.clear()
+
+    view = snapshot.get_view(db)
+    if view is None:
+        entries = _load_entries(db)
+    else:
+        entries = _snapshot_entries(db, view)
+    _index = SuggestIndex(entries)
+
+
+def _mark_products_changed(product_ids: Optional[List[int]]) -> None:
+    global _index_ready
+
+    if product_ids is None:
+        _index_ready = False
+        return
+    with _pending_lock:
+        _pending_product_ids.update(product_ids)
+
+
+def _compact() -> None:
+    global _index, _compacting
+
+    try:
+        with _build_lock:
+            _index = _index.compacted()
+    finally:
+        _compacting = False
+
+
+def _apply_pending_changes(db: Session) -> None:
+    """
+    Применяет накопленные изменения товаров. Вызывается из запросов; если
+    индекс уже меняет другой поток, запрос не ждет его, а изменения
+    остаются в очереди до следующего запроса.
+    """
+    global _index, _compacting
+
+    if not _pending_product_ids or not _build_lock.acquire(blocking=False):
+        return
+    try:
+        with _pending_lock:
+            product_ids = list(_pending_product_ids)
+            _pending_product_ids.clear()
+
+        sellable = {
+            product_id: (name, slug)
+            for product_id, name, slug in db.execute(
+                _sellable_products_stmt().where(models.Product.id.in_(product_ids))
+            )
+        }
+        changes = {
+            (KIND_PRODUCT, product_id): (
+                (KIND_PRODUCT, product_id, *sellable[product_id])
+                if product_id in sellable
+                else None
+            )
+            for product_id in product_ids
+        }
+        _index = _index.with_changes(changes)
+
+        # Полная перестройка - в фоне, пока запросы читают текущий индекс
+        if _index.needs_compaction and not _compacting:
+            _compacting = True
+            threading.Thread(
+                target=_compact, name="suggest-compact", daemon=True
+            ).start()
+    finally:
+        _build_lock.release()
+
+
+def suggest(db: Session, query: str, limit: int = 8) -> List[Dict]:
+    """
+    Возвращает подсказки для запроса. Индекс строится при первом обращении,
+    затем обновляется только по изменившимся товарам. После полного сброса
+    индекс перестраивает один запрос, остальные отвечают по прежнему.
+    """
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                build_index(db)
+    elif not _index_ready and _build_lock.acquire(blocking=False):
+        try:
+            if not _index_ready:
+                build_index(db)
+        finally:
+            _build_lock.release()
+    else:
+        _apply_pending_changes(db)
+
+    index = _index
+    return index.search(query, limit=limit)
+
+
+cache.subscribe("products", _mark_products_changed)
@@ -0,0 +1,248 @@
+"""
+Теги ответов каталога для кэширующего прокси (nginx, Varnish) и их очистка.
+
+Ответы каталога помечаются заголовками Surrogate-Key (через пробел) и
+Cache-Tag (через запятую) с ключами:
+    product-<id>  - товар в ответе;
+    brand-<id>    - бренд товара или фильтра;
+    category-<id> - категория, по которой построен список или фильтры;
+    catalog       - список без категории (по всему каталогу).
+Cache-Control разрешает прокси хранить ответ SURROGATE_MAX_AGE секунд,
+браузеру - нет: актуальность в прокси обеспечивает очистка по ключам.
+
+После изменения товаров (оформление, отмена, админка) crud вызывает
+purge_products(). id копятся и раз в PURGE_INTERVAL отправляются
+пачками: ключи товаров, их брендов, категорий со всеми родительскими и
+catalog - запросом SURROGATE_PURGE_METHOD на SURROGATE_PURGE_URL
+с ключами в заголовке SURROGATE_PURGE_HEADER. Без SURROGATE_PURGE_URL
+очистка отключена. Для проверки без прокси см. purge_recorder.py.
+"""
+
+import atexit
+import os
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+import snapshot
+from database import ReadSessionLocal
+
+SURROGATE_MAX_AGE = int(os.environ.get("SURROGATE_MAX_AGE", "3600"))
+PURGE_URL = os.environ.get("SURROGATE_PURGE_URL", "")
+PURGE_METHOD = os.environ.get("SURROGATE_PURGE_METHOD", "PURGE")
+PURGE_HEADER = os.environ.get("SURROGATE_PURGE_HEADER", "Surrogate-Key")
+# Сколько копить изменения перед отправкой, секунды
+PURGE_INTERVAL = float(os.environ.get("SURROGATE_PURGE_INTERVAL", "0.5"))
+# Ключей в одном запросе очистки (ограничение длины заголовка)
+PURGE_BATCH_SIZE = 200
+PURGE_RETRY_SECONDS = 5
+
+CATALOG_KEY = "catalog"
+
+CACHEABLE = f"public, max-age=0, s-maxage={SURROGATE_MAX_AGE}"
+NOT_CACHEABLE = "no-store"
+
+
+class Tagged(NamedTuple):
+    """Значение ответа с ключами; fresh=False - отдано устаревшим."""
+
+    value: Any
+    keys: Tuple[str, ...]
+    fresh: bool = True
+
+
+def product_key(product_id: int) -> str:
+    return f"product-{product_id}"
+
+
+def brand_key(brand_id: int) -> str:
+    return f"brand-{brand_id}"
+
+
+def category_key(category_id: int) -> str:
+    return f"category-{category_id}"
+
+
+def _get_category_ancestors(db: Session, category_id: int) -> List[int]:
+    """
+    Категория и все ее родительские, снизу вверх. Из снимка каталога;
+    категории, которой в нем еще нет, - из базы.
+    """
+    current = snapshot.get_snapshot()
+    if current is not None:
+        ids = current.get_category_ancestors(category_id)
+        if ids:
+            return ids
+
+    parents = dict(
+        db.execute(select(models.Category.id, models.Category.parent_id)).all()
+    )
+    ids = []
+    while category_id in parents and category_id not in ids:
+        ids.append(category_id)
+        category_id = parents[category_id]
+    return ids
+
+
+def listing_keys(
+    db: Session, category_slug: Optional[str], products: Iterable[Any]
+) -> Tuple[str, ...]:
+    """
+    Ключи списка товаров: его категория (catalog - без категории или
+    неизвестная категория), товары страницы и их бренды.
+    """
+    keys = []
+    if category_slug:
+        current = snapshot.get_snapshot()
+        category_id = None if current is None else current.find_category(category_slug)
+        if category_id is not None:
+            keys.append(category_key(category_id))
+        else:
+            keys.extend(
+                category_key(category_id)
+                for category_id in db.scalars(
+                    select(models.Category.id).where(
+                        models.Category.slug == category_slug
+                    )
+                )
+            )
+    if not keys:
+        keys.append(CATALOG_KEY)
+    for product in products:
+        keys.append(product_key(product.id))
+        if product.brand_id is not None:
+            keys.append(brand_key(product.brand_id))
+    return tuple(dict.fromkeys(keys))
+
+
+def tag(response, keys: Iterable[str], cacheable: bool = True):
+    """Проставляет ключи и Cache-Control ответу; возвращает его же."""
+    keys = list(dict.fromkeys(keys))
+    response.headers["Surrogate-Key"] = " ".join(keys)
+    response.headers["Cache-Tag"] = ",".join(keys)
+    response.headers["Cache-Control"] = CACHEABLE if cacheable else NOT_CACHEABLE
+    return response
+
+
+def _resolve_keys(db: Session, product_ids: Set[int]) -> List[str]:
+    """
+    Ключи ответов, которые могли измениться вместе с товарами. Бренд и
+    категория товара через API не меняются, поэтому берутся из снимка
+    каталога; товары не из снимка - из базы.
+    """
+    keys = {CATALOG_KEY}
+    keys.update(product_key(product_id) for product_id in product_ids)
+
+    products: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+    current = snapshot.get_snapshot()
+    if current is not None:
+        for product_id in product_ids:
+            product = current.get_product(product_id)
+            if product is not None:
+                products[product_id] = (product.category_id, product.brand_id)
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        for product_id, category_id, brand_id in db.execute(
+            select(
+                models.Product.id, models.Product.category_id, models.Product.brand_id
+            ).where(models.Product.id.in_(missing))
+        ):
+            products[product_id] = (category_id, brand_id)
+
+    for category_id, brand_id in products.values():
+        if brand_id is not None:
+            keys.add(brand_key(brand_id))
+        # Товар входит в списки категории и всех ее родителей
+        if category_id is not None:
+            keys.update(
+                category_key(ancestor_id)
+                for ancestor_id in _get_category_ancestors(db, category_id)
+            )
+    return sorted(keys)
+
+
+def _send(keys: List[str]) -> None:
+    request = urllib.request.Request(
+        PURGE_URL, method=PURGE_METHOD, headers={PURGE_HEADER: " ".join(keys)}
+    )
+    with urllib.request.urlopen(request, timeout=5):
+        pass
+
+
+class _Purger:
+    def __init__(self):
+        self.pending: Set[int] = set()
+        self.requests = 0
+        self.keys = 0
+        self.errors = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, product_ids: Iterable[int]) -> None:
+        with self._cond:
+            self.pending.update(product_ids)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="surrogate-purge", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self.pending:
+                    self._cond.wait()
+            # Изменения, пришедшие за интервал, уходят одной пачкой
+            time.sleep(PURGE_INTERVAL)
+            if not self.flush():
+                time.sleep(PURGE_RETRY_SECONDS)
+
+    def flush(self) -> bool:
+        """Отправляет накопленное. False - ошибка, id возвращены в очередь."""
+        with self._cond:
+            product_ids, self.pending = self.pending, set()
+        if not product_ids:
+            return True
+        db = ReadSessionLocal()
+        try:
+            keys = _resolve_keys(db, product_ids)
+            for start in range(0, len(keys), PURGE_BATCH_SIZE):
+                _send(keys[start : start + PURGE_BATCH_SIZE])
+                self.requests += 1
+            self.keys += len(keys)
+            return True
+        except Exception as e:
+            print(f"Ошибка очистки кэша прокси: {e}")
+            self.errors += 1
+            with self._cond:
+                self.pending.update(product_ids)
+            return False
+        finally:
+            db.close()
+
+
+_purger = _Purger()
+# Изменения из командных скриптов (orders_db.py sweep) не теряются при выходе
+atexit.register(_purger.flush)
+
+
+def purge_products(product_ids: Iterable[int]) -> None:
+    """Ставит в очередь очистку прокси после изменения товаров."""
+    if PURGE_URL:
+        _purger.add(product_ids)
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "enabled": bool(PURGE_URL),
+        "pending": len(_purger.pending),
+        "requests": _purger.requests,
+        "keys": _purger.keys,
+        "errors": _purger.errors,
+    }
@@ -0,0 +1,136 @@
+"""
+Кэш stale-while-revalidate для редко меняющихся данных каталога.
+
+У записи два срока:
+- soft_ttl - после него запись устарела: запрос сразу получает ее,
+  а обновление ставится в фоновую очередь (одно на ключ);
+- hard_ttl - после него запись удаляется, и запрос ждет загрузки
+  (одинаковые одновременные загрузки объединяются, см. singleflight).
+
+Инвалидация пространства имён целиком не удаляет записи, а помечает
+их устаревшими: следующий запрос получает прежнее значение и запускает
+обновление. Инвалидация отдельных ключей удаляет их.
+
+Фоновые обновления выполняются в отдельном небольшом пуле потоков
+(SWR_WORKERS) с собственными сессиями только для чтения, поэтому они
+не занимают пул потоков запросов и его соединения с базой.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+import cache
+import singleflight
+from database import ReadSessionLocal
+
+SWR_WORKERS = int(os.environ.get("SWR_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=SWR_WORKERS, thread_name_prefix="swr")
+
+# Все кэши процесса - для статистики
+_caches: Dict[str, "SWRCache"] = {}
+
+# Загрузка значения по сессии
+Loader = Callable[[Session], Any]
+
+
+class SWRCache:
+    def __init__(
+        self,
+        name: str,
+        soft_ttl: float,
+        hard_ttl: float,
+        maxsize: int = 1024,
+        namespace: Optional[str] = None,
+    ):
+        """namespace - пространство имён инвалидации (см. cache.subscribe)."""
+        self.name = name
+        self.soft_ttl = soft_ttl
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        # Записи: (годна до, поколение, значение); ttl - жесткий срок
+        self._entries = cache.TTLCache(name, ttl=hard_ttl, maxsize=maxsize)
+        self._loads = singleflight.Group(name, timeout=hard_ttl)
+        self._generation = 0
+        self._refreshing: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        _caches[name] = self
+        if namespace is not None:
+            cache.subscribe(namespace, self.invalidate)
+
+    def get(self, db: Session, key: Hashable, load: Loader) -> Tuple[Any, bool]:
+        """
+        Возвращает (значение, свежее ли оно). load(db) загружает значение;
+        при промахе выполняется с сессией запроса, при фоновом
+        обновлении - со своей сессией.
+        """
+        found, entry = self._entries.get(key)
+        if found:
+            fresh_until, generation, value = entry
+            if monotonic() > fresh_until or generation != self._generation:
+                self._schedule_refresh(key, load)
+                return value, False
+            return value, True
+        return self._loads.do(key, lambda: self._load(db, key, load)), True
+
+    def _load(self, db: Session, key: Hashable, load: Loader) -> Any:
+        # Поколение до чтения: изменение во время загрузки оставит запись устаревшей
+        generation = self._generation
+        value = load(db)
+        self._entries.set(key, (monotonic() + self.soft_ttl, generation, value))
+        return value
+
+    def _schedule_refresh(self, key: Hashable, load: Loader) -> None:
+        with self._lock:
+            self.stale_hits += 1
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        _executor.submit(self._refresh, key, load)
+
+    def _refresh(self, key: Hashable, load: Loader) -> None:
+        db = ReadSessionLocal()
+        failed = False
+        try:
+            self._load(db, key, load)
+        except Exception as e:
+            # Запись остается устаревшей и обновится при следующем запросе
+            failed = True
+            print(f"Ошибка обновления кэша {self.name}: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing.discard(key)
+                if failed:
+                    self.refresh_errors += 1
+                else:
+                    self.refreshes += 1
+
+    def invalidate(self, keys: Optional[Iterable[Hashable]] = None) -> None:
+        if keys is None:
+            with self._lock:
+                self._generation += 1
+        else:
+            self._entries.invalidate(keys)
+        # Загрузки, начатые до изменения, не разделяются с новыми запросами
+        self._loads.forget()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "soft_ttl": self.soft_ttl,
+            "stale_hits": self.stale_hits,
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Счетчики фоновых обновлений по всем кэшам процесса."""
+    return {name: swr_cache.stats() for name, swr_cache in _caches.items()}
@@ -0,0 +1,105 @@
+"""
+Общие фикстуры тестов.
+
+database.py открывает ./shop.db и ORDERS_DATABASE_PATH относительно
+рабочего каталога, поэтому до импорта модулей приложения рабочим
+становится временный каталог: тесты работают со своими базами.
+Перед каждым тестом таблицы пересоздаются и заполняются небольшим
+каталогом, а внутрипроцессные кэши сбрасываются.
+"""
+
+import os
+import sys
+import tempfile
+from decimal import Decimal
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="shop-tests-")
+
+os.chdir(TEST_DIR)
+os.environ["ORDERS_DATABASE_PATH"] = "./orders.db"
+os.environ["SNAPSHOT_DIR"] = os.path.join(TEST_DIR, "snapshots")
+os.environ["SURROGATE_PURGE_URL"] = ""
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest  # noqa: E402
+
+import cache  # noqa: E402
+import low_stock  # noqa: E402
+import models  # noqa: E402
+import product_cache  # noqa: E402
+from database import SessionLocal  # noqa: E402
+
+
+def _create_catalog() -> None:
+    """
+    Каталог тестов:
+        категория 1 clothes, ее дочерняя 2 shirts; бренд 1 acme;
+        товар 1 (shirts): варианты 1 (10.00, остаток 5) и 2 (12.00, 0);
+        товар 2 (clothes): вариант 3 (20.00, остаток 3).
+    """
+    db = SessionLocal()
+    try:
+        db.add_all(
+            [
+                models.Category(id=1, name="Clothes", slug="clothes"),
+                models.Category(id=2, name="Shirts", slug="shirts", parent_id=1),
+                models.Brand(id=1, name="Acme", slug="acme"),
+            ]
+        )
+        db.flush()
+        db.add_all(
+            [
+                models.Product(
+                    id=1,
+                    name="Blue Shirt",
+                    slug="blue-shirt",
+                    category_id=2,
+                    brand_id=1,
+                ),
+                models.Product(
+                    id=2,
+                    name="Red Hoodie",
+                    slug="red-hoodie",
+                    category_id=1,
+                    brand_id=1,
+                ),
+            ]
+        )
+        db.flush()
+        db.add_all(
+            [
+                models.ProductVariant(
+                    id=1, product_id=1, sku="BS-M", price=Decimal("10.00"), stock=5
+                ),
+                models.ProductVariant(
+                    id=2, product_id=1, sku="BS-L", price=Decimal("12.00"), stock=0
+                ),
+                models.ProductVariant(
+                    id=3, product_id=2, sku="RH-M", price=Decimal("20.00"), stock=3
+                ),
+            ]
+        )
+        db.commit()
+        low_stock.rebuild(db)
+    finally:
+        db.close()
+
+
+@pytest.fixture(autouse=True)
+def catalog():
+    models.create_tables(drop=True)
+    _create_catalog()
+    product_cache._variant_products.clear()
+    for namespace in cache.namespaces():
+        cache.invalidate(namespace)
+    yield
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,82 @@
+"""
+Накопительные таблицы продаж при смене статуса заказа: отмена вычитает
+заказ, вывести заказ из отмены нельзя.
+"""
+
+from decimal import Decimal
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import analytics
+import crud
+import models
+import schemas
+from routers import admin
+
+
+def _checkout(db):
+    return crud.create_order(
+        db,
+        schemas.CheckoutForm(
+            name="Ivan",
+            phone="+70000000000",
+            shipping_city="Moscow",
+            cart=[schemas.CartItem(ProductVariantId=1, quantity=2)],
+        ),
+    )
+
+
+def _daily_totals(db):
+    return [
+        (row["orders_count"], row["revenue"])
+        for row in analytics.get_sales_by_day(db)
+        if row["orders_count"]
+    ]
+
+
+def _stock(db):
+    db.expire_all()
+    return db.get(models.ProductVariant, 1).stock
+
+
+def test_cancellation_removes_order_from_rollups(db):
+    order = _checkout(db)
+    assert _daily_totals(db) == [(1, Decimal("20.00"))]
+
+    crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+
+    assert _daily_totals(db) == []
+    assert _stock(db) == 5
+
+
+@pytest.mark.parametrize(
+    "status", [models.OrderStatus.PENDING, models.OrderStatus.CONFIRMED]
+)
+def test_cancelled_order_cannot_be_reopened(db, status):
+    order = _checkout(db)
+    crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+
+    with pytest.raises(crud.OrderStatusConflict):
+        crud.update_order_status(db, order.id, status)
+
+    db.expire_all()
+    assert db.get(models.Order, order.id).status == models.OrderStatus.CANCELLED
+    # Продажи и остатки по-прежнему согласованы
+    assert _daily_totals(db) == []
+    assert _stock(db) == 5
+
+
+def test_reopening_cancelled_order_returns_409(db):
+    order = _checkout(db)
+    crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+    app = FastAPI()
+    app.include_router(admin.router)
+    client = TestClient(app)
+
+    response = client.patch(f"/admin/{order.id}/status", json={"status": "pending"})
+    assert response.status_code == 409
+
+    response = client.patch("/admin/404/status", json={"status": "pending"})
+    assert response.status_code == 404
@@ -0,0 +1,39 @@
+"""Пакетные запросы товаров и вариантов."""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import products, variants
+
+
+def _client():
+    app = FastAPI()
+    app.include_router(products.router)
+    app.include_router(variants.router)
+    return TestClient(app)
+
+
+def test_product_batch():
+    response = _client().get("/products/batch", params={"ids": [2, 404, 1]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [product["id"] for product in body["products"]] == [2, 1]
+    assert body["missing_ids"] == [404]
+    assert response.headers["Cache-Control"] == "no-store"
+
+
+def test_variant_batch():
+    response = _client().get("/variants/batch", params={"ids": [3, 1, 99]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(v["id"], v["stock"]) for v in body["variants"]] == [(3, 3), (1, 5)]
+    assert body["missing_ids"] == [99]
+    assert response.headers["Surrogate-Key"] == "product-2 product-1"
+
+
+def test_variant_batch_limit():
+    response = _client().get("/variants/batch", params={"ids": list(range(1000))})
+
+    assert response.status_code == 400
@@ -0,0 +1,99 @@
+"""
+Шина инвалидации между процессами: запись другого процесса (другой
+_origin) сбрасывает кэши этого процесса после опроса.
+"""
+
+import time
+
+import pytest
+from sqlalchemy import delete
+
+import cache
+import cache_bus
+import models
+
+NAMESPACE = "test-bus"
+
+# Инвалидации пространства имён NAMESPACE в этом процессе
+_received = []
+cache.subscribe(NAMESPACE, _received.append)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+@pytest.fixture
+def poller(db):
+    # Своя запись до запуска: по ней видно, что опрос начался
+    cache_bus.publish(db, NAMESPACE, [1])
+    db.commit()
+    cache_bus.start(interval=0.02)
+    try:
+        assert _wait_for(lambda: cache_bus._poller.last_id > 0)
+        _received.clear()
+        yield cache_bus._poller
+    finally:
+        cache_bus.stop()
+
+
+def _publish_as_other_worker(db, monkeypatch, *records):
+    with monkeypatch.context() as patch:
+        patch.setattr(cache_bus, "_origin", "other-worker")
+        for namespace, keys in records:
+            cache_bus.publish(db, namespace, keys)
+        db.commit()
+
+
+def test_other_worker_invalidation_is_applied(db, poller, monkeypatch):
+    _publish_as_other_worker(db, monkeypatch, (NAMESPACE, [1]))
+
+    assert _wait_for(lambda: _received == [[1]])
+
+
+def test_records_of_one_namespace_are_merged(db, poller, monkeypatch):
+    _publish_as_other_worker(
+        db, monkeypatch, (NAMESPACE, [1]), (NAMESPACE, [2, 1]), ("other", [3])
+    )
+
+    assert _wait_for(lambda: len(_received) == 1)
+    assert sorted(_received[0]) == [1, 2]
+
+
+def test_namespace_wide_record_wins(db, poller, monkeypatch):
+    _publish_as_other_worker(db, monkeypatch, (NAMESPACE, [1]), (NAMESPACE, None))
+
+    assert _wait_for(lambda: _received == [None])
+
+
+def test_own_records_are_skipped(db, poller):
+    cache_bus.publish(db, NAMESPACE, [1])
+    db.commit()
+    last_id = poller.last_id
+
+    # Запись прочитана, но свой процесс сбрасывает кэши сам после коммита
+    assert _wait_for(lambda: poller.last_id > last_id)
+    assert _received == []
+
+
+def test_gap_invalidates_all_namespaces(db, poller, monkeypatch):
+    last_id = poller.last_id
+
+    # Первая новая запись удалена до опроса, как при очистке старых записей
+    monkeypatch.setattr(cache_bus, "_origin", "other-worker")
+    cache_bus.publish(db, "other")
+    cache_bus.publish(db, "other")
+    db.execute(
+        delete(models.CacheInvalidation).where(
+            models.CacheInvalidation.id == last_id + 1
+        )
+    )
+    db.commit()
+
+    # Сбрасываются и пространства имён, которых не было в записях
+    assert _wait_for(lambda: _received == [None])
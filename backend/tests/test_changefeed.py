@@ -0,0 +1,109 @@
+"""Журнал изменений каталога: схлопывание при чтении и compact()."""
+
+from sqlalchemy import func, select, update
+
+import changefeed
+import crud
+import models
+import schemas
+from models import ChangeKind
+
+
+def _record(db, changes):
+    changefeed.record(db, changes)
+    db.commit()
+
+
+def _rows(db):
+    return db.execute(
+        select(
+            models.CatalogChange.product_id,
+            models.CatalogChange.variant_id,
+            models.CatalogChange.kind,
+        ).order_by(models.CatalogChange.id)
+    ).all()
+
+
+def test_get_changes_merges_repeated_changes_of_a_variant(db):
+    _record(db, [(1, 1, ChangeKind.STOCK)])
+    _record(db, [(2, 3, ChangeKind.STOCK)])
+    _record(db, [(1, 1, ChangeKind.PRICE)])
+    _record(db, [(1, 1, ChangeKind.STOCK)])
+
+    page = changefeed.get_changes(db, since=0)
+
+    assert not page["reset_required"]
+    assert page["version"] == changefeed.get_version(db) == 4
+    # Вариант 1 - одна запись со всеми видами изменений, после варианта 3
+    assert [(c["product_id"], c["variant_id"]) for c in page["changes"]] == [
+        (2, 3),
+        (1, 1),
+    ]
+    merged = page["changes"][1]
+    assert merged["kinds"] == [ChangeKind.STOCK, ChangeKind.PRICE]
+    assert merged["version"] == 4
+    assert (merged["stock"], merged["deleted"]) == (5, False)
+
+
+def test_get_changes_returns_current_values_and_pages(db):
+    crud.update_variant(db, 1, schemas.AdminVariantUpdate(stock=9))
+    crud.update_variant(db, 3, schemas.AdminVariantUpdate(stock=1))
+
+    first = changefeed.get_changes(db, since=0, limit=1)
+    assert first["has_more"]
+    assert [c["variant_id"] for c in first["changes"]] == [1]
+    assert first["changes"][0]["stock"] == 9
+
+    second = changefeed.get_changes(db, since=first["version"], limit=1)
+    assert not second["has_more"]
+    assert [(c["variant_id"], c["stock"]) for c in second["changes"]] == [(3, 1)]
+
+    assert changefeed.get_changes(db, since=second["version"])["changes"] == []
+
+
+def test_compact_keeps_only_the_latest_record_per_change(db):
+    for kind in (ChangeKind.STOCK, ChangeKind.STOCK, ChangeKind.PRICE):
+        _record(db, [(1, 1, kind)])
+    _record(db, [(1, 1, ChangeKind.STOCK)])
+    before = changefeed.get_changes(db, since=0)
+
+    collapsed, expired = changefeed.compact(db)
+
+    assert (collapsed, expired) == (2, 0)
+    assert _rows(db) == [(1, 1, ChangeKind.PRICE), (1, 1, ChangeKind.STOCK)]
+    # Клиенту с любой версией достаточно оставшихся записей
+    for since in (0, 2):
+        (after,) = changefeed.get_changes(db, since=since)["changes"]
+        assert set(after.pop("kinds")) == {ChangeKind.STOCK, ChangeKind.PRICE}
+        assert after == {
+            key: value for key, value in before["changes"][0].items() if key != "kinds"
+        }
+
+
+def test_compact_expires_old_records_and_requires_reset(db):
+    _record(db, [(1, 1, ChangeKind.STOCK)])
+    _record(db, [(2, 3, ChangeKind.STOCK)])
+    _record(db, [(1, 2, ChangeKind.STATUS)])
+    db.execute(
+        update(models.CatalogChange)
+        .where(models.CatalogChange.id <= 2)
+        .values(created_at=func.datetime("now", "-10 days"))
+    )
+    db.commit()
+
+    collapsed, expired = changefeed.compact(db, retention_days=5)
+
+    assert (collapsed, expired) == (0, 2)
+    assert _rows(db) == [(1, 2, ChangeKind.STATUS)]
+    # Версия не уменьшается, хотя последние удаленные записи были старше
+    assert changefeed.get_version(db) == 3
+
+    stale = changefeed.get_changes(db, since=1)
+    assert stale["reset_required"]
+    assert stale["version"] == 3
+    assert changefeed.get_changed_products(db, since=1) is None
+
+    current = changefeed.get_changes(db, since=2)
+    assert not current["reset_required"]
+    assert [c["variant_id"] for c in current["changes"]] == [2]
+    assert changefeed.get_changed_products(db, since=2) == {1}
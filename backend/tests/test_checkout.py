@@ -0,0 +1,142 @@
+"""
+Двухфазное оформление заказа: резерв остатков в базе каталога, заказ в
+базе заказов, возврат остатков при сбое и их снятие очисткой резервов.
+"""
+
+import logging
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError
+
+import analytics
+import crud
+import models
+import orders_db
+import schemas
+
+
+def _checkout(db, quantity=2):
+    return crud.create_order(
+        db,
+        schemas.CheckoutForm(
+            name="Ivan",
+            phone="+70000000000",
+            shipping_city="Moscow",
+            cart=[schemas.CartItem(ProductVariantId=1, quantity=quantity)],
+        ),
+    )
+
+
+def _stock(db, variant_id=1):
+    db.expire_all()
+    return db.get(models.ProductVariant, variant_id).stock
+
+
+def _reservation_ids(db):
+    return db.scalars(select(models.StockReservation.id)).all()
+
+
+def _age(db, model, seconds=3600):
+    db.execute(
+        update(model).values(created_at=func.datetime("now", f"-{seconds} seconds"))
+    )
+    db.commit()
+
+
+def _fail_second_phase(*args, **kwargs):
+    raise RuntimeError("orders database is unavailable")
+
+
+def test_checkout_reserves_stock_and_creates_order(db):
+    order = _checkout(db)
+
+    assert _stock(db) == 3
+    assert order.reservation_id in _reservation_ids(db)
+    assert order.status == models.OrderStatus.PENDING
+
+
+def test_sweeper_removes_completed_reservations(db):
+    order = _checkout(db)
+    _age(db, models.StockReservation)
+
+    assert orders_db.sweep_reservations(db) == (1, 0)
+
+    assert _reservation_ids(db) == []
+    assert _stock(db) == 3
+    assert db.get(models.Order, order.id) is not None
+
+
+def test_second_phase_failure_releases_stock(db, monkeypatch):
+    monkeypatch.setattr(analytics, "apply_order", _fail_second_phase)
+
+    with pytest.raises(ValueError):
+        _checkout(db)
+
+    assert _stock(db) == 5
+    assert _reservation_ids(db) == []
+    assert db.scalar(select(func.count(models.Order.id))) == 0
+
+
+def test_sweeper_releases_reservation_left_by_crash(db, monkeypatch):
+    # Процесс "упал" между фазами: заказ не записан, резерв не снят
+    monkeypatch.setattr(analytics, "apply_order", _fail_second_phase)
+    monkeypatch.setattr(crud, "release_stock_reservation", lambda db, _id: False)
+    with pytest.raises(ValueError):
+        _checkout(db)
+    monkeypatch.undo()
+    assert _stock(db) == 3
+
+    # Свежий резерв может принадлежать заказу, который еще оформляется
+    assert orders_db.sweep_reservations(db) == (0, 0)
+    assert _stock(db) == 3
+
+    _age(db, models.StockReservation)
+    assert orders_db.sweep_reservations(db) == (0, 1)
+
+    assert _stock(db) == 5
+    assert _reservation_ids(db) == []
+
+
+def test_cancellation_returns_stock(db):
+    order = _checkout(db)
+
+    crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+    assert _stock(db) == 5
+
+    # Повторная отмена не возвращает остатки второй раз
+    crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+    assert _stock(db) == 5
+
+
+def test_sweeper_finishes_interrupted_cancellation(db, monkeypatch):
+    order = _checkout(db)
+    # Статус сменился, а возврат остатков не выполнен
+    monkeypatch.setattr(crud, "apply_stock_return", lambda db, _id: False)
+    crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+    monkeypatch.undo()
+    assert _stock(db) == 3
+
+    _age(db, models.StockReturn)
+    assert orders_db.sweep_stock_returns(db) == (0, 1)
+
+    assert _stock(db) == 5
+    assert db.scalar(select(func.count(models.StockReturn.id))) == 0
+
+
+def test_busy_catalog_defers_stock_return(db, monkeypatch, caplog):
+    order = _checkout(db)
+
+    def busy(db, _id):
+        raise OperationalError("UPDATE", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(crud, "apply_stock_return", busy)
+    with caplog.at_level(logging.WARNING, logger="crud"):
+        crud.update_order_status(db, order.id, models.OrderStatus.CANCELLED)
+    monkeypatch.undo()
+
+    assert f"Возврат остатков заказа {order.id} отложен" in caplog.text
+    assert _stock(db) == 3
+    _age(db, models.StockReturn)
+    assert orders_db.sweep_stock_returns(db) == (0, 1)
+    assert _stock(db) == 5
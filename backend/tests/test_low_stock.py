@@ -0,0 +1,66 @@
+"""
+Список на дозаказ: вход и выход вариантов, long-poll без удержания
+соединения и обновление существующей базы до порогов вариантов.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+import crud
+import database
+import low_stock
+import models
+import schemas
+from routers import admin
+
+
+def test_variant_enters_and_leaves_the_list(db):
+    version = low_stock.get_version(db)
+
+    crud.update_variant(db, 1, schemas.AdminVariantUpdate(reorder_threshold=5))
+    assert 1 in {v["variant_id"] for v in low_stock.get_low_stock_variants(db)}
+    assert low_stock.get_version(db) > version
+
+    crud.update_variant(db, 1, schemas.AdminVariantUpdate(stock=6))
+    assert 1 not in {v["variant_id"] for v in low_stock.get_low_stock_variants(db)}
+
+
+def test_add_missing_columns_upgrades_existing_database(db):
+    # База, созданная до появления порогов
+    with database.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "ALTER TABLE product_variants DROP COLUMN reorder_threshold"
+        )
+
+    assert models.add_missing_columns() == ["product_variants.reorder_threshold"]
+    assert models.add_missing_columns() == []
+    assert db.scalars(select(models.ProductVariant.reorder_threshold)).all() == [
+        0,
+        0,
+        0,
+    ]
+
+
+def test_long_poll_waits_without_a_connection(db):
+    app = FastAPI()
+    app.include_router(admin.router)
+    client = TestClient(app)
+    version = client.get("/admin/low-stock").json()["version"]
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        waiting = pool.submit(
+            client.get, "/admin/low-stock", params={"version": version, "timeout": 5}
+        )
+        time.sleep(0.2)
+        assert not waiting.done()
+        assert database.read_engine.pool.checkedout() == 0
+
+        crud.update_variant(db, 1, schemas.AdminVariantUpdate(reorder_threshold=5))
+        response = waiting.result(timeout=5).json()
+
+    assert response["version"] != version
+    assert 1 in {v["variant_id"] for v in response["variants"]}
@@ -0,0 +1,52 @@
+"""Сообщения потока событий заказов для админки."""
+
+import json
+
+from sqlalchemy import event
+
+import crud
+import database
+import models
+import order_events
+import schemas
+
+
+def _checkout(db):
+    return crud.create_order(
+        db,
+        schemas.CheckoutForm(
+            name="Ivan",
+            phone="+70000000000",
+            shipping_city="Moscow",
+            cart=[schemas.CartItem(ProductVariantId=1, quantity=1)],
+        ),
+    )
+
+
+def test_messages_are_loaded_without_order_items(db):
+    orders = [_checkout(db) for _ in range(3)]
+    for order in orders:
+        crud.update_order_status(db, order.id, models.OrderStatus.CONFIRMED)
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    engines = (database.read_engine, database.read_orders_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", count)
+    try:
+        messages = order_events._load_messages(0, 100)
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", count)
+
+    # События и заказы - по одному запросу на пачку
+    assert len(statements) == 2
+    assert [message_id for message_id, _ in messages] == list(range(1, 7))
+    first = messages[0][1]
+    assert "event: order_created" in first
+    data = json.loads(first.split("data: ", 1)[1])
+    assert data["id"] == orders[0].id
+    assert "items" not in data
@@ -0,0 +1,114 @@
+"""
+Кэш карточек товаров: остатки отдельно от статической части, защита от
+записи устаревших данных и смена набора вариантов.
+"""
+
+import json
+from decimal import Decimal
+
+import cache
+import crud
+import models
+import product_cache
+import schemas
+
+
+def _detail(db, product_id=1):
+    payload = product_cache.get_product_detail(db, product_id=product_id)
+    return json.loads(payload.body)
+
+
+def _variants(db, product_id=1):
+    return {v["id"]: v for v in _detail(db, product_id)["variants"]}
+
+
+def _count_calls(monkeypatch, module, name):
+    calls = []
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(kwargs)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, wrapper)
+    return calls
+
+
+def test_stock_update_does_not_reserialize(db, monkeypatch):
+    serialized = _count_calls(monkeypatch, product_cache, "_serialize_static")
+    assert _variants(db)[1]["stock"] == 5
+
+    crud.update_variant(db, 1, schemas.AdminVariantUpdate(stock=9))
+
+    assert _variants(db)[1]["stock"] == 9
+    assert len(serialized) == 1
+
+
+def test_price_update_reserializes(db, monkeypatch):
+    serialized = _count_calls(monkeypatch, product_cache, "_serialize_static")
+    _detail(db)
+
+    crud.update_variant(db, 1, schemas.AdminVariantUpdate(price=Decimal("11.50")))
+
+    assert Decimal(str(_variants(db)[1]["price"])) == Decimal("11.50")
+    assert len(serialized) == 2
+
+
+def test_repeated_reads_share_the_body(db):
+    first = product_cache.get_product_detail(db, product_id=1)
+
+    assert product_cache.get_product_detail(db, product_id=1) is first
+    assert product_cache.get_product_detail(db, product_id=404) is None
+
+
+def test_invalidation_during_load_is_not_stored(db, monkeypatch):
+    loads = []
+    original = crud.get_products_by_ids
+
+    def load_then_change(*args, **kwargs):
+        loads.append(args)
+        result = original(*args, **kwargs)
+        # Изменение закоммичено, пока загруженные данные еще не сохранены
+        if len(loads) == 1:
+            cache.invalidate("product_content", [1])
+            cache.invalidate("products", [1])
+        return result
+
+    monkeypatch.setattr(crud, "get_products_by_ids", load_then_change)
+
+    _detail(db)
+    _detail(db)
+    assert len(loads) == 2
+    _detail(db)
+    assert len(loads) == 2
+
+
+def test_new_variant_with_stock_only_invalidation(db):
+    assert set(_variants(db)) == {1, 2}
+
+    db.add(
+        models.ProductVariant(
+            id=4, product_id=1, sku="BS-XL", price=Decimal("13.00"), stock=2
+        )
+    )
+    db.commit()
+    cache.invalidate("products", [1])
+
+    variants = _variants(db)
+    assert set(variants) == {1, 2, 4}
+    assert variants[4]["stock"] == 2
+
+
+def test_batches_reuse_the_detail_cache(db, monkeypatch):
+    _detail(db)
+    loads = _count_calls(monkeypatch, crud, "get_products_by_ids")
+
+    products, missing = product_cache.get_product_details(db, [1, 2, 1, 404])
+    assert [product_id for product_id, _ in products] == [1, 2]
+    assert missing == [404]
+    # Из базы загружены только товары, которых не было в кэше
+    assert [call["product_ids"] for call in loads] == [[2, 404]]
+
+    variants, missing = product_cache.get_cart_variants(db, [3, 1, 99])
+    assert [json.loads(body)["id"] for _, body in variants] == [3, 1]
+    assert missing == [99]
@@ -0,0 +1,159 @@
+"""
+Объединение одинаковых одновременных вызовов: одно выполнение на ключ,
+общий результат или ошибка, выполнение ожидающим после таймаута.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import singleflight
+
+_names = itertools.count()
+
+
+def _group(timeout=5.0):
+    return singleflight.Group(f"test-{next(_names)}", timeout=timeout)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+class _Gate:
+    """fn, которая считает вызовы и ждет release()."""
+
+    def __init__(self, result="value", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self._released = threading.Event()
+
+    def release(self):
+        self._released.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self._released.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_share_one_execution():
+    group = _group()
+    fn = _Gate(result=object())
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(group.do, "key", fn) for _ in range(4)]
+        _wait_for(lambda: group.stats()["coalesced"] == 3)
+        fn.release()
+        results = [future.result() for future in futures]
+
+    assert fn.calls == 1
+    assert all(result is fn.result for result in results)
+    assert group.stats() == {
+        "in_flight": 0,
+        "executions": 1,
+        "coalesced": 3,
+        "timeouts": 0,
+    }
+
+
+def test_different_keys_are_not_coalesced():
+    group = _group()
+
+    assert group.do("a", lambda: 1) == 1
+    assert group.do("b", lambda: 2) == 2
+    assert group.stats()["executions"] == 2
+
+
+def test_error_is_shared_with_waiters():
+    group = _group()
+    fn = _Gate(error=LookupError("boom"))
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(group.do, "key", fn) for _ in range(2)]
+        _wait_for(lambda: group.stats()["coalesced"] == 1)
+        fn.release()
+        for future in futures:
+            with pytest.raises(LookupError):
+                future.result()
+
+    assert fn.calls == 1
+    # Ошибка не запоминается: следующий вызов выполняется заново
+    assert group.do("key", lambda: "retry") == "retry"
+
+
+def test_waiter_runs_fn_itself_after_timeout():
+    group = _group(timeout=0.05)
+    leader = _Gate()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(group.do, "key", leader)
+        assert leader.started.wait(2)
+
+        assert group.do("key", lambda: "own") == "own"
+        assert group.stats()["timeouts"] == 1
+
+        leader.release()
+        assert future.result() == "value"
+
+
+def test_forget_starts_a_new_execution():
+    group = _group()
+    old = _Gate(result="old")
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(group.do, "key", old)
+        assert old.started.wait(2)
+
+        group.forget()
+        assert group.do("key", lambda: "new") == "new"
+
+        old.release()
+        assert future.result() == "old"
+    assert group.stats()["executions"] == 2
+
+
+def test_async_waiter_shares_result_with_thread_leader():
+    group = _group()
+    fn = _Gate(result="shared")
+
+    async def waiter():
+        return await group.do_async("key", lambda: "own")
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(group.do, "key", fn)
+        assert fn.started.wait(2)
+        threading.Timer(0.05, fn.release).start()
+
+        assert asyncio.run(waiter()) == "shared"
+        assert future.result() == "shared"
+
+    assert fn.calls == 1
+    assert group.stats()["coalesced"] == 1
+
+
+def test_async_leader_shares_result_with_async_waiters():
+    group = _group()
+    fn = _Gate(result="shared")
+
+    async def main():
+        tasks = [asyncio.create_task(group.do_async("key", fn)) for _ in range(3)]
+        while group.stats()["coalesced"] < 2:
+            await asyncio.sleep(0.005)
+        fn.release()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == ["shared"] * 3
+    assert fn.calls == 1
@@ -0,0 +1,101 @@
+"""
+Ключи ответов каталога и очистка кэширующего прокси по ним после
+изменения товаров (прокси заменяет purge_recorder).
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Response
+
+import crud
+import purge_recorder
+import schemas
+import surrogate
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    server = purge_recorder.PurgeRecorder(0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    monkeypatch.setattr(surrogate, "PURGE_URL", f"http://{host}:{port}/")
+    monkeypatch.setattr(surrogate, "PURGE_INTERVAL", 0.01)
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _purged_keys(recorder, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with recorder.lock:
+            if recorder.purges:
+                return set().union(*recorder.purges)
+        time.sleep(0.01)
+    return set()
+
+
+def test_listing_keys(db):
+    products = [
+        SimpleNamespace(id=1, brand_id=1),
+        SimpleNamespace(id=2, brand_id=None),
+    ]
+
+    assert surrogate.listing_keys(db, "shirts", products) == (
+        "category-2",
+        "product-1",
+        "brand-1",
+        "product-2",
+    )
+    assert surrogate.listing_keys(db, None, []) == ("catalog",)
+    assert surrogate.listing_keys(db, "unknown", []) == ("catalog",)
+
+
+def test_tag_sets_keys_and_cache_control():
+    response = surrogate.tag(Response(), ["product-1", "brand-1", "product-1"])
+
+    assert response.headers["Surrogate-Key"] == "product-1 brand-1"
+    assert response.headers["Cache-Tag"] == "product-1,brand-1"
+    assert response.headers["Cache-Control"] == surrogate.CACHEABLE
+
+    response = surrogate.tag(Response(), ["catalog"], cacheable=False)
+    assert response.headers["Cache-Control"] == surrogate.NOT_CACHEABLE
+
+
+def test_purge_includes_brand_and_category_ancestors(recorder):
+    surrogate.purge_products([1])
+
+    assert _purged_keys(recorder) == {
+        "catalog",
+        "product-1",
+        "brand-1",
+        "category-2",
+        "category-1",
+    }
+
+
+def test_variant_update_purges_its_product(db, recorder):
+    crud.update_variant(db, 3, schemas.AdminVariantUpdate(stock=1))
+
+    assert _purged_keys(recorder) == {
+        "catalog",
+        "product-2",
+        "brand-1",
+        "category-1",
+    }
+
+
+def test_purge_is_disabled_without_url(monkeypatch):
+    monkeypatch.setattr(surrogate, "PURGE_URL", "")
+    pending = set(surrogate._purger.pending)
+
+    surrogate.purge_products([1])
+
+    assert surrogate._purger.pending == pending
+    assert surrogate.get_stats()["enabled"] is False
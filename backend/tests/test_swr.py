@@ -0,0 +1,123 @@
+"""
+Кэш stale-while-revalidate: свежие записи до soft_ttl, устаревшие с
+фоновым обновлением до hard_ttl, синхронная загрузка после него.
+"""
+
+import itertools
+import time
+
+import pytest
+
+import cache
+import swr
+
+_names = itertools.count()
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Loader:
+    """Загрузка, возвращающая номер вызова."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, db):
+        self.calls += 1
+        return self.calls
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(swr, "monotonic", clock)
+    monkeypatch.setattr(cache, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def swr_cache():
+    name = f"test-swr-{next(_names)}"
+    return swr.SWRCache(name, soft_ttl=10, hard_ttl=60, namespace=name)
+
+
+def _wait_for_refreshes(swr_cache, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while swr_cache.stats()["refreshes"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_fresh_within_soft_ttl(db, clock, swr_cache):
+    load = _Loader()
+
+    assert swr_cache.get(db, "key", load) == (1, True)
+    clock.now += 9
+    assert swr_cache.get(db, "key", load) == (1, True)
+    assert load.calls == 1
+
+
+def test_stale_after_soft_ttl_is_refreshed_in_background(db, clock, swr_cache):
+    load = _Loader()
+    swr_cache.get(db, "key", load)
+
+    clock.now += 11
+    assert swr_cache.get(db, "key", load) == (1, False)
+    _wait_for_refreshes(swr_cache, 1)
+
+    assert swr_cache.get(db, "key", load) == (2, True)
+    assert load.calls == 2
+    assert swr_cache.stats()["stale_hits"] == 1
+
+
+def test_expired_after_hard_ttl_is_loaded_synchronously(db, clock, swr_cache):
+    load = _Loader()
+    swr_cache.get(db, "key", load)
+
+    clock.now += 61
+    assert swr_cache.get(db, "key", load) == (2, True)
+    assert swr_cache.stats()["stale_hits"] == 0
+
+
+def test_namespace_invalidation_marks_entries_stale(db, clock, swr_cache):
+    load = _Loader()
+    swr_cache.get(db, "key", load)
+
+    cache.invalidate(swr_cache.name)
+    assert swr_cache.get(db, "key", load) == (1, False)
+    _wait_for_refreshes(swr_cache, 1)
+
+    assert swr_cache.get(db, "key", load) == (2, True)
+
+
+def test_key_invalidation_removes_entry(db, clock, swr_cache):
+    load = _Loader()
+    swr_cache.get(db, "key", load)
+    swr_cache.get(db, "other", load)
+
+    cache.invalidate(swr_cache.name, ["key"])
+
+    assert swr_cache.get(db, "key", load) == (3, True)
+    assert swr_cache.get(db, "other", load) == (2, True)
+
+
+def test_failed_refresh_keeps_stale_entry(db, clock, swr_cache):
+    swr_cache.get(db, "key", lambda db: "old")
+
+    def fail(db):
+        raise RuntimeError("database is unavailable")
+
+    clock.now += 11
+    assert swr_cache.get(db, "key", fail) == ("old", False)
+    deadline = time.monotonic() + 2
+    while swr_cache.stats()["refresh_errors"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+    assert swr_cache.get(db, "key", lambda db: "new") == ("old", False)
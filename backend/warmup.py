@@ -0,0 +1,153 @@
+"""
+Прогрев воркера после запуска: соединения с базой, страницы горячих
+таблиц и индексов, кэш скомпилированных запросов SQLAlchemy, валидаторы
+pydantic и кэши приложения: первые страницы и фильтры категорий
+прогреваются через listings, карточки - через product_cache, вместе
+со сжатыми вариантами ответов; а также подсказки и список остатков.
+
+Запускается из lifespan в фоне; /ready отвечает 503, пока прогрев не
+закончится. Бюджет времени - WARMUP_BUDGET секунд (0 отключает прогрев),
+шаги, не уложившиеся в бюджет, пропускаются. Прогреваются корневые
+категории и WARMUP_CATEGORIES самых наполненных.
+"""
+
+import json
+import os
+from time import monotonic
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+import compression
+import listings
+import low_stock
+import models
+import product_cache
+import suggest
+from database import SessionLocal, engine, read_engine, read_orders_engine
+
+WARMUP_BUDGET = float(os.environ.get("WARMUP_BUDGET", "15"))
+WARMUP_CATEGORIES = int(os.environ.get("WARMUP_CATEGORIES", "10"))
+
+# Сортировки витрины, для каждой строится своя форма запроса
+_SORTS = (None, "price_asc", "price_desc", "name_asc")
+
+_state: Dict[str, Any] = {
+    "ready": False,
+    "elapsed_ms": None,
+    "steps": [],
+    "skipped": [],
+    "errors": [],
+}
+
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+
+def get_state() -> Dict[str, Any]:
+    return dict(_state)
+
+
+def _warm_connections(db: Session) -> None:
+    # У сессии две базы: текстовому SQL база указывается явно
+    db.execute(text("SELECT 1"), bind_arguments={"bind": engine})
+    db.execute(select(func.count()).select_from(models.Order))
+    for read_only_engine in (read_engine, read_orders_engine):
+        with read_only_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+
+def _warm_indexes(db: Session) -> None:
+    # Проходы по индексам, которые используют листинг, поиск и карточка товара
+    db.execute(
+        select(func.count())
+        .select_from(models.ProductVariant)
+        .where(
+            models.ProductVariant.status == models.VariantStatus.ACTIVE,
+            models.ProductVariant.stock > 0,
+        )
+    )
+    db.execute(select(func.count(models.VariantAttribute.variant_id)))
+    db.execute(select(func.count(models.ProductImage.id)))
+    db.execute(
+        text("SELECT count(*) FROM products_fts"), bind_arguments={"bind": engine}
+    )
+
+
+def _warm(payload: compression.Precompressed) -> None:
+    # Сжатый вариант, который выберет большинство клиентов
+    payload.encode(compression.AVAILABLE_ENCODINGS[0])
+
+
+def _warm_category(db: Session, slug: str) -> None:
+    # Те же записи кэшей, что заполняют запросы витрины
+    for sort_by in _SORTS:
+        page = listings.get_listing(db, category_slug=slug, sort_by=sort_by)
+        _warm(page.value)
+    _warm(listings.get_filters(db, category_slug=slug).value)
+
+    products = json.loads(page.value.body)["products"]
+    if products:
+        detail = product_cache.get_product_detail(db, product_id=products[0]["id"])
+        if detail is not None:
+            _warm(detail)
+
+
+def _top_category_slugs(db: Session) -> List[str]:
+    roots = db.scalars(
+        select(models.Category.slug)
+        .where(models.Category.parent_id.is_(None))
+        .order_by(models.Category.id)
+    ).all()
+    busiest = db.scalars(
+        select(models.Category.slug)
+        .join(models.Product, models.Product.category_id == models.Category.id)
+        .group_by(models.Category.id)
+        .order_by(func.count(models.Product.id).desc())
+        .limit(WARMUP_CATEGORIES)
+    ).all()
+    return list(dict.fromkeys([*roots, *busiest]))
+
+
+def _steps(db: Session) -> Iterator[Tuple[str, Callable[[], None]]]:
+    yield "connections", lambda: _warm_connections(db)
+    yield "indexes", lambda: _warm_indexes(db)
+    for slug in _top_category_slugs(db):
+        yield f"category:{slug}", lambda slug=slug: _warm_category(db, slug)
+    yield "suggest", lambda: suggest.suggest(db, "a")
+    yield "low_stock", lambda: low_stock.get_low_stock_variants(db)
+
+
+def run(budget: float = WARMUP_BUDGET) -> Dict[str, Any]:
+    """
+    Выполняет шаги прогрева в пределах бюджета и отмечает воркер готовым.
+    Ошибка шага не блокирует готовность - она попадает в errors.
+    """
+    started = monotonic()
+    deadline = started + budget
+    db = SessionLocal()
+    try:
+        if budget > 0:
+            for name, step in _steps(db):
+                if monotonic() >= deadline:
+                    _state["skipped"].append(name)
+                    continue
+                step_started = monotonic()
+                try:
+                    step()
+                except Exception as e:
+                    db.rollback()
+                    _state["errors"].append(f"{name}: {e}")
+                    continue
+                _state["steps"].append(
+                    {"name": name, "ms": round((monotonic() - step_started) * 1000, 1)}
+                )
+    except Exception as e:
+        _state["errors"].append(str(e))
+    finally:
+        db.close()
+        _state["elapsed_ms"] = round((monotonic() - started) * 1000, 1)
+        _state["ready"] = True
+    return get_state()